@@ -14,8 +14,10 @@ from django import forms
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from ensembl.production.metadata.admin.filters import *
+from ensembl.production.metadata.admin.inlines import PaginatedInline, PaginatedInlinesMixin
+from ensembl.production.metadata.admin.search import IndexedSearchMixin
 from .models import Attribute, AssemblySequence, Assembly, EnsemblRelease, Organism, Dataset, OrganismGroup, Genome, \
-    DatasetAttribute
+    DatasetAttribute, SearchDocument
 from django.utils.html import format_html, format_html_join
 from django.contrib import admin, messages
 
@@ -51,6 +53,18 @@ class MetadataInline(InlineModelAdmin):
     def has_view_permission(self, request, obj=None):
         return True
 
+    list_select_related = ()
+
+    def get_queryset(self, request):
+        # FKs displayed in each row, fetched with the rows
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        # evaluate the choices once for all the rows, instead of one query per row
+        formfield.choices = list(formfield.choices)
+        return formfield
+
     def get_readonly_fields(self, request, obj=None):
         if not request.user.is_superuser:
             return self.fields
@@ -61,6 +75,7 @@ class GenomeInLine(MetadataInline, admin.TabularInline):
     model = Genome
     fields = ['display_genome_uuid', 'organism', 'production_name', 'is_best']  # Specify the fields to display
     readonly_fields = ['display_genome_uuid']
+    list_select_related = ['organism']
     can_delete = False
     extra = 0
 
@@ -78,38 +93,37 @@ class GenomeInLine(MetadataInline, admin.TabularInline):
         return formset
 
 
-class DAttributeInLine(MetadataInline, admin.TabularInline):
-    # TODO We might nee to remove some linking, too many request generated. Page already takes around 1s to load with
-    #  only 241 genomes
+class DAttributeInLine(PaginatedInline):
     model = DatasetAttribute
+    fk_name = 'attribute'
+    verbose_name_plural = 'Dataset attributes'
     fields = ['display_dataset_uuid', 'display_dataset_source_name', 'value']  # Updated fields list
-    readonly_fields = ['display_dataset_uuid', 'display_dataset_source_name']  # Updated readonly fields
-    can_delete = False
-    extra = 0
+    search_fields = ['dataset__dataset_uuid', 'dataset__dataset_source__name', 'value']
+    list_select_related = ['dataset__dataset_source']
+    ordering = ['dataset__dataset_uuid']
 
     def display_dataset_uuid(self, obj):
         url = reverse('admin:ensembl_metadata_dataset_change', args=[obj.dataset.pk])
         return format_html("<a href='{}'>{}</a>", url, obj.dataset.dataset_uuid)
 
     display_dataset_uuid.short_description = 'Dataset UUID'
+    display_dataset_uuid.admin_order_field = 'dataset__dataset_uuid'
 
     def display_dataset_source_name(self, obj):
         url = reverse('admin:ensembl_metadata_datasetsource_change', args=[obj.dataset.dataset_source.pk])
         return format_html("<a href='{}'>{}</a>", url, obj.dataset.dataset_source.name)
 
     display_dataset_source_name.short_description = 'Dataset Source Name'
-
-    def has_change_permission(self, request, obj=None):
-        return False
+    display_dataset_source_name.admin_order_field = 'dataset__dataset_source__name'
 
 
 @admin.register(Attribute)
-class AttributeAdmin(AdminMetadata, admin.ModelAdmin):
+class AttributeAdmin(PaginatedInlinesMixin, AdminMetadata, admin.ModelAdmin):
     search_fields = ('name', 'type',)
     list_display = ('name', 'label', 'description', 'type')
     list_per_page = 30
     ordering = ('name',)
-    inlines = (DAttributeInLine,)
+    paginated_inlines = (DAttributeInLine,)
 
 
 @admin.register(AssemblySequence)
@@ -122,17 +136,14 @@ class AssemblySequenceAdmin(AdminMetadata, admin.ModelAdmin):
     list_display = ['name', 'accession', 'length', 'chromosomal', 'md5', 'sha512t24u']
     search_fields = ['name', 'accession', 'md5', 'sha512t24u']
     list_per_page = 30
-    object_id = None
 
     def has_delete_permission(self, request, obj=None):
         return request.user.is_superuser
 
-    def change_view(self, request, object_id, form_url='', extra_context=None):
-        self.object_id = object_id
-        return super().change_view(request, object_id, form_url, extra_context)
-
     def get_queryset(self, request):
-        if not (request.GET.get('assembly__assembly_id__exact') or self.object_id):
+        # only the changelist lists sequences, the other views get them by primary key
+        is_changelist = request.resolver_match and request.resolver_match.url_name.endswith('_changelist')
+        if is_changelist and not request.GET.get('assembly__assembly_id__exact'):
             messages.warning(request, "Please Filter per Assembly first.")
             return AssemblySequence.objects.none()
         else:
@@ -174,93 +185,89 @@ class AssemblyAdmin(AdminMetadata, admin.ModelAdmin):
 
 
 # #####RELEASE ADMIN PAGE#####
-class GenomeReleaseInLine(MetadataInline, admin.TabularInline):
+class GenomeReleaseInLine(PaginatedInline):
     model = GenomeRelease
-    verbose_name = 'Genome in Release'
+    fk_name = 'release'
     verbose_name_plural = 'Genomes in Release'
     fields = ['genome_genome', 'genome_assembly', 'genome_organism', 'is_current']
-    readonly_fields = ['genome_genome', 'genome_assembly', 'genome_organism', 'is_current']
-    can_delete = False
-    can_update = False
-    extra = 0
+    search_fields = ['genome__genome_uuid', 'genome__production_name', 'genome__assembly__accession',
+                     'genome__organism__scientific_name']
+    list_select_related = ['genome__assembly', 'genome__organism']
     ordering = ['genome__genome_uuid']
 
-    def has_add_permission(self, request, obj):
-        return False
-
     def genome_genome(self, obj):
         return display_genome_uuid(obj.genome)
 
     genome_genome.short_description = "Genome"
+    genome_genome.admin_order_field = 'genome__genome_uuid'
 
     def genome_assembly(self, obj):
         url_view = reverse('admin:ensembl_metadata_assembly_change',
                            args=(obj.genome.assembly.assembly_id,))
-        return mark_safe(u"<a href='" + url_view + "'>" + obj.genome.assembly.accession + "</a>")
+        return format_html("<a href='{}'>{}</a>", url_view, obj.genome.assembly.accession)
 
     genome_assembly.short_description = "Assembly"
+    genome_assembly.admin_order_field = 'genome__assembly__accession'
 
     def genome_organism(self, obj):
-        # return obj.genome.organism.biosample_id
         url_view = reverse('admin:ensembl_metadata_organism_change',
                            args=(obj.genome.organism.organism_id,))
-        return mark_safe(f"<a href='{url_view}'>{obj.genome.organism.display_name}</a>")
+        return format_html("<a href='{}'>{}</a>", url_view, obj.genome.organism)
 
     genome_organism.short_description = "Organism"
+    genome_organism.admin_order_field = 'genome__organism__scientific_name'
 
 
-class ReleaseDatasetInline(MetadataInline, admin.TabularInline):
+class ReleaseDatasetInline(PaginatedInline):
     model = GenomeDataset
-    verbose_name = 'Dataset in Release'
+    fk_name = 'release'
     verbose_name_plural = 'Datasets in Release'
     fields = ['dataset_uuid', 'genome_uuid', 'dataset_topic', 'dataset_status']
-    readonly_fields = ['dataset_uuid', 'genome_uuid', 'dataset_topic', 'dataset_status']
-    can_delete = False
-    can_update = False
-    extra = 0
+    search_fields = ['dataset__dataset_uuid', 'dataset__name', 'genome__genome_uuid', 'dataset__dataset_type__topic']
+    list_select_related = ['dataset__dataset_type', 'genome']
     ordering = ['genome__genome_uuid', 'dataset__name']
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
+    def get_queryset(self, request, obj):
+        qs = super().get_queryset(request, obj)
         if not request.user.is_superuser:
             qs = qs.filter(dataset__parent__isnull=True)
-        qs = qs.prefetch_related('dataset', 'genome', 'dataset__dataset_type')
         return qs
 
-    def has_add_permission(self, request, obj):
-        return False
-
     def dataset_uuid(self, obj):
         url = reverse('admin:ensembl_metadata_dataset_change', args=[obj.dataset.pk])
         return format_html("<a href='{}'>{}</a>", url, obj.dataset.dataset_uuid)
 
     dataset_uuid.short_description = "Dataset uuid"
+    dataset_uuid.admin_order_field = 'dataset__dataset_uuid'
 
     def genome_uuid(self, obj):
         return display_genome_uuid(obj.genome)
 
     genome_uuid.short_description = "Genome uuid"
+    genome_uuid.admin_order_field = 'genome__genome_uuid'
 
     def dataset_topic(self, obj):
         return obj.dataset.dataset_type.topic
 
     dataset_topic.short_description = "Dataset topic"
+    dataset_topic.admin_order_field = 'dataset__dataset_type__topic'
 
     def dataset_status(self, obj):
         return obj.dataset.status
 
     dataset_status.short_description = "Dataset status"
+    dataset_status.admin_order_field = 'dataset__status'
 
 
 @admin.register(EnsemblRelease)
-class ReleaseAdmin(AdminMetadata, admin.ModelAdmin):
+class ReleaseAdmin(PaginatedInlinesMixin, AdminMetadata, admin.ModelAdmin):
     # TODO add message for inconsistency detected in metadata release
     fields = ('get_status_display', 'release_date', 'release_type', 'is_current', 'label')
     readonly_fields = ('get_status_display', 'release_date', 'site', 'release_type', 'is_current')
     search_fields = ('version',)
     list_filter = ('is_current', 'release_type', 'site')
     list_display = ('version', 'release_date', 'label', 'release_type', 'is_current', 'get_status_display')
-    inlines = (GenomeReleaseInLine, ReleaseDatasetInline)
+    paginated_inlines = (GenomeReleaseInLine, ReleaseDatasetInline)
 
     def get_status_display(self, obj):
         return obj.status
@@ -288,6 +295,7 @@ class OrganismGroupMemberInLine(MetadataInline, admin.TabularInline):
     verbose_name_plural = "Organisms Groups"
     fields = ['display_organism_group_name', 'display_organism_group_type', 'is_reference']  # Updated fields list
     readonly_fields = ['display_organism_group_name', 'display_organism_group_type']  # Updated readonly fields
+    list_select_related = ['organism_group']
     can_delete = False
     can_update = False
 
@@ -353,6 +361,7 @@ class DatasetAttributeInline(MetadataInline, admin.TabularInline):
     model = DatasetAttribute
     fields = ['attribute', 'value']
     ordering = ['attribute']
+    list_select_related = ['attribute']
     filter = ''
 
     def has_change_permission(self, request, obj=None):
@@ -390,6 +399,7 @@ class DatasetGenomeInline(MetadataInline, admin.TabularInline):
     model = GenomeDataset
     fields = ['genome_uuid', 'release_version', 'is_current']
     readonly_fields = ['genome_uuid', 'release_version']
+    list_select_related = ['genome', 'release']
     extra = 0
     can_update = False
     can_delete = False
@@ -402,7 +412,8 @@ class DatasetGenomeInline(MetadataInline, admin.TabularInline):
 
 
 @admin.register(Dataset)
-class DatasetAdmin(AdminMetadata, admin.ModelAdmin):
+class DatasetAdmin(IndexedSearchMixin, AdminMetadata, admin.ModelAdmin):
+    search_kind = SearchDocument.Kind.DATASET
     fields = ('name', 'version', 'dataset_type', 'dataset_source', 'label', 'status_display')
     search_fields = ('dataset_uuid', 'genomes__genome_uuid', 'genomes__organism__common_name',
                      'genomes__organism__biosample_id', 'genomes__organism__scientific_name',
@@ -411,6 +422,7 @@ class DatasetAdmin(AdminMetadata, admin.ModelAdmin):
     list_display = ('dataset_uuid', 'name', 'label', 'version', 'status_display', 'dataset_type')
     # ordering = ('-ensemblrelease__version', 'genomes__organism__name',)
     list_filter = (MetadataDatasetReleaseFilter, DatasetTypeListFilter, 'dataset_type__topic', 'status')
+    list_select_related = ('dataset_type',)
     inlines = (DatasetGenomeInline, DatasetAttributeInline)
     readonly_fields = ('status_display', 'dataset_type', 'dataset_source')
 
@@ -418,7 +430,6 @@ class DatasetAdmin(AdminMetadata, admin.ModelAdmin):
         qs = super().get_queryset(request)
         if not request.user.is_superuser:
             qs = qs.filter(parent__isnull=True)
-        qs = qs.prefetch_related('genomes__organism', 'genomes__assembly', 'genomes__releases')
         return qs
 
     def status_display(self, obj):
@@ -435,6 +446,7 @@ class OrganismGroupInLine(MetadataInline, admin.TabularInline):
     model = OrganismGroupMember
     fields = ('group_organisms', 'is_reference')
     readonly_fields = ('group_organisms',)
+    list_select_related = ('organism',)
     can_delete = False
     ordering = ('organism__scientific_name',)
 
@@ -465,6 +477,7 @@ class GenomeDatasetInline(MetadataInline, admin.TabularInline):
               'status_display']  # Updated fields list
     readonly_fields = ['display_dataset', 'name', 'type', 'release_version', 'is_current',
                        'status_display', 'dataset_topic']  # Updated readonly fields
+    list_select_related = ['dataset__dataset_type', 'release']
     can_delete = False
     extra = 0
 
@@ -495,6 +508,7 @@ class GenomeReleaseInline(MetadataInline, admin.TabularInline):
     model = Genome.releases.through
     fields = ['release_info', 'is_current', 'release__release_date']
     readonly_fields = ['release_info', 'is_current', 'release__release_date']
+    list_select_related = ['release__site']
 
     def has_add_permission(self, request, obj):
         return super().has_add_permission(request, obj) or request.user.is_superuser
@@ -504,15 +518,21 @@ class GenomeReleaseInline(MetadataInline, admin.TabularInline):
 
 
 @admin.register(Genome)
-class GenomeAdmin(AdminMetadata, admin.ModelAdmin):
+class GenomeAdmin(IndexedSearchMixin, AdminMetadata, admin.ModelAdmin):
+    search_kind = SearchDocument.Kind.GENOME
     list_display = ['genome_uuid', 'assembly', 'organism', 'is_best']
-    list_filter = ['releases', 'is_best']
+    list_select_related = ['assembly', 'organism']
+    list_filter = [GenomeReleaseFilter, GenomeOrganismFilter, 'is_best']
     # TODO add an item to list with NULL value
     search_fields = ['assembly__name', 'organism__common_name', 'genome_uuid']
     fields = ['genome_uuid', 'assembly', 'organism', 'production_name', 'is_best', 'created']
     readonly_fields = ['production_name', 'genome_uuid', 'assembly', 'organism', 'created']
     inlines = [GenomeDatasetInline, GenomeReleaseInline]
 
+    @property
+    def media(self):
+        return super().media + GenomeOrganismFilter.media(self.admin_site)
+
 
 class DatasetInline(MetadataInline, admin.TabularInline):
     model = Dataset
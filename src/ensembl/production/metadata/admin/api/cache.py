@@ -0,0 +1,196 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+API responses cache.
+
+Released data cannot be modified (see the `save()`/`delete()` guards in models.py), so the serialized output of a
+released genome or dataset is kept with no expiry. Unreleased data is kept `METADATA_API_CACHE_TTL` seconds.
+
+Each cache key embeds a generation token, one for released and one for unreleased entries. Any write to the registry
+renews the unreleased token, and the writes still allowed on released data (a new release, a dataset attached to a
+released genome, a change to a shared dataset type, source or attribute...) renew the released token, which
+invalidates all the matching entries at once whatever the cache backend.
+
+The backend is the `METADATA_API_CACHE` alias of the Django CACHES setting (local memory, file based...).
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny, SAFE_METHODS
+from rest_framework.response import Response
+
+from ensembl.production.metadata.admin.models import Attribute, DatasetSource, DatasetType, EnsemblRelease, \
+    GenomeRelease, is_released
+
+KEY_PREFIX = 'metadata_api'
+RELEASED = 'released'
+UNRELEASED = 'unreleased'
+
+
+def get_cache():
+    return caches[getattr(settings, 'METADATA_API_CACHE', 'default')]
+
+
+def get_timeout(state):
+    return None if state == RELEASED else getattr(settings, 'METADATA_API_CACHE_TTL', 60)
+
+
+def generation_key(state):
+    return f'{KEY_PREFIX}:generation:{state}'
+
+
+def counter_key(name):
+    return f'{KEY_PREFIX}:{name}'
+
+
+def generation(cache, state):
+    token = cache.get(generation_key(state))
+    if token is None:
+        # never set, or evicted: start a new generation rather than reading back older entries
+        cache.add(generation_key(state), uuid.uuid4().hex, None)
+        token = cache.get(generation_key(state))
+    return token
+
+
+def invalidate(released=False):
+    """
+    Drop the cached unreleased responses, and the released ones too if `released` is set.
+    """
+    states = [UNRELEASED, RELEASED] if released else [UNRELEASED]
+    get_cache().set_many({generation_key(state): uuid.uuid4().hex for state in states}, None)
+
+
+def count(name):
+    cache = get_cache()
+    cache.add(counter_key(name), 0, None)
+    try:
+        cache.incr(counter_key(name))
+    except ValueError:
+        # evicted in between
+        cache.set(counter_key(name), 1, None)
+
+
+def stats():
+    cache = get_cache()
+    counters = cache.get_many([counter_key('hits'), counter_key('misses')])
+    hits = counters.get(counter_key('hits'), 0)
+    misses = counters.get(counter_key('misses'), 0)
+    return {
+        'backend': f'{cache.__class__.__module__}.{cache.__class__.__name__}',
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def cache_stats(request):
+    """
+    API cache backend and hit/miss counters (per process for the local memory backend).
+    """
+    return Response(stats())
+
+
+def released_instance(instance):
+    """
+    Whether `instance`, of a model declaring a `release_lock`, is attached to a released genome.
+    """
+    kind, field = instance.release_lock
+    return is_released(kind, getattr(instance, 'pk' if field == 'pk' else field))
+
+
+class CachedResponseMixin:
+    """
+    Cache the serialized data of `retrieve`, and of `list` when `is_released_list` is true, in the API cache.
+    `is_released_object(instance)` tells which entries can be kept indefinitely, by default through the release lock
+    of the instance model. The response has a `X-Cache` header set to HIT or MISS.
+    """
+
+    def is_released_object(self, instance):
+        return released_instance(instance)
+
+    def is_released_list(self, request):
+        return False
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            instance = self.get_object()
+            return self.get_serializer(instance).data, self.is_released_object(instance)
+
+        return self.cached_response(request, build)
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_released_list(request):
+            return super().list(request, *args, **kwargs)
+
+        def build():
+            return super(CachedResponseMixin, self).list(request, *args, **kwargs).data, True
+
+        return self.cached_response(request, build)
+
+    def cached_response(self, request, build):
+        cache = get_cache()
+        digest = hashlib.md5(
+            f'{request.build_absolute_uri()}|{request.accepted_media_type}'.encode()
+        ).hexdigest()
+        keys = {state: f'{KEY_PREFIX}:{state}:{generation(cache, state)}:{digest}' for state in (RELEASED, UNRELEASED)}
+        hits = cache.get_many(keys.values())
+        if hits:
+            count('hits')
+            response = Response(next(iter(hits.values())))
+            response['X-Cache'] = 'HIT'
+            return response
+        count('misses')
+        data, released = build()
+        state = RELEASED if released else UNRELEASED
+        cache.set(keys[state], data, get_timeout(state))
+        response = Response(data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def is_released_write(self, request, response):
+        """
+        Whether a successful write request changed released entries without sending any signal (bulk queries).
+        Writes sending signals are handled by `registry_changed`.
+        """
+        return False
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            invalidate(released=self.is_released_write(request, response))
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+# Models with no release lock rendered in the API responses, shared by released and unreleased data
+SHARED_MODELS = (Attribute, DatasetSource, DatasetType, EnsemblRelease, GenomeRelease)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def registry_changed(sender, instance, raw=False, created=False, **kwargs):
+    if sender._meta.app_label != 'ensembl_metadata':
+        return
+    if raw:
+        # fixtures
+        invalidate(released=True)
+    elif hasattr(sender, 'release_lock'):
+        invalidate(released=released_instance(instance))
+    elif sender in SHARED_MODELS:
+        # a new attribute, source, type or release is not in any released entry yet, unlike a new genome release
+        invalidate(released=not created or sender is GenomeRelease)
+    # other models (sites, organism groups, search documents...) are not rendered by the API
@@ -0,0 +1,129 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from decimal import Decimal, InvalidOperation
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from ensembl.production.metadata.admin.models import GenomeRelease, Organism, SearchDocument
+from ensembl.production.metadata.admin.search import search
+from ensembl.production.ncbi_taxonomy.api.utils import TaxonomyUtils, chunks
+
+FALSE_VALUES = ('', '0', 'false', 'False')
+
+
+def in_chunks(field, values):
+    """
+    `field IN (values)` as OR-ed IN lists of at most IN_CHUNK_SIZE values each.
+    """
+    return reduce(or_, (Q(**{f'{field}__in': chunk}) for chunk in chunks(sorted(values))))
+
+
+def filter_search(request, queryset, kind):
+    """
+    Objects matching the `search` query parameter, from their search documents.
+    """
+    term = request.query_params.get('search', '').strip()
+    return search(queryset, kind, term) if term else queryset
+
+
+SEARCH_PARAMETER = {
+    'name': 'search',
+    'description': 'Words to search in the UUIDs, organism names and assembly names or accessions, each matched as '
+                   'a word prefix (e.g. GCA_0000 or Homo sap)',
+    'required': False,
+    'in': 'query',
+    'schema': {
+        'type': 'string',
+    },
+}
+
+
+class GenomeFilterBackend(BaseFilterBackend):
+    """
+    Filter genomes by taxon, release and search term.
+
+    The taxonomy lives in its own database, so no SQL join is possible: the distinct taxa of the registry organisms
+    (a few thousand at most) are read from the metadata database, those under the requested taxa are found with the
+    taxonomy index (or nested set queries), and they are sent to the genome query as chunked IN lists. A large clade
+    such as Vertebrata is never expanded.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        taxon = request.query_params.get('taxon')
+        if taxon is not None:
+            try:
+                taxon_ids = TaxonomyUtils.parse_taxon_ids(taxon)
+            except ValueError:
+                raise ValidationError({'taxon': 'Comma-separated taxon ids expected'})
+            if request.query_params.get('descendants', '') not in FALSE_VALUES:
+                organism_taxon_ids = Organism.objects.values_list('taxonomy_id', flat=True).distinct()
+                taxon_ids = TaxonomyUtils.filter_descendants(organism_taxon_ids, taxon_ids)
+            if not taxon_ids:
+                return queryset.none()
+            queryset = queryset.filter(in_chunks('organism__taxonomy_id', taxon_ids))
+        return filter_search(request, self.filter_release(request, queryset), SearchDocument.Kind.GENOME)
+
+    @staticmethod
+    def release_version(request):
+        release = request.query_params.get('release')
+        if release is None:
+            return None
+        try:
+            return Decimal(release)
+        except InvalidOperation:
+            raise ValidationError({'release': 'Release version expected'})
+
+    @classmethod
+    def filter_release(cls, request, queryset):
+        version = cls.release_version(request)
+        if version is not None:
+            # as a subquery: a version is released on each site, a join would repeat the genomes
+            queryset = queryset.filter(pk__in=GenomeRelease.objects.filter(release__version=version)
+                                       .values('genome_id'))
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': 'taxon',
+                'description': 'Comma-separated taxon ids of the organisms (e.g. 9606,10090)',
+                'required': False,
+                'in': 'query',
+                'schema': {
+                    'type': 'string',
+                },
+            },
+            {
+                'name': 'descendants',
+                'description': 'Include the organisms of the descendant taxa (e.g. taxon=7742&descendants=1 for all '
+                               'the vertebrates)',
+                'required': False,
+                'in': 'query',
+                'schema': {
+                    'type': 'boolean',
+                },
+            },
+            {
+                'name': 'release',
+                'description': 'Ensembl release version (e.g. 112)',
+                'required': False,
+                'in': 'query',
+                'schema': {
+                    'type': 'string',
+                },
+            },
+            SEARCH_PARAMETER,
+        ]
@@ -1,3 +1,3 @@
 from .genome import GenomeSerializer
 from .user import UserSerializer
-from .dataset import DatasetSerializer
\ No newline at end of file
+from .dataset import DatasetSerializer, DatasetBulkItemSerializer
\ No newline at end of file
@@ -9,12 +9,16 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+from collections import Counter
+
 from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 from django.core.exceptions import ObjectDoesNotExist
 
 from ensembl.production.metadata.admin.models import Dataset, Attribute, DatasetAttribute, DatasetSource, DatasetType, \
     Genome, GenomeDataset
+from ensembl.production.metadata.admin.search import index_datasets
 
 
 class AttributeSerializer(serializers.ModelSerializer):
@@ -51,6 +55,37 @@ class DatasetSourceSerializer(serializers.ModelSerializer):
         return data
 
 
+class DatasetSourceItemSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    type = serializers.CharField(max_length=32)
+
+
+class DatasetAttributeItemSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=128)
+    value = serializers.CharField(max_length=255)
+
+
+class DatasetBulkItemSerializer(serializers.Serializer):
+    """
+    One dataset of a bulk submission. Only the payload shape is validated here, database lookups are run
+    for the whole batch at once by the `bulk` action.
+    """
+    genome_uuid = serializers.UUIDField()
+    name = serializers.CharField(max_length=128)
+    label = serializers.CharField(max_length=128)
+    version = serializers.CharField(max_length=128, required=False, allow_null=True)
+    dataset_type = serializers.CharField(max_length=32)
+    dataset_source = DatasetSourceItemSerializer()
+    dataset_attribute = DatasetAttributeItemSerializer(many=True, required=False)
+
+    def validate_dataset_attribute(self, value):
+        counts = Counter((attr['name'], attr['value']) for attr in value)
+        duplicates = sorted({name for (name, _), count in counts.items() if count > 1})
+        if duplicates:
+            raise serializers.ValidationError(f"Duplicate values of attributes {', '.join(duplicates)}.")
+        return value
+
+
 class DatasetSerializer(serializers.ModelSerializer):
     dataset_attribute = DatasetAttributeSerializer(many=True, required=False)
     genome_uuid = serializers.UUIDField(write_only=True)
@@ -67,6 +102,16 @@ class DatasetSerializer(serializers.ModelSerializer):
                   "dataset_type",
                   'genome_uuid']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load all the relations rendered by the serializer along with the datasets, so that rendering a page of
+        datasets runs the same number of queries whatever its size.
+        """
+        return queryset.select_related('dataset_source', 'dataset_type').prefetch_related(
+            Prefetch('genome_datasets', queryset=GenomeDataset.objects.select_related('genome', 'release'))
+        )
+
     def get_genome_datasets(self, obj):
         genome_datasets = obj.genome_datasets.all()
         serialized_data = []
@@ -107,7 +152,9 @@ class DatasetSerializer(serializers.ModelSerializer):
             validated_data['dataset_source'] = dataset_source
             new_dataset = Dataset.objects.create(**validated_data)
             GenomeDataset.objects.create(genome=genome, dataset=new_dataset)
-            Dataset.objects.create_child_datasets(new_dataset, genome)
+            children = Dataset.objects.create_child_datasets(new_dataset, genome)
+            # bulk inserts, see DatasetManager
+            index_datasets([child.pk for child in children])
             for attr_data in dataset_attributes_data:
                 attr_value = attr_data.get('value')
                 attr_name = attr_data['attribute']['name']
@@ -9,11 +9,12 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+from urllib.parse import quote
 
+from django.db.models import Prefetch
 from rest_framework import serializers
 
 from ensembl.production.metadata.admin.models import Genome, Assembly, Organism, Dataset, EnsemblRelease
-from django.urls import reverse
 
 
 class AssemblySerializer(serializers.ModelSerializer):
@@ -40,14 +41,47 @@ class ReleaseSerializer(serializers.ModelSerializer):
         fields = ["version"]
 
 
+class TemplatedHyperlinkedRelatedField(serializers.HyperlinkedRelatedField):
+    """
+    HyperlinkedRelatedField reversing the URL once per serializer, then filling in the lookup value for each object,
+    instead of calling `reverse()` for every link.
+    """
+    placeholder = 'lookup-placeholder'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_templates = {}
+
+    def get_url(self, obj, view_name, request, format):
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        if (view_name, format) not in self.url_templates:
+            kwargs = {self.lookup_url_kwarg: self.placeholder}
+            self.url_templates[(view_name, format)] = self.reverse(view_name, kwargs=kwargs, request=request,
+                                                                   format=format)
+        lookup_value = quote(str(getattr(obj, self.lookup_field)), safe='')
+        return self.url_templates[(view_name, format)].replace(self.placeholder, lookup_value)
+
+
 class GenomeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Genome
         fields = ["genome_uuid", "created", "releases", "datasets", "assembly", "organism"]
     assembly = AssemblySerializer(read_only=True, many=False)
     organism = OrganismSerializer(many=False, read_only=True)
-    datasets = serializers.HyperlinkedRelatedField(
+    datasets = TemplatedHyperlinkedRelatedField(
         view_name='ensembl_metadata:dataset-detail',
         lookup_field='dataset_uuid',
         many=True, read_only=True)
     releases = ReleaseSerializer(many=True, read_only=True)
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load all the relations rendered by the serializer along with the genomes, so that rendering a page of
+        genomes runs the same number of queries whatever its size and the number of datasets per genome.
+        """
+        return queryset.select_related('assembly', 'organism').prefetch_related(
+            Prefetch('releases', queryset=EnsemblRelease.objects.only('release_id', 'version')),
+            Prefetch('datasets', queryset=Dataset.objects.only('dataset_id', 'dataset_uuid')),
+        )
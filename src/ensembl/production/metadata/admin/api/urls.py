@@ -13,6 +13,7 @@
 from django.urls import include, path
 from rest_framework import routers
 
+from ensembl.production.metadata.admin.api.cache import cache_stats
 from ensembl.production.metadata.admin.api.viewsets import GenomeViewSet, UserViewSet, DatasetViewSet
 
 router = routers.DefaultRouter()
@@ -21,6 +22,6 @@ router.register(r'genomes', GenomeViewSet)
 router.register(r'datasets', DatasetViewSet)
 
 urlpatterns = [
-    path(f'', include((router.urls, 'ensembl_metadata'))),
+    path(f'', include((router.urls + [path('cache/', cache_stats, name='cache-stats')], 'ensembl_metadata'))),
     path(f'api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
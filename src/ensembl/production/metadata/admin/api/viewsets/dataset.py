@@ -9,42 +9,69 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+import uuid
+
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.db.models import Q
+from django.db import router, transaction
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
-from ensembl.production.metadata.admin.api.serializers import DatasetSerializer
-from ensembl.production.metadata.admin.models import Dataset, DatasetSource, DatasetAttribute, Attribute
-from ensembl.production.metadata.admin.models import Genome
+from ensembl.production.metadata.admin.api.cache import CachedResponseMixin
+from ensembl.production.metadata.admin.api.filters import filter_search
+from ensembl.production.ncbi_taxonomy.api.pagination import OffsetOrCursorPagination
+from ensembl.production.metadata.admin.api.serializers import DatasetSerializer, DatasetBulkItemSerializer
+from ensembl.production.metadata.admin.models import Dataset, DatasetSource, DatasetAttribute, Attribute, DatasetType
+from ensembl.production.metadata.admin.models import Genome, GenomeDataset, SearchDocument
+from ensembl.production.metadata.admin.search import index_datasets
+
+
+# Largest number of datasets accepted by the bulk endpoint, and rows per INSERT
+BULK_MAX_DATASETS = 10000
+BULK_BATCH_SIZE = 1000
 
 
-class DatasetViewSet(viewsets.ModelViewSet):
+class DatasetViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     lookup_field = 'dataset_uuid'
     queryset = Dataset.objects.all()
     serializer_class = DatasetSerializer
     permission_classes = [AllowAny, ]
+    pagination_class = OffsetOrCursorPagination
+    cursor_ordering = 'dataset_id'
 
     @csrf_exempt
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = self.get_serializer_class().setup_eager_loading(super().get_queryset())
         topic = self.request.query_params.get('topic')
         released = self.request.query_params.get('released')
         unreleased = self.request.query_params.get('unreleased')
         if topic:
             queryset = queryset.filter(dataset_type__topic=topic)
+        # released as for the release lock and the response cache: attached to a released genome
+        released_ids = GenomeDataset.objects.filter(genome__is_released=True).values('dataset_id')
         if released is not None:
-            release_filter = Q(genome_datasets__release_id__isnull=False)
-            queryset = queryset.filter(release_filter)
+            queryset = queryset.filter(pk__in=released_ids)
         if unreleased is not None:
-            release_filter = Q(genome_datasets__release_id__isnull=False)
-            queryset = queryset.exclude(release_filter)
+            queryset = queryset.exclude(pk__in=released_ids)
 
-        return queryset
+        return filter_search(self.request, queryset, SearchDocument.Kind.DATASET)
+
+    def is_released_list(self, request):
+        return 'released' in request.query_params and 'unreleased' not in request.query_params
+
+    def is_released_write(self, request, response):
+        # Attributes added to a released dataset, or datasets created in bulk for released genomes. Released datasets
+        # cannot be deleted, and single datasets are created with signals.
+        if self.action in ('update', 'partial_update'):
+            dataset_uuids = [self.kwargs[self.lookup_field]]
+        elif self.action == 'bulk':
+            dataset_uuids = [result['dataset_uuid'] for result in response.data['results'] if 'dataset_uuid' in result]
+        else:
+            return False
+        return Dataset.objects.filter(dataset_uuid__in=dataset_uuids, genomes__is_released=True).exists()
 
     @csrf_exempt
     def create(self, request, *args, **kwargs):
@@ -80,6 +107,121 @@ class DatasetViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @csrf_exempt
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create a list of datasets in one request: {"user": ..., "datasets": [<dataset payload as for POST>, ...]}.
+        The whole batch (at most BULK_MAX_DATASETS datasets) is checked and inserted in one transaction, with a number
+        of queries independent of its size up to BULK_BATCH_SIZE. Valid datasets
+        are created, and the result (dataset_uuid or errors) is returned for each submitted item, in order.
+        """
+        User = get_user_model()
+        username = request.data.get('user', None)
+        if not username or not User.objects.filter(username=username).exists():
+            return Response({'detail': 'User not registered'}, status=status.HTTP_401_UNAUTHORIZED)
+        items = request.data.get('datasets')
+        if not isinstance(items, list):
+            return Response({'error': 'Please provide the list of datasets to create in "datasets".'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > BULK_MAX_DATASETS:
+            return Response({'error': f'At most {BULK_MAX_DATASETS} datasets can be created per request.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = [{} for _ in items]
+        valid = []
+        for index, item in enumerate(items):
+            item_serializer = DatasetBulkItemSerializer(data=item)
+            if item_serializer.is_valid():
+                valid.append((index, item_serializer.validated_data))
+            else:
+                results[index]['errors'] = item_serializer.errors
+
+        genome_uuids = {str(data['genome_uuid']) for _, data in valid}
+        type_names = {data['dataset_type'] for _, data in valid}
+        source_names = {data['dataset_source']['name'] for _, data in valid}
+        genomes = Genome.objects.in_bulk(genome_uuids, field_name='genome_uuid')
+        dataset_types = {dataset_type.name: dataset_type for dataset_type in
+                         DatasetType.objects.filter(name__in=type_names)}
+        sources = {source.name: source for source in DatasetSource.objects.filter(name__in=source_names)}
+        existing = set(Dataset.objects.filter(
+            dataset_type__name__in=type_names,
+            dataset_source__name__in=source_names,
+            genome_datasets__genome__genome_uuid__in=genome_uuids,
+            genome_datasets__release__isnull=True,
+        ).values_list('dataset_type__name', 'dataset_source__name', 'genome_datasets__genome__genome_uuid'))
+
+        to_create = []
+        new_sources = {}
+        for index, data in valid:
+            genome_uuid = str(data['genome_uuid'])
+            source_data = data['dataset_source']
+            key = (data['dataset_type'], source_data['name'], genome_uuid)
+            error = None
+            if genome_uuid not in genomes:
+                error = 'No Genome found with the provided UUID.'
+            elif data['dataset_type'] not in dataset_types:
+                error = f"Unknown dataset_type {data['dataset_type']}."
+            elif source_data['name'] in sources and sources[source_data['name']].type != source_data['type']:
+                error = 'dataset source with this name already exists with a different type.'
+            elif new_sources.get(source_data['name'], source_data['type']) != source_data['type']:
+                error = 'dataset source with this name is submitted with a different type by another item.'
+            elif key in existing:
+                error = 'Dataset with the provided genome_uuid, dataset_type.name and dataset_source.name ' \
+                        'already exists. Please DELETE dataset and resubmit or PUT additional dataset_attributes.'
+            if error:
+                results[index]['error'] = error
+                continue
+            existing.add(key)
+            if source_data['name'] not in sources:
+                new_sources[source_data['name']] = source_data['type']
+            to_create.append((index, data))
+
+        with transaction.atomic(using=router.db_for_write(Dataset)):
+            if new_sources:
+                DatasetSource.objects.bulk_create([DatasetSource(name=name, type=type_)
+                                                   for name, type_ in new_sources.items()],
+                                                  batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+                sources.update((source.name, source) for source in
+                               DatasetSource.objects.filter(name__in=new_sources.keys()))
+            datasets = [Dataset(name=data['name'],
+                                label=data['label'],
+                                version=data.get('version'),
+                                dataset_type=dataset_types[data['dataset_type']],
+                                dataset_source=sources[data['dataset_source']['name']],
+                                dataset_uuid=str(uuid.uuid4())) for _, data in to_create]
+            Dataset.objects.bulk_create_datasets(datasets, batch_size=BULK_BATCH_SIZE)
+            parents = [(dataset, genomes[str(data['genome_uuid'])]) for dataset, (_, data) in zip(datasets, to_create)]
+            GenomeDataset.objects.bulk_create([GenomeDataset(genome=genome, dataset=dataset)
+                                               for dataset, genome in parents], batch_size=BULK_BATCH_SIZE)
+            children = Dataset.objects.bulk_create_child_datasets(parents, batch_size=BULK_BATCH_SIZE)
+
+            attribute_names = {attr['name'] for _, data in to_create for attr in data.get('dataset_attribute', [])}
+            attributes = Attribute.objects.in_bulk(attribute_names, field_name='name') if attribute_names else {}
+            missing = attribute_names - set(attributes)
+            if missing:
+                Attribute.objects.bulk_create([Attribute(name=name, label=name, description=name, type="string")
+                                               for name in missing], batch_size=BULK_BATCH_SIZE,
+                                              ignore_conflicts=True)
+                attributes.update(Attribute.objects.in_bulk(missing, field_name='name'))
+            DatasetAttribute.objects.bulk_create([
+                DatasetAttribute(dataset=dataset, attribute=attributes[attr['name']], value=attr['value'])
+                for dataset, (_, data) in zip(datasets, to_create) for attr in data.get('dataset_attribute', [])
+            ], batch_size=BULK_BATCH_SIZE)
+            # bulk inserts, see DatasetManager
+            index_datasets([dataset.pk for dataset in datasets + children])
+
+        for dataset, (index, _) in zip(datasets, to_create):
+            results[index]['dataset_uuid'] = dataset.dataset_uuid
+        created = len(to_create)
+        if created == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'results': results}, status=response_status)
+
     # PUT
     @csrf_exempt
     def update(self, request, dataset_uuid=None, *args, **kwargs):
@@ -95,30 +237,30 @@ class DatasetViewSet(viewsets.ModelViewSet):
                             status=status.HTTP_400_BAD_REQUEST)
         attrs_data = request.data.get('dataset_attribute', [])
 
-        for attr_data in attrs_data:
-            name = attr_data.get('name')
-            value = attr_data.get('value')
-
-            # Check if the attribute value already exists for the dataset
-            if DatasetAttribute.objects.filter(dataset=dataset, attribute__name=name).exists():
-                return Response(
-                    {'error': f'Error, {name} is already populated. Please use the admin pages to modify it.'},
-                    status=status.HTTP_400_BAD_REQUEST)
-
-            # If not, update or create the dataset attribute
-            attribute, created = Attribute.objects.get_or_create(
-                name=name,
-                defaults={
-                    'label': name,
-                    'description': name,
-                    'type': "string"
-                }
-            )
-            DatasetAttribute.objects.update_or_create(
-                dataset=dataset,
-                attribute=attribute,
-                defaults={'value': value}
-            )
+        with transaction.atomic(using=router.db_for_write(DatasetAttribute)):
+            # Check if any of the attribute values already exists for the dataset
+            populated = set(DatasetAttribute.objects.filter(dataset=dataset, attribute__name__in=[
+                attr_data.get('name') for attr_data in attrs_data]).values_list('attribute__name', flat=True))
+            values = {}
+            for attr_data in attrs_data:
+                name = attr_data.get('name')
+                if name in populated or name in values:
+                    return Response(
+                        {'error': f'Error, {name} is already populated. Please use the admin pages to modify it.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+                values[name] = attr_data.get('value')
+
+            # If not, create the missing attributes then the dataset attributes, in bulk
+            attributes = Attribute.objects.in_bulk(values.keys(), field_name='name')
+            missing = [name for name in values if name not in attributes]
+            if missing:
+                Attribute.objects.bulk_create([Attribute(name=name, label=name, description=name, type="string")
+                                               for name in missing], ignore_conflicts=True)
+                attributes.update(Attribute.objects.in_bulk(missing, field_name='name'))
+            DatasetAttribute.objects.bulk_create([
+                DatasetAttribute(dataset=dataset, attribute=attributes[name], value=value)
+                for name, value in values.items()
+            ])
 
         serializer = self.get_serializer(dataset)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -10,12 +10,83 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+
+from ensembl.production.metadata.admin.api.cache import CachedResponseMixin
+from ensembl.production.metadata.admin.api.filters import GenomeFilterBackend
+from ensembl.production.metadata.admin.export import export_ndjson
+from ensembl.production.ncbi_taxonomy.api.pagination import OffsetOrCursorPagination
 from ensembl.production.metadata.admin.api.serializers import GenomeSerializer
-from ensembl.production.metadata.admin.models import Genome
+from ensembl.production.metadata.admin.models import Genome, GenomeDataset
+from ensembl.production.ncbi_taxonomy.api.utils import TaxonomyUtils
 
-class GenomeViewSet(viewsets.ReadOnlyModelViewSet):
+class GenomeViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Genome.objects.all()
     serializer_class = GenomeSerializer
     lookup_field = 'genome_uuid'
+    pagination_class = OffsetOrCursorPagination
+    cursor_ordering = 'genome_id'
+    filter_backends = [GenomeFilterBackend]
+
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(super().get_queryset())
+
+    def is_released_object(self, instance):
+        return instance.is_released
+
+    @action(detail=False, url_path='export')
+    def export(self, request, *args, **kwargs):
+        """
+        Stream the whole registry as NDJSON, one genome per line with its assembly, organism, releases, datasets
+        and attributes.
+        """
+        response = StreamingHttpResponse(export_ndjson(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="metadata_registry.ndjson"'
+        return response
 
+    @action(detail=False, url_path='clades')
+    def clades(self, request, *args, **kwargs):
+        """
+        Number of organisms, genomes and datasets under a taxon (`taxon`, required) and under each of its descendant
+        clades holding genomes, in pre-order, optionally for a release (`release`) and for the clades of a rank only
+        (`rank`, e.g. order or family). A dataset attached to genomes of several taxa is counted once per clade.
+        """
+        try:
+            taxon_id = int(request.query_params['taxon'])
+        except (KeyError, ValueError):
+            raise ValidationError({'taxon': 'A taxon id is required'})
+        rank = request.query_params.get('rank')
+        version = GenomeFilterBackend.release_version(request)
+        genomes = GenomeFilterBackend.filter_release(request, Genome.objects.all())
+        # the datasets of the release only, not those of the genomes in other releases
+        datasets_filter = Q(genomedataset__release__version=version) if version is not None else None
+        counts = {taxonomy_id: [organisms, genomes, datasets] for taxonomy_id, organisms, genomes, datasets in
+                  genomes.order_by().values_list('organism__taxonomy_id').annotate(
+                      organisms=Count('organism', distinct=True), genomes=Count('genome_id', distinct=True),
+                      datasets=Count('genomedataset__dataset', distinct=True, filter=datasets_filter))}
+        # datasets of genomes of several taxa are counted once per taxon above, and once per clade after correction
+        links = GenomeDataset.objects.filter(genome__in=genomes)
+        if version is not None:
+            links = links.filter(release__version=version)
+        shared = links.order_by().values('dataset_id').annotate(
+            taxa=Count('genome__organism__taxonomy_id', distinct=True)).filter(taxa__gt=1).values('dataset_id')
+        dataset_taxa = {}
+        for dataset_id, taxonomy_id in links.filter(dataset_id__in=shared).values_list(
+                'dataset_id', 'genome__organism__taxonomy_id').distinct():
+            dataset_taxa.setdefault(dataset_id, []).append(taxonomy_id)
+        for corrected_id, correction in TaxonomyUtils.shared_count_corrections(list(dataset_taxa.values())).items():
+            counts.setdefault(corrected_id, [0, 0, 0])[2] += correction
+        clades = TaxonomyUtils.clade_counts(taxon_id, counts)
+        if not clades:
+            raise NotFound(f'Taxon {taxon_id} not found')
+        summaries = TaxonomyUtils.fetch_summaries(list(clades))
+        results = [dict(summaries.get(clade_id, {'taxon_id': clade_id, 'rank': None, 'scientific_name': None}),
+                        parent_id=parent_id, organisms=totals[0], genomes=totals[1], datasets=totals[2])
+                   for clade_id, (parent_id, totals) in clades.items()]
+        return Response(dict(results[0], clades=[clade for clade in results[1:]
+                                                 if rank is None or clade['rank'] == rank]))
@@ -18,3 +18,9 @@ class EnsemblMetadataConfig(AppConfig):
     name = 'ensembl.production.metadata.admin'
     label = 'ensembl_metadata'
     verbose_name = "Genomes Metadata"
+
+    def ready(self):
+        # connect the API cache invalidation signals
+        from ensembl.production.metadata.admin.api import cache  # noqa: F401
+        # and the search documents updates
+        from ensembl.production.metadata.admin import search  # noqa: F401
@@ -0,0 +1,114 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+Full registry export, one JSON document per genome (NDJSON).
+
+Genomes are read in chunks of `chunk_size` rows ordered by primary key (`genome_id > last_seen LIMIT chunk_size`),
+and the releases, datasets and attributes are prefetched per chunk, so memory usage depends on the chunk size,
+never on the size of the registry. Keyset chunks are used rather than a single `.iterator()` query because the
+MySQL driver buffers the whole result set client side.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, prefetch_related_objects
+
+from ensembl.production.metadata.admin.models import Genome, GenomeDataset, GenomeRelease, DatasetAttribute
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def genome_chunks(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of at most `chunk_size` genomes, with all the relations exported prefetched.
+    """
+    queryset = (queryset if queryset is not None else Genome.objects.all()).select_related('assembly', 'organism')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(genome_id__gt=last_id).order_by('genome_id')[:chunk_size])
+        if not chunk:
+            return
+        prefetch_related_objects(
+            chunk,
+            Prefetch('genomerelease_set', queryset=GenomeRelease.objects.select_related('release')),
+            Prefetch('genomedataset_set', queryset=GenomeDataset.objects.select_related(
+                'dataset__dataset_type', 'dataset__dataset_source', 'release').order_by('dataset_id')),
+            Prefetch('genomedataset_set__dataset__attributes_set',
+                     queryset=DatasetAttribute.objects.select_related('attribute')),
+        )
+        yield chunk
+        last_id = chunk[-1].genome_id
+
+
+def genome_document(genome):
+    assembly = genome.assembly
+    organism = genome.organism
+    return {
+        'genome_uuid': genome.genome_uuid,
+        'production_name': genome.production_name,
+        'created': genome.created,
+        'is_best': genome.is_best,
+        'genebuild_version': genome.genebuild_version,
+        'genebuild_date': genome.genebuild_date,
+        'assembly': {
+            'assembly_uuid': assembly.assembly_uuid,
+            'accession': assembly.accession,
+            'name': assembly.name,
+            'ucsc_name': assembly.ucsc_name,
+            'level': assembly.level,
+            'tol_id': assembly.tol_id,
+            'is_reference': assembly.is_reference,
+        },
+        'organism': {
+            'organism_uuid': organism.organism_uuid,
+            'biosample_id': organism.biosample_id,
+            'scientific_name': organism.scientific_name,
+            'common_name': organism.common_name,
+            'strain': organism.strain,
+            'taxonomy_id': organism.taxonomy_id,
+            'species_taxonomy_id': organism.species_taxonomy_id,
+        },
+        'releases': [{
+            'version': genome_release.release.version,
+            'label': genome_release.release.label,
+            'status': genome_release.release.status,
+            'release_type': genome_release.release.release_type,
+            'is_current': genome_release.is_current,
+        } for genome_release in genome.genomerelease_set.all()],
+        'datasets': [{
+            'dataset_uuid': genome_dataset.dataset.dataset_uuid,
+            'name': genome_dataset.dataset.name,
+            'label': genome_dataset.dataset.label,
+            'version': genome_dataset.dataset.version,
+            'status': genome_dataset.dataset.status,
+            'dataset_type': genome_dataset.dataset.dataset_type.name,
+            'dataset_source': {
+                'name': genome_dataset.dataset.dataset_source.name,
+                'type': genome_dataset.dataset.dataset_source.type,
+            },
+            'release_version': genome_dataset.release.version if genome_dataset.release else None,
+            'is_current': genome_dataset.is_current,
+            'attributes': [{
+                'name': dataset_attribute.attribute.name,
+                'value': dataset_attribute.value,
+            } for dataset_attribute in genome_dataset.dataset.attributes_set.all()],
+        } for genome_dataset in genome.genomedataset_set.all()],
+    }
+
+
+def export_ndjson(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the registry export, one NDJSON line per genome.
+    """
+    for chunk in genome_chunks(queryset, chunk_size):
+        for genome in chunk:
+            yield json.dumps(genome_document(genome), cls=DjangoJSONEncoder) + '\n'
@@ -10,60 +10,147 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import abc
+import uuid
+
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
 from ensembl.production.metadata.admin.models import *
 
+# List filter lookups are kept in the default cache until their source table changes (see `lookups_changed`).
+# Writes sending no signal (bulk queries, or other processes when the cache is local memory) are picked up after
+# LOOKUPS_CACHE_TTL seconds.
+LOOKUPS_CACHE_TTL = 3600
+
+
+def lookups_generation(model):
+    return cache.get_or_set(f'admin_lookups:{model._meta.label_lower}', lambda: uuid.uuid4().hex, None)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def lookups_changed(sender, **kwargs):
+    if sender._meta.app_label == 'ensembl_metadata':
+        cache.delete(f'admin_lookups:{sender._meta.label_lower}')
+
+
+class CachedLookupsFilter(admin.SimpleListFilter, metaclass=abc.ABCMeta):
+    """
+    List filter caching its lookups, built by `load_lookups()` from `lookups_model`.
+    """
+    lookups_model = None
+
+    def lookups_variant(self, request):
+        """
+        Part of the cache key, for lookups depending on the request.
+        """
+        return ''
+
+    def lookups(self, request, model_admin):
+        key = f'admin_lookups:{self.__class__.__name__}:{self.lookups_variant(request)}:' \
+              f'{lookups_generation(self.lookups_model)}'
+        lookups = cache.get(key)
+        if lookups is None:
+            lookups = list(self.load_lookups(request, model_admin))
+            cache.set(key, lookups, LOOKUPS_CACHE_TTL)
+        return lookups
+
+    @abc.abstractmethod
+    def load_lookups(self, request, model_admin):
+        """
+        The (value, label) lookups, read from the database.
+        """
 
-class MetadataReleaseFilter(admin.SimpleListFilter):
+
+class MetadataReleaseFilter(CachedLookupsFilter):
     title = _('Ensembl Release')
     parameter_name = 'ensembl_release'
+    lookups_model = EnsemblRelease
+    field_path = 'genome__releases'
 
-    def lookups(self, request, model_admin):
+    def load_lookups(self, request, model_admin):
         releases = EnsemblRelease.objects.all()
         return [(r.release_id, r.version) for r in releases] + [('-', '-')]
 
     def queryset(self, request, queryset):
         if self.value():
             if self.value() == '-':
-                return queryset.exclude(genome__releases__isnull=False)
-            ensembl_release = EnsemblRelease.objects.get(pk=self.value())
-            queryset = queryset.filter(genome__releases=ensembl_release)
-            return queryset
+                return queryset.exclude(**{f'{self.field_path}__isnull': False})
+            return queryset.filter(**{self.field_path: self.value()}).distinct()
 
 
 class MetadataDatasetReleaseFilter(MetadataReleaseFilter):
-    def queryset(self, request, queryset):
-        if self.value():
-            if self.value() == '-':
-                return queryset.exclude(genome_datasets__release__isnull=False)
-            ensembl_release = EnsemblRelease.objects.get(pk=self.value())
-            queryset = queryset.filter(genome_datasets__release=ensembl_release)
-            return queryset
+    field_path = 'genome_datasets__release'
+
+
+class GenomeReleaseFilter(MetadataReleaseFilter):
+    field_path = 'releases'
 
 
 class MetadataOrganismFilter(admin.SimpleListFilter):
+    """
+    Organism filter picking the organism with the admin autocomplete (matching OrganismAdmin search_fields), instead
+    of listing all the organisms in each page.
+    """
     title = _('Organism')
     parameter_name = 'organism'
+    template = 'admin/ensembl_metadata/autocomplete_filter.html'
+    field_path = 'genome__organism'
+
+    def __init__(self, request, params, model, model_admin):
+        self.admin_site = model_admin.admin_site
+        super().__init__(request, params, model, model_admin)
 
     def lookups(self, request, model_admin):
-        organisms = Organism.objects.all()
-        return [(r.organism_id, r.biosample_id) for r in organisms]
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        # autocomplete queries use the Genome.organism field
+        field = forms.ModelChoiceField(queryset=Organism.objects.all(), required=False, widget=AutocompleteSelect(
+            Genome._meta.get_field('organism'), self.admin_site, attrs={
+                'data-url': changelist.get_query_string(remove=[self.parameter_name]),
+                'data-parameter': self.parameter_name,
+                'class': 'autocomplete-filter',
+                'style': 'width: 100%',
+            }))
+        yield {
+            'selected': self.value() is not None,
+            'widget': field.widget.render(self.parameter_name, self.value()),
+        }
 
     def queryset(self, request, queryset):
         if self.value():
-            organism = Organism.objects.get(pk=self.value())
-            return queryset.filter(genome__organism=organism)
+            return queryset.filter(**{self.field_path: self.value()})
+
+    @classmethod
+    def media(cls, admin_site):
+        return AutocompleteSelect(Genome._meta.get_field('organism'), admin_site).media
+
 
+class GenomeOrganismFilter(MetadataOrganismFilter):
+    field_path = 'organism'
 
-class DatasetTypeListFilter(admin.SimpleListFilter):
+
+class DatasetTypeListFilter(CachedLookupsFilter):
     title = _("Dataset Type")
 
     # Parameter for the filter that will be used in the URL query.
     parameter_name = "dataset_type"
+    lookups_model = DatasetType
 
-    def lookups(self, request, model_admin):
+    def lookups_variant(self, request):
+        return 'all' if request.user.is_superuser else 'top'
+
+    def load_lookups(self, request, model_admin):
         """
         Returns a list of tuples. The first element in each
         tuple is the coded value for the option that will
@@ -85,5 +172,4 @@ class DatasetTypeListFilter(admin.SimpleListFilter):
         `self.value()`.
         """
         if self.value():
-            dataset_type = DatasetType.objects.get(pk=self.value())
-            return queryset.filter(dataset_type=dataset_type)
+            return queryset.filter(dataset_type=self.value())
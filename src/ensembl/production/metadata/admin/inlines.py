@@ -0,0 +1,165 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+Paginated admin inlines.
+
+Django inlines render every related object in the change page, which does not scale to a release holding thousands of
+genomes. A `PaginatedInline` is a read only table rendered empty with the change page, then filled in over AJAX one
+page at a time by the `<object_id>/inline/<name>/` view added by `PaginatedInlinesMixin`, with server side sorting
+(`o`), search (`q`) and paging (`p`), so the change page costs the same whatever the number of related objects.
+"""
+from functools import reduce
+from operator import or_
+from urllib.parse import urlencode
+
+from django.contrib.admin.utils import label_for_field, quote, unquote
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+
+PAGE_VAR = 'p'
+ORDER_VAR = 'o'
+SEARCH_VAR = 'q'
+
+
+class PaginatedInline(object):
+    """
+    Read only table of the `model` objects linked to the change page object by `fk_name`.
+
+    `fields` are model fields or methods of the inline taking the object, as for `list_display`: their
+    `short_description` is the column header, and their `admin_order_field` makes the column sortable.
+    """
+    model = None
+    fk_name = None
+    fields = ()
+    search_fields = ()
+    ordering = ()
+    list_select_related = ()
+    per_page = 50
+    verbose_name_plural = None
+
+    def __init__(self, model_admin):
+        self.model_admin = model_admin
+        self.opts = self.model._meta
+        if self.verbose_name_plural is None:
+            self.verbose_name_plural = self.opts.verbose_name_plural
+
+    @property
+    def name(self):
+        return self.__class__.__name__.lower()
+
+    def get_queryset(self, request, obj):
+        return self.model._default_manager.filter(**{self.fk_name: obj}).select_related(*self.list_select_related)
+
+    def order_fields(self):
+        """
+        {field name: ORDER BY field} of the sortable columns.
+        """
+        order_fields = {}
+        for field_name in self.fields:
+            attr = getattr(self, field_name, None)
+            if attr is not None:
+                if getattr(attr, 'admin_order_field', None):
+                    order_fields[field_name] = attr.admin_order_field
+            else:
+                order_fields[field_name] = field_name
+        return order_fields
+
+    def get_ordering(self, order):
+        field_name = order.lstrip('-')
+        order_field = self.order_fields().get(field_name)
+        if order_field is None:
+            return list(self.ordering)
+        # primary key as tie breaker, for stable pages
+        return [f'-{order_field}' if order.startswith('-') else order_field, 'pk']
+
+    def get_search_results(self, queryset, query):
+        if not query or not self.search_fields:
+            return queryset
+        return queryset.filter(reduce(or_, (Q(**{f'{field}__icontains': query}) for field in self.search_fields)))
+
+    def display(self, field_name, obj):
+        attr = getattr(self, field_name, None)
+        return attr(obj) if attr is not None else getattr(obj, field_name)
+
+    def get_context(self, request, obj):
+        query = request.GET.get(SEARCH_VAR, '').strip()
+        order = request.GET.get(ORDER_VAR, '')
+        queryset = self.get_search_results(self.get_queryset(request, obj), query).order_by(*self.get_ordering(order))
+        paginator = Paginator(queryset, self.per_page)
+        page = paginator.get_page(request.GET.get(PAGE_VAR))
+
+        def query_string(**params):
+            return '?' + urlencode(dict({ORDER_VAR: order, SEARCH_VAR: query}, **params))
+
+        order_fields = self.order_fields()
+        headers = []
+        for field_name in self.fields:
+            header = {'label': label_for_field(field_name, self.model, self), 'sorted': None, 'url': None}
+            if field_name in order_fields:
+                header['sorted'] = 'ascending' if order == field_name else \
+                    'descending' if order == f'-{field_name}' else None
+                header['url'] = query_string(**{ORDER_VAR: f'-{field_name}' if order == field_name else field_name})
+            headers.append(header)
+        return {
+            'inline': self,
+            'headers': headers,
+            'rows': [[self.display(field_name, item) for field_name in self.fields] for item in page.object_list],
+            'page': page,
+            'page_range': [(number, query_string(**{PAGE_VAR: number}) if number != paginator.ELLIPSIS else None)
+                           for number in paginator.get_elided_page_range(page.number)],
+            'search_url': query_string(**{SEARCH_VAR: ''}),
+            'query': query,
+            'search_enabled': bool(self.search_fields),
+        }
+
+
+class PaginatedInlinesMixin(object):
+    """
+    ModelAdmin mixin rendering the `paginated_inlines` (PaginatedInline classes) below the change form.
+    """
+    paginated_inlines = ()
+    change_form_template = 'admin/ensembl_metadata/paginated_inlines_change_form.html'
+
+    def get_paginated_inlines(self, request, obj=None):
+        return [inline_class(self) for inline_class in self.paginated_inlines]
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('<path:object_id>/inline/<str:inline_name>/', self.admin_site.admin_view(self.paginated_inline_view),
+                 name='%s_%s_inline' % info),
+        ] + super().get_urls()
+
+    def paginated_inline_view(self, request, object_id, inline_name):
+        obj = self.get_object(request, unquote(object_id))
+        if obj is None:
+            raise Http404
+        if not self.has_view_or_change_permission(request, obj):
+            raise PermissionDenied
+        for inline in self.get_paginated_inlines(request, obj):
+            if inline.name == inline_name:
+                return TemplateResponse(request, 'admin/ensembl_metadata/paginated_inline.html',
+                                        inline.get_context(request, obj))
+        raise Http404
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        extra_context = dict(extra_context or {}, paginated_inlines=[
+            (inline, reverse('admin:%s_%s_inline' % info, args=[quote(object_id), inline.name],
+                             current_app=self.admin_site.name))
+            for inline in self.get_paginated_inlines(request)
+        ])
+        return super().change_view(request, object_id, form_url, extra_context)
@@ -0,0 +1,41 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import time
+
+from django.core.management.base import BaseCommand
+
+from ensembl.production.metadata.admin.export import DEFAULT_CHUNK_SIZE, export_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Export the whole metadata registry as NDJSON, one genome per line with its assembly, organism, ' \
+           'releases, datasets and attributes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', help='Output file (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help=f'Number of genomes fetched per query (default: {DEFAULT_CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        # write the lines through the raw stream, OutputWrapper would append a second line ending
+        out = open(options['output'], 'w') if options['output'] else self.stdout._out
+        start = time.perf_counter()
+        rows = 0
+        try:
+            for line in export_ndjson(chunk_size=options['chunk_size']):
+                out.write(line)
+                rows += 1
+        finally:
+            if options['output']:
+                out.close()
+        elapsed = time.perf_counter() - start
+        self.stderr.write(f'Exported {rows} genomes in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)')
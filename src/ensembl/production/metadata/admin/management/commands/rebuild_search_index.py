@@ -0,0 +1,32 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import time
+
+from django.core.management.base import BaseCommand
+
+from ensembl.production.metadata.admin.search import DEFAULT_CHUNK_SIZE, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search documents of all the datasets and genomes, and their full text index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help=f'Number of datasets or genomes fetched per query (default: {DEFAULT_CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = rebuild(chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - start
+        rows = sum(counts.values())
+        self.stdout.write(f"Indexed {counts['dataset']} datasets and {counts['genome']} genomes in {elapsed:.1f}s "
+                          f"({rows / elapsed if elapsed else 0:.0f} rows/s)")
@@ -0,0 +1,26 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from django.core.management.base import BaseCommand
+
+from ensembl.production.metadata.admin.api.cache import invalidate
+from ensembl.production.metadata.admin.models import update_released_flags
+
+
+class Command(BaseCommand):
+    help = 'Recompute the released flag of the genomes from genome_release, after writes made outside of Django ' \
+           '(direct database loads, other registry clients)'
+
+    def handle(self, *args, **options):
+        changed = update_released_flags()
+        if changed:
+            invalidate(released=True)
+        self.stdout.write(f'Updated the released flag of {changed} genomes')
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def set_released_genomes(apps, schema_editor):
+    Genome = apps.get_model('ensembl_metadata', 'Genome')
+    GenomeRelease = apps.get_model('ensembl_metadata', 'GenomeRelease')
+    db_alias = schema_editor.connection.alias
+    Genome.objects.using(db_alias).filter(
+        genome_id__in=GenomeRelease.objects.using(db_alias).values('genome_id')
+    ).update(is_released=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ensembl_metadata', '0021_auto_20240712_1107'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genome',
+            name='is_released',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(set_released_genomes, migrations.RunPython.noop),
+    ]
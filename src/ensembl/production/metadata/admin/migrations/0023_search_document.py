@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+# Full text index of search_document.text per database vendor, as created by search.create_search_index()
+FULLTEXT_INDEX_SQL = {
+    'sqlite': (
+        [
+            "CREATE VIRTUAL TABLE search_document_fts USING fts5("
+            "text, content='search_document', content_rowid='search_document_id')",
+            "CREATE TRIGGER search_document_fts_insert AFTER INSERT ON search_document BEGIN "
+            "INSERT INTO search_document_fts(rowid, text) VALUES (new.search_document_id, new.text); END",
+            "CREATE TRIGGER search_document_fts_delete AFTER DELETE ON search_document BEGIN "
+            "INSERT INTO search_document_fts(search_document_fts, rowid, text) "
+            "VALUES ('delete', old.search_document_id, old.text); END",
+            "CREATE TRIGGER search_document_fts_update AFTER UPDATE ON search_document BEGIN "
+            "INSERT INTO search_document_fts(search_document_fts, rowid, text) "
+            "VALUES ('delete', old.search_document_id, old.text); "
+            "INSERT INTO search_document_fts(rowid, text) VALUES (new.search_document_id, new.text); END",
+        ],
+        [
+            "DROP TRIGGER search_document_fts_insert",
+            "DROP TRIGGER search_document_fts_delete",
+            "DROP TRIGGER search_document_fts_update",
+            "DROP TABLE search_document_fts",
+        ],
+    ),
+    'mysql': (
+        ["ALTER TABLE search_document ADD FULLTEXT INDEX search_document_text (text)"],
+        ["ALTER TABLE search_document DROP INDEX search_document_text"],
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    forward, _ = FULLTEXT_INDEX_SQL.get(schema_editor.connection.vendor, ([], []))
+    for sql in forward:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    _, backward = FULLTEXT_INDEX_SQL.get(schema_editor.connection.vendor, ([], []))
+    for sql in backward:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ensembl_metadata', '0022_genome_is_released'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('search_document_id', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('dataset', 'Dataset'), ('genome', 'Genome')], max_length=8)),
+                ('object_id', models.IntegerField()),
+                ('text', models.TextField()),
+            ],
+            options={
+                'db_table': 'search_document',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_document'),
+        ),
+        # documents are written by the rebuild_search_index command
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -9,12 +9,16 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+import threading
 import uuid
+from contextlib import contextmanager
 
 import jsonfield.fields
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models.lookups import IContains
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 
 
 class UUIDField(models.UUIDField):
@@ -47,7 +51,92 @@ class UUIDIContains(IContains):
     pass
 
 
+# Genome lookups to find out whether an object is attached to a released genome, per kind of object
+RELEASED_LOOKUPS = {
+    'genome': 'genome_id',
+    'assembly': 'assembly_id',
+    'organism': 'organism_id',
+    'dataset': 'genomedataset__dataset_id',
+}
+
+_release_lock = threading.local()
+
+
+@contextmanager
+def release_lock_cache():
+    """
+    Memoize the released data checks run by the models save()/delete() guards for the duration of the block, so
+    that saving many sequences or attributes of the same assembly or dataset only checks it once.
+    The cache is dropped as soon as a genome is added to or removed from a release.
+    """
+    if getattr(_release_lock, 'cache', None) is not None:
+        yield
+        return
+    _release_lock.cache = {}
+    try:
+        yield
+    finally:
+        _release_lock.cache = None
+
+
+def is_released(kind, pk):
+    """
+    Check whether the `kind` object ('genome', 'assembly', 'organism' or 'dataset') with primary key `pk` is
+    attached to a released genome. Relies on the denormalized `Genome.is_released` flag, so no join on the
+    releases is needed.
+    """
+    cache = getattr(_release_lock, 'cache', None)
+    if cache is not None and (kind, pk) in cache:
+        return cache[(kind, pk)]
+    released = Genome.objects.filter(is_released=True, **{RELEASED_LOOKUPS[kind]: pk}).exists()
+    if cache is not None:
+        cache[(kind, pk)] = released
+    return released
+
+
+class ReleaseLockQuerySet(models.QuerySet):
+    """
+    QuerySet extending the models save()/delete() release guards to bulk update(), bulk_update() and delete().
+    Models using it declare `release_lock = (kind, field)`: the kind of object checked by `is_released` and the
+    field holding its primary key.
+    """
+
+    def released(self):
+        """
+        Whether any row of the queryset is attached to a released genome, checked in one set-based query.
+        """
+        kind, field = self.model.release_lock
+        lookup = f"{RELEASED_LOOKUPS[kind]}__in"
+        return Genome.objects.filter(is_released=True, **{lookup: self.values(field)}).exists()
+
+    def update(self, **kwargs):
+        if self.released():
+            raise ValidationError('Released data cannot be modified')
+        return super().update(**kwargs)
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # Check all the rows at once up front, rather than each batch through update()
+        objs = tuple(objs)
+        if objs and self.filter(pk__in=[obj.pk for obj in objs]).released():
+            raise ValidationError('Released data cannot be modified')
+        return self.model._base_manager.db_manager(self.db).bulk_update(objs, fields, batch_size=batch_size)
+
+    bulk_update.alters_data = True
+
+    def delete(self):
+        if self.released():
+            raise ValidationError('Released data cannot be deleted')
+        return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Assembly(models.Model):
+    objects = ReleaseLockQuerySet.as_manager()
+    release_lock = ('assembly', 'pk')
     assembly_id = models.AutoField(primary_key=True)
     ucsc_name = models.CharField(max_length=16, blank=True, null=True)
     accession = models.CharField(unique=True, max_length=16)
@@ -65,12 +154,12 @@ class Assembly(models.Model):
 
     def save(self, *args, **kwargs):
         if self.pk is not None:
-            if self.genome_set.filter(releases__isnull=False).exists():
+            if is_released('assembly', self.pk):
                 raise ValidationError('Released data cannot be modified')
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.genome_set.filter(releases__isnull=False).exists():  # check if it's associated with an EnsemblRelease
+        if is_released('assembly', self.pk):  # check if it's associated with an EnsemblRelease
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -92,6 +181,8 @@ class AssemblySequence(models.Model):
         SCAFFOLD = 'scaffold', 'Scaffold'
         SUPERCONTIG = 'supercontig', 'Supercontig'
 
+    objects = ReleaseLockQuerySet.as_manager()
+    release_lock = ('assembly', 'assembly_id')
     assembly_sequence_id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=128, blank=True, null=True)
     assembly = models.ForeignKey(Assembly, on_delete=models.CASCADE)
@@ -108,12 +199,12 @@ class AssemblySequence(models.Model):
 
     def save(self, *args, **kwargs):
         if self.pk is not None:
-            if self.assembly.genome_set.filter(releases__isnull=False).exists():
+            if is_released('assembly', self.assembly_id):
                 raise ValidationError('Released data cannot be modified')
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.assembly.genome_set.filter(releases__isnull=False).exists():
+        if is_released('assembly', self.assembly_id):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -146,21 +237,72 @@ class Attribute(models.Model):
         return self.name
 
 
-class DatasetManager(models.Manager):
+class DatasetManager(models.Manager.from_queryset(ReleaseLockQuerySet)):
+    """
+    Creation of datasets in bulk. The datasets and genome links inserted by these methods go through `bulk_create`,
+    which sends no `post_save` signal: callers do the work of the signal receivers themselves.
+    """
+
+    def bulk_create_datasets(self, datasets, batch_size=None):
+        """
+        `bulk_create` new datasets, making sure their primary keys are set afterward.
+        Datasets are expected to have their own `dataset_uuid` set.
+        """
+        self.bulk_create(datasets, batch_size=batch_size)
+        if any(ds.pk is None for ds in datasets):
+            # Backends such as MySQL do not return primary keys from bulk inserts: fetch them back
+            uuids = [str(ds.dataset_uuid) for ds in datasets]
+            size = batch_size or len(uuids)
+            pks = {}
+            for start in range(0, len(uuids), size):
+                pks.update(self.filter(dataset_uuid__in=uuids[start:start + size])
+                           .values_list('dataset_uuid', 'dataset_id'))
+            for ds in datasets:
+                ds.pk = pks[str(ds.dataset_uuid)]
+        return datasets
+
     def create_child_datasets(self, instance, genome):
+        """
+        Create the whole tree of child datasets for `instance`, following the DatasetType hierarchy.
+        Returns the list of created child datasets.
+        """
+        return self.bulk_create_child_datasets([(instance, genome)])
+
+    def bulk_create_child_datasets(self, parents, batch_size=None):
+        """
+        Create the trees of child datasets for each of the (dataset, genome) `parents`.
+        The type tree is resolved in one query, then each level of children is inserted with `bulk_create`,
+        so the number of queries only depends on the depth of the type tree, not on the number of children.
+        """
         # FYI Needs to be correlated with SQLAlchemy counter part:
         # https://github.com/Ensembl/ensembl-metadata-api/blob/main/src/ensembl/production/metadata/api/factories/datasets.py#L26
-        kids_type = DatasetType.objects.filter(parent=instance.dataset_type)
-        for kid in kids_type.all():
-            ds = self.create(dataset_type=kid,
-                             label=f"{kid.name} from {instance.dataset_type.name}",
-                             dataset_source=instance.dataset_source,
-                             name=kid.name,
-                             status=instance.status,
-                             dataset_uuid=uuid.uuid4(),
-                             parent=instance)
-            GenomeDataset.objects.create(genome=genome, dataset=ds)
-            self.create_child_datasets(ds, genome)
+        kids_types = {}
+        for dataset_type in DatasetType.objects.filter(parent__isnull=False):
+            kids_types.setdefault(dataset_type.parent_id, []).append(dataset_type)
+        created = []
+        # (dataset, genome, dataset types already in its tree)
+        level = [(instance, genome, {instance.dataset_type_id}) for instance, genome in parents]
+        while level:
+            kids = []
+            for parent, genome, seen_types in level:
+                for kid in kids_types.get(parent.dataset_type_id, []):
+                    if kid.dataset_type_id in seen_types:
+                        continue
+                    kids.append((self.model(dataset_type=kid,
+                                            label=f"{kid.name} from {parent.dataset_type.name}",
+                                            dataset_source=parent.dataset_source,
+                                            name=kid.name,
+                                            status=parent.status,
+                                            dataset_uuid=str(uuid.uuid4()),
+                                            parent=parent),
+                                 genome, seen_types | {kid.dataset_type_id}))
+            if kids:
+                self.bulk_create_datasets([ds for ds, _, _ in kids], batch_size=batch_size)
+                created.extend(kids)
+            level = kids
+        GenomeDataset.objects.bulk_create([GenomeDataset(genome=genome, dataset=ds) for ds, genome, _ in created],
+                                          batch_size=batch_size)
+        return [ds for ds, _, _ in created]
 
 
 class Dataset(models.Model):
@@ -171,6 +313,7 @@ class Dataset(models.Model):
         RELEASED = 'RELEASED', 'Released'
 
     objects = DatasetManager()
+    release_lock = ('dataset', 'pk')
     dataset_id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=128)
     version = models.CharField(max_length=128, blank=True, null=True)
@@ -181,7 +324,7 @@ class Dataset(models.Model):
     status = models.CharField(max_length=12, choices=DatasetStatus.choices, default=DatasetStatus.SUBMITTED)
     genomes = models.ManyToManyField('Genome', through='GenomeDataset')
     dataset_type = models.ForeignKey('DatasetType', models.DO_NOTHING)
-    dataset_uuid = UUIDField(default=str(uuid.uuid4()), editable=False)
+    dataset_uuid = UUIDField(default=uuid.uuid4, editable=False)
     parent = models.ForeignKey('Dataset', default=None, null=True, db_column='parent_id',
                                on_delete=models.CASCADE)
 
@@ -189,14 +332,12 @@ class Dataset(models.Model):
         db_table = 'dataset'
 
     def save(self, *args, **kwargs):
-        if self.pk and self.genomes.filter(releases__isnull=False).exists():
+        if self.pk and is_released('dataset', self.pk):
             raise ValidationError('Released data cannot be modified')
-        else:
-            created = True
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.genomes.filter(releases__isnull=False).exists():
+        if is_released('dataset', self.pk):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -208,6 +349,8 @@ class Dataset(models.Model):
 
 
 class DatasetAttribute(models.Model):
+    objects = ReleaseLockQuerySet.as_manager()
+    release_lock = ('dataset', 'dataset_id')
     dataset_attribute_id = models.AutoField(primary_key=True)
     value = models.CharField(max_length=255)
     attribute = models.ForeignKey('Attribute', on_delete=models.CASCADE, related_name='datasets_set')
@@ -219,12 +362,12 @@ class DatasetAttribute(models.Model):
 
     def save(self, *args, **kwargs):
         if self.pk is not None:
-            if self.dataset.genomes.filter(releases__isnull=False).exists():
+            if is_released('dataset', self.dataset_id):
                 raise ValidationError('Released data cannot be modified')
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.dataset.genomes.filter(releases__isnull=False).exists():
+        if is_released('dataset', self.dataset_id):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -303,6 +446,8 @@ class EnsemblSite(models.Model):
 
 
 class Genome(models.Model):
+    objects = ReleaseLockQuerySet.as_manager()
+    release_lock = ('genome', 'pk')
     genome_id = models.AutoField(primary_key=True)
     genome_uuid = UUIDField(default=str(uuid.uuid4()), editable=False, unique=True)
     assembly = models.ForeignKey(Assembly, on_delete=models.CASCADE)
@@ -314,14 +459,21 @@ class Genome(models.Model):
     production_name = models.CharField(max_length=255)
     genebuild_version = models.CharField(max_length=64, null=True, unique=False)
     genebuild_date = models.CharField(max_length=20, null=True, unique=False)
+    # Denormalized from genome_release, kept up to date by the GenomeRelease signals and queryset below
+    is_released = models.BooleanField(default=False, editable=False)
 
     def save(self, *args, **kwargs):
-        if self.pk is not None and self.releases.exists():
+        if self.pk is not None and is_released('genome', self.pk):
             raise ValidationError('Released data cannot be modified')
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            # is_released is only written by update_released_flags, never from a possibly stale instance
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'is_released']
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.releases.exists():
+        if is_released('genome', self.pk):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -341,6 +493,8 @@ class GenomeDataset(models.Model):
             )
         ]
 
+    objects = ReleaseLockQuerySet.as_manager()
+    release_lock = ('genome', 'genome_id')
     genome_dataset_id = models.AutoField(primary_key=True)
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='genome_datasets')
     genome = models.ForeignKey(Genome, on_delete=models.CASCADE)
@@ -348,12 +502,12 @@ class GenomeDataset(models.Model):
     is_current = models.BooleanField(default=False)
 
     def save(self, *args, **kwargs):
-        if self.pk is not None and self.genome.releases.exists():
+        if self.pk is not None and is_released('genome', self.genome_id):
             raise ValidationError('Released data cannot be modified')
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.genome.releases.exists():
+        if is_released('genome', self.genome_id):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -369,6 +523,36 @@ class GenomeDataset(models.Model):
         return f"{self.release.version} [{self.release.status}]" if self.release else 'Unreleased'
 
 
+class GenomeReleaseQuerySet(models.QuerySet):
+    """
+    QuerySet keeping the `Genome.is_released` flags up to date on bulk_create() and update(), which send no signal.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        update_released_flags({obj.genome_id for obj in objs})
+        return objs
+
+    def update(self, **kwargs):
+        # the genomes the entries are moved from, and to
+        rows = dict(self.values_list('pk', 'genome_id'))
+        updated = super().update(**kwargs)
+        moved = GenomeRelease._base_manager.using(self.db).filter(pk__in=rows).values_list('genome_id', flat=True)
+        update_released_flags(set(rows.values()) | set(moved))
+        return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        genome_ids = set(self.values_list('genome_id', flat=True))
+        deleted = super().delete()
+        update_released_flags(genome_ids)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class GenomeRelease(models.Model):
     class Meta:
         constraints = [
@@ -377,13 +561,14 @@ class GenomeRelease(models.Model):
             )
         ]
 
+    objects = GenomeReleaseQuerySet.as_manager()
     genome_release_id = models.AutoField(primary_key=True)
     genome = models.ForeignKey(Genome, on_delete=models.CASCADE)
     release = models.ForeignKey(EnsemblRelease, on_delete=models.CASCADE)
     is_current = models.BooleanField(default=False)
 
     def delete(self, *args, **kwargs):
-        if self.genome.releases.exists():
+        if is_released('genome', self.genome_id):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -403,6 +588,8 @@ class GenomeRelease(models.Model):
 
 
 class Organism(models.Model):
+    objects = ReleaseLockQuerySet.as_manager()
+    release_lock = ('organism', 'pk')
     organism_id = models.AutoField(primary_key=True)
     taxonomy_id = models.IntegerField()
     species_taxonomy_id = models.IntegerField(blank=True, null=True)
@@ -419,12 +606,12 @@ class Organism(models.Model):
 
     def save(self, *args, **kwargs):
         if self.pk is not None:
-            if self.genome_set.filter(releases__isnull=False).exists():
+            if is_released('organism', self.pk):
                 raise ValidationError('Released data cannot be modified')
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.genome_set.filter(releases__isnull=False).exists():
+        if is_released('organism', self.pk):
             raise ValidationError('Released data cannot be deleted')
         super().delete(*args, **kwargs)
 
@@ -478,3 +665,75 @@ class OrganismGroupMember(models.Model):
 
     def __str__(self):
         return str(self.organism_group_member_id)
+
+
+class SearchDocument(models.Model):
+    """
+    Searchable text of a dataset or a genome, full text indexed (see search.py).
+    """
+
+    class Kind(models.TextChoices):
+        DATASET = 'dataset', 'Dataset'
+        GENOME = 'genome', 'Genome'
+
+    search_document_id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=8, choices=Kind.choices)
+    object_id = models.IntegerField()
+    text = models.TextField()
+
+    class Meta:
+        db_table = 'search_document'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_document')
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+def update_released_flags(genome_ids=None):
+    """
+    Recompute the denormalized `Genome.is_released` flag from genome_release, for the `genome_ids` genomes or all of
+    them. Returns the number of genomes whose flag changed.
+    """
+    genomes = Genome._base_manager.all()
+    if genome_ids is not None:
+        genomes = genomes.filter(pk__in=genome_ids)
+    released = GenomeRelease.objects.values('genome_id')
+    changed = genomes.filter(is_released=False, pk__in=released).update(is_released=True)
+    changed += genomes.filter(is_released=True).exclude(pk__in=released).update(is_released=False)
+    if getattr(_release_lock, 'cache', None):
+        _release_lock.cache.clear()
+    return changed
+
+
+@receiver(pre_save, sender=GenomeRelease)
+def genome_release_saving(sender, instance, raw=False, **kwargs):
+    # remember the genome a release entry is moved from
+    instance._previous_genome_id = None
+    if instance.pk is not None and not raw:
+        instance._previous_genome_id = GenomeRelease.objects.filter(pk=instance.pk) \
+            .values_list('genome_id', flat=True).first()
+
+
+@receiver(post_save, sender=GenomeRelease)
+def genome_release_saved(sender, instance, created, **kwargs):
+    if created:
+        Genome._base_manager.filter(pk=instance.genome_id).update(is_released=True)
+        if getattr(_release_lock, 'cache', None):
+            _release_lock.cache.clear()
+    else:
+        update_released_flags({instance.genome_id, getattr(instance, '_previous_genome_id', None)} - {None})
+
+
+@receiver(post_delete, sender=GenomeRelease)
+def genome_release_deleted(sender, instance, **kwargs):
+    update_released_flags([instance.genome_id])
+
+
+@receiver(post_save, sender=GenomeDataset)
+@receiver(post_delete, sender=GenomeDataset)
+def genome_dataset_changed(sender, instance, **kwargs):
+    # Attaching a dataset to a released genome releases it
+    if getattr(_release_lock, 'cache', None):
+        _release_lock.cache.pop(('dataset', instance.dataset_id), None)
@@ -0,0 +1,296 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+Indexed search of datasets and genomes.
+
+Searching datasets with `icontains` over the genome, organism and assembly columns means a `LIKE '%term%'` on each
+column of a many-to-many join, deduplicated with DISTINCT, which no index can serve. Instead each dataset and each
+genome has a `SearchDocument` row holding all its searchable values, full text indexed: an FTS5 table kept in sync by
+triggers on SQLite, a FULLTEXT index on MySQL. A search is a single index lookup returning the matching primary keys,
+used as `pk IN (...)` by the admin and the API.
+
+Documents and search terms are split into words the same way whatever the backend, on any character other than a
+letter or a digit (FTS5 splits on `_`, MySQL does not): `GCA_000001405.29` is stored as `GCA 000001405 29`. Each word
+of the term has to match the start of a word of the document, in any order (`GCA_0000`, `Homo sap`, a full UUID).
+Unlike the former `icontains` search, the middle of a word does not match (`1405` does not find `GCA_000001405`).
+
+Documents are updated by the signals below, once per object when the transaction commits however many times it is
+saved. Bulk inserts (see `DatasetManager`) are indexed with `index_datasets()`/`index_genomes()`, and all the
+documents can be rebuilt with the `rebuild_search_index` command.
+"""
+import re
+import threading
+
+from django.db import connections, router, transaction
+from django.db.models import Prefetch
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ensembl.production.metadata.admin.models import Assembly, Dataset, Genome, GenomeDataset, Organism, \
+    SearchDocument
+from ensembl.production.ncbi_taxonomy.api.utils import chunks
+
+DATASET = SearchDocument.Kind.DATASET
+GENOME = SearchDocument.Kind.GENOME
+FTS_TABLE = 'search_document_fts'
+FULLTEXT_INDEX = 'search_document_text'
+DEFAULT_CHUNK_SIZE = 500
+
+# Objects to index when the current transaction commits, per kind
+_pending = threading.local()
+
+
+def search_connection():
+    return connections[router.db_for_write(SearchDocument)]
+
+
+def create_search_index(connection):
+    """
+    Create the full text index of the search_document table if missing, as migration 0023 does, for the databases
+    created without migrations. Run by `rebuild_search_index`.
+    """
+    table = SearchDocument._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                           f"text, content='{table}', content_rowid='search_document_id')")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {table} BEGIN "
+                           f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.search_document_id, new.text); END")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {table} BEGIN "
+                           f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+                           f"VALUES ('delete', old.search_document_id, old.text); END")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE ON {table} BEGIN "
+                           f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+                           f"VALUES ('delete', old.search_document_id, old.text); "
+                           f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.search_document_id, new.text); END")
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() '
+                           'AND table_name = %s AND index_name = %s', [table, FULLTEXT_INDEX])
+            if not cursor.fetchone()[0]:
+                cursor.execute(f'ALTER TABLE {table} ADD FULLTEXT INDEX {FULLTEXT_INDEX} (text)')
+
+
+def drop_search_index(connection):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def words(text):
+    """
+    The indexed words of `text`: runs of letters and digits.
+    """
+    return re.findall(r'[^\W_]+', text)
+
+
+def match_expression(term, vendor):
+    """
+    Full text query matching the documents holding all the words of `term`, each as a word prefix.
+    """
+    if vendor == 'sqlite':
+        return ' '.join(f'"{word}"*' for word in words(term))
+    # MySQL boolean mode
+    return ' '.join(f'+{word}*' for word in words(term))
+
+
+def search(queryset, kind, term):
+    """
+    Filter `queryset` (datasets or genomes, as per `kind`) down to the objects whose document matches `term`.
+    """
+    vendor = search_connection().vendor
+    table = SearchDocument._meta.db_table
+    if vendor not in ('sqlite', 'mysql'):
+        # no full text index: substring search of each word
+        documents = SearchDocument.objects.filter(kind=kind)
+        for word in words(term):
+            documents = documents.filter(text__icontains=word)
+        return queryset.filter(pk__in=documents.values('object_id'))
+    expression = match_expression(term, vendor)
+    if not expression:
+        return queryset.none()
+    if vendor == 'sqlite':
+        sql = f'SELECT object_id FROM {table} WHERE kind = %s AND search_document_id IN ' \
+              f'(SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'
+    else:
+        sql = f'SELECT object_id FROM {table} WHERE kind = %s AND MATCH (text) AGAINST (%s IN BOOLEAN MODE)'
+    return queryset.filter(pk__in=RawSQL(sql, [kind, expression]))
+
+
+def document_text(values):
+    return ' '.join(word for value in values if value for word in words(str(value)))
+
+
+def genome_values(genome):
+    assembly = genome.assembly
+    organism = genome.organism
+    return [genome.genome_uuid, organism.common_name, organism.biosample_id, organism.scientific_name,
+            assembly.accession, assembly.name, assembly.tol_id, assembly.ensembl_name]
+
+
+def dataset_document(dataset):
+    values = [dataset.dataset_uuid]
+    for genome in dataset.genomes.all():
+        values.extend(genome_values(genome))
+    return document_text(values)
+
+
+def genome_document(genome):
+    return document_text(genome_values(genome) + [genome.production_name])
+
+
+def dataset_queryset():
+    return Dataset.objects.prefetch_related(
+        Prefetch('genomes', queryset=Genome.objects.select_related('assembly', 'organism')))
+
+
+def genome_queryset():
+    return Genome.objects.select_related('assembly', 'organism')
+
+
+INDEXED = {
+    DATASET: (dataset_queryset, dataset_document),
+    GENOME: (genome_queryset, genome_document),
+}
+
+
+def write_documents(kind, object_ids, objects):
+    """
+    Replace the documents of `object_ids` with those of `objects`, the ones still existing.
+    """
+    _, document = INDEXED[kind]
+    connection = search_connection()
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            # plain DELETE, as for bulk_create no signal is needed for the documents
+            cursor.execute(f'DELETE FROM {SearchDocument._meta.db_table} WHERE kind = %s AND object_id IN '
+                           f'({", ".join(["%s"] * len(object_ids))})', [kind, *object_ids])
+        SearchDocument.objects.using(connection.alias).bulk_create([
+            SearchDocument(kind=kind, object_id=obj.pk, text=document(obj)) for obj in objects
+        ])
+
+
+def index(kind, object_ids):
+    """
+    Write the documents of the given datasets or genomes, removing those of the ones which do not exist anymore.
+    """
+    queryset, _ = INDEXED[kind]
+    for chunk in chunks(sorted(set(object_ids))):
+        write_documents(kind, chunk, queryset().filter(pk__in=chunk))
+
+
+def index_pending():
+    pending = getattr(_pending, 'ids', None) or {}
+    _pending.ids = {}
+    for kind, object_ids in pending.items():
+        index(kind, object_ids)
+
+
+def index_on_commit(kind, object_ids):
+    """
+    Write the documents of the given datasets or genomes when the current transaction commits (right away in
+    autocommit mode), along with all the other objects changed by the transaction.
+    """
+    if getattr(_pending, 'ids', None) is None:
+        _pending.ids = {}
+    _pending.ids.setdefault(kind, set()).update(object_ids)
+    # the first callback indexes everything, the others find nothing left (as do those of a rolled back transaction)
+    transaction.on_commit(index_pending, using=search_connection().alias)
+
+
+def index_datasets(dataset_ids):
+    index_on_commit(DATASET, dataset_ids)
+
+
+def index_genomes(genome_ids):
+    index_on_commit(GENOME, genome_ids)
+
+
+def rebuild(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Recreate the full text index and all the documents, in chunks of `chunk_size` objects read by primary key
+    order. Returns the number of documents written for each kind.
+    """
+    connection = search_connection()
+    counts = {}
+    with transaction.atomic(using=connection.alias):
+        create_search_index(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SearchDocument._meta.db_table}')
+        for kind, (queryset, _) in INDEXED.items():
+            counts[kind] = 0
+            last_id = 0
+            while True:
+                chunk = list(queryset().filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+                if not chunk:
+                    break
+                write_documents(kind, [obj.pk for obj in chunk], chunk)
+                counts[kind] += len(chunk)
+                last_id = chunk[-1].pk
+        if connection.vendor == 'sqlite':
+            # documents written before the index was created are not in it
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return counts
+
+
+class IndexedSearchMixin(object):
+    """
+    ModelAdmin mixin searching the `search_kind` documents rather than the `search_fields` (which still enable the
+    search box). No DISTINCT is needed as no join is added.
+    """
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search(queryset, self.search_kind, search_term), False
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+def dataset_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_datasets([instance.pk])
+
+
+@receiver(post_save, sender=GenomeDataset)
+@receiver(post_delete, sender=GenomeDataset)
+def genome_dataset_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_datasets([instance.dataset_id])
+
+
+@receiver(post_save, sender=Genome)
+@receiver(post_delete, sender=Genome)
+def genome_changed(sender, instance, signal, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    index_genomes([instance.pk])
+    if signal is post_save and not created:
+        # an existing genome may have been moved to another assembly or organism
+        # (deleted genomes are unlinked from their datasets first, by cascade)
+        index_datasets(GenomeDataset.objects.filter(genome_id=instance.pk).values_list('dataset_id', flat=True))
+
+
+@receiver(post_save, sender=Organism)
+@receiver(post_save, sender=Assembly)
+def genome_part_saved(sender, instance, created, raw=False, **kwargs):
+    # deletions cascade to the genomes, whose own signals update the documents
+    if raw or created:
+        return
+    field = 'organism_id' if sender is Organism else 'assembly_id'
+    index_genomes(Genome.objects.filter(**{field: instance.pk}).values_list('pk', flat=True))
+    index_datasets(GenomeDataset.objects.filter(**{f'genome__{field}': instance.pk})
+                   .values_list('dataset_id', flat=True).distinct())
@@ -9,16 +9,32 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+import json
+import tempfile
 import uuid
+from io import StringIO
+from unittest import mock
 
+from django.contrib.admin import site
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient, APITestCase
 
+from ensembl.production.metadata.admin.admin import GenomeReleaseInLine, display_genome_uuid
+from ensembl.production.metadata.admin.api.filters import in_chunks
 from ensembl.production.metadata.admin.models import Dataset, Attribute, DatasetAttribute, DatasetSource, Organism, \
-    Assembly, Genome
+    Assembly, AssemblySequence, Genome, DatasetType, GenomeDataset, GenomeRelease, EnsemblRelease, EnsemblSite, \
+    OrganismGroup, OrganismGroupMember, SearchDocument, release_lock_cache
+from ensembl.production.ncbi_taxonomy.api.utils import TaxonomyUtils
+from ensembl.production.ncbi_taxonomy.index import TaxonomyIndex
+from ensembl.production.ncbi_taxonomy.models import TaxonomyNode
 
 
 class GenomeViewSetTestCase(APITestCase):
@@ -26,6 +42,7 @@ class GenomeViewSetTestCase(APITestCase):
     databases = ['metadata', 'ncbi_taxonomy']
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
     def test_genome_viewset_get(self):
@@ -39,6 +56,242 @@ class GenomeViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIsNotNone(response.data)
 
+    def test_genome_viewset_query_count(self):
+        # count + genomes with their assembly and organism + releases + datasets
+        for limit in (5, 20):
+            with self.assertNumQueries(4, using='metadata'):
+                response = self.client.get(reverse('ensembl_metadata:genome-list'), {'limit': limit})
+            self.assertEqual(len(response.data['results']), min(limit, 19))
+        genome_uuid = 'a7335667-93e7-11ec-a39d-005056b38ce3'
+        response = self.client.get(reverse('ensembl_metadata:genome-detail', args=[genome_uuid]))
+        genome = Genome.objects.get(genome_uuid=genome_uuid)
+        self.assertEqual(sorted(response.data['datasets']), sorted(
+            reverse('ensembl_metadata:dataset-detail', args=[dataset.dataset_uuid], request=response.wsgi_request)
+            for dataset in genome.datasets.all()))
+        self.assertEqual(response.data['assembly']['accession'], genome.assembly.accession)
+
+    def test_genome_export(self):
+        response = self.client.get(reverse('ensembl_metadata:genome-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        genomes = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(genomes), 19)
+        genome = next(genome for genome in genomes if genome['genome_uuid'] == 'a7335667-93e7-11ec-a39d-005056b38ce3')
+        self.assertEqual(genome['releases'][0]['version'], '108.0')
+        self.assertEqual(len(genome['datasets']), GenomeDataset.objects.filter(genome__genome_id=86).count())
+        self.assertTrue(any(dataset['attributes'] for dataset in genome['datasets']))
+
+    def test_export_registry_command(self):
+        out = StringIO()
+        with CaptureQueriesContext(connections['metadata']) as context:
+            call_command('export_registry', chunk_size=5, stdout=out, stderr=StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 19)
+        # 4 chunks: genomes, releases, datasets and attributes, then the last empty chunk
+        self.assertEqual(len(context.captured_queries), 4 * 4 + 1)
+
+
+class GenomeTaxonFilterTestCase(APITestCase):
+    fixtures = ['django.json', 'ensembl_genome_data.json', 'ncbi_taxonomy.json']
+    databases = ['metadata', 'ncbi_taxonomy']
+
+    def setUp(self):
+        cache.clear()
+        TaxonomyIndex.clear()
+        # Homo sapiens, under Euarchontoglires
+        TaxonomyNode.objects.create(taxon_id=9606, parent_id=314146, rank='species', genbank_hidden_flag=0,
+                                    left_index=4517814, right_index=4517815, root_id=1)
+
+    def tearDown(self):
+        TaxonomyIndex.clear()
+
+    def genome_ids(self, **params):
+        response = self.client.get(reverse('ensembl_metadata:genome-list'), dict(params, limit=100))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        genome_uuids = [genome['genome_uuid'] for genome in response.data['results']]
+        return sorted(Genome.objects.filter(genome_uuid__in=genome_uuids).values_list('genome_id', flat=True))
+
+    def test_taxon_filter(self):
+        human_ids = sorted(Genome.objects.filter(organism__taxonomy_id=9606).values_list('genome_id', flat=True))
+        for index_enabled in (True, False):
+            with self.settings(TAXONOMY_INDEX=index_enabled):
+                self.assertEqual(self.genome_ids(taxon=7742, descendants=1), human_ids)
+                self.assertEqual(self.genome_ids(taxon='314145,314146', descendants='true'), human_ids)
+                self.assertEqual(self.genome_ids(taxon=314145, descendants=1), [])
+                self.assertEqual(self.genome_ids(taxon=7742, descendants=0), [])
+                self.assertEqual(self.genome_ids(taxon='9606,6239'), human_ids + [203])
+                self.assertEqual(self.genome_ids(taxon=7742, descendants=1, release=108), [31, 86])
+        response = self.client.get(reverse('ensembl_metadata:genome-list'), {'taxon': 'Vertebrata'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('ensembl_metadata:genome-list'), {'release': 'latest'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_release_on_several_sites(self):
+        site = EnsemblSite.objects.create(name='mirror', label='Mirror', uri='https://mirror.example.org')
+        mirror = EnsemblRelease.objects.create(version=108, site=site, release_type='integrated')
+        GenomeRelease.objects.create(genome_id=31, release=mirror)
+        response = self.client.get(reverse('ensembl_metadata:genome-list'),
+                                   {'taxon': 7742, 'descendants': 1, 'release': 108})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_clades(self):
+        humans = Genome.objects.filter(organism__taxonomy_id=9606)
+        expected = {'organisms': humans.values('organism').distinct().count(), 'genomes': humans.count(),
+                    'datasets': GenomeDataset.objects.filter(genome__in=humans).values('dataset').distinct().count()}
+        url = reverse('ensembl_metadata:genome-clades')
+        for index_enabled in (True, False):
+            with self.settings(TAXONOMY_INDEX=index_enabled):
+                response = self.client.get(url, {'taxon': 7742})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual({key: response.data[key] for key in expected}, expected)
+                self.assertEqual(response.data['scientific_name'], 'Vertebrata')
+                ancestors = TaxonomyUtils.fetch_ancestor_ids(9606)[::-1]
+                lineage = ancestors[ancestors.index(7742):] + [9606]
+                self.assertEqual([clade['taxon_id'] for clade in response.data['clades']], lineage[1:])
+                self.assertEqual([clade['parent_id'] for clade in response.data['clades']], lineage[:-1])
+                self.assertTrue(all(clade['genomes'] == expected['genomes'] for clade in response.data['clades']))
+                response = self.client.get(url, {'taxon': 1, 'rank': 'superorder', 'release': 108})
+                self.assertEqual(response.data['genomes'], 2)
+                self.assertEqual(response.data['datasets'], GenomeDataset.objects.filter(
+                    genome__genomerelease__release__version=108, release__version=108).values('dataset')
+                                 .distinct().count())
+                self.assertEqual([(clade['scientific_name'], clade['genomes']) for clade in response.data['clades']],
+                                 [('Euarchontoglires', 2)])
+                response = self.client.get(url, {'taxon': 314145})
+                self.assertEqual((response.data['genomes'], response.data['clades']), (0, []))
+        self.assertEqual(self.client.get(url, {'taxon': 0}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_clades_shared_dataset(self):
+        # Caenorhabditis elegans, simplified to a child of Ecdysozoa
+        TaxonomyNode.objects.create(taxon_id=6239, parent_id=1206794, rank='species', genbank_hidden_flag=0,
+                                    left_index=2375584, right_index=2375585, root_id=1)
+        gained = {6239, 1206794, 33317}
+        url = reverse('ensembl_metadata:genome-clades')
+        before = self.client.get(url, {'taxon': 1}).data
+        self.assertIn(6239, [clade['taxon_id'] for clade in before['clades']])
+        # a human dataset also attached to the C. elegans genome
+        GenomeDataset.objects.create(genome_id=203, dataset=GenomeDataset.objects.filter(
+            genome__organism__taxonomy_id=9606).first().dataset)
+        for index_enabled in (True, False):
+            with self.settings(TAXONOMY_INDEX=index_enabled):
+                response = self.client.get(url, {'taxon': 1})
+                self.assertEqual(response.data['datasets'], before['datasets'])
+                datasets = {clade['taxon_id']: clade['datasets'] for clade in response.data['clades']}
+                # one more in the clades holding C. elegans but not Homo sapiens, the same from Bilateria up
+                self.assertEqual(datasets, {clade['taxon_id']: clade['datasets'] + (clade['taxon_id'] in gained)
+                                            for clade in before['clades']})
+
+    def test_in_chunks(self):
+        condition = in_chunks('organism__taxonomy_id', range(2500))
+        self.assertEqual([len(child[1]) for child in condition.children], [1000, 1000, 500])
+        self.assertEqual(condition.connector, 'OR')
+
+
+class ResponseCacheTestCase(APITestCase):
+    fixtures = ['django.json', 'ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='test_user', password='test')
+
+    def assertCached(self, url, hit, queries=None):
+        with CaptureQueriesContext(connections['metadata']) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], 'HIT' if hit else 'MISS')
+        if hit:
+            self.assertEqual(len(context.captured_queries), 0)
+        return response
+
+    def test_released_genome(self):
+        url = reverse('ensembl_metadata:genome-detail', args=['a7335667-93e7-11ec-a39d-005056b38ce3'])
+        response = self.assertCached(url, hit=False)
+        self.assertEqual(self.assertCached(url, hit=True).data, response.data)
+        self.assertEqual(self.client.get(reverse('ensembl_metadata:cache-stats')).data['hits'], 1)
+        # A dataset attached to a released genome changes its document
+        dataset = Dataset.objects.create(name='assembly', label='test', dataset_uuid=str(uuid.uuid4()),
+                                         dataset_type=DatasetType.objects.first(),
+                                         dataset_source=DatasetSource.objects.first())
+        GenomeDataset.objects.create(genome=Genome.objects.get(genome_id=86), dataset=dataset)
+        response = self.assertCached(url, hit=False)
+        self.assertIn(dataset.dataset_uuid, ''.join(response.data['datasets']))
+
+    def test_unreleased_dataset_invalidated_on_write(self):
+        dataset_uuid = '2ef7c056-847e-4742-a68b-18c3ece068aa'
+        url = reverse('ensembl_metadata:dataset-detail', args=[dataset_uuid])
+        self.assertCached(url, hit=False)
+        self.assertCached(url, hit=True)
+        # released entries are untouched by writes to unreleased data
+        released_url = reverse('ensembl_metadata:genome-detail', args=['a7335667-93e7-11ec-a39d-005056b38ce3'])
+        self.assertCached(released_url, hit=False)
+        DatasetAttribute.objects.create(dataset=Dataset.objects.get(dataset_uuid=dataset_uuid),
+                                        attribute=Attribute.objects.first(), value='cache.test')
+        self.assertCached(url, hit=False)
+        self.assertCached(released_url, hit=True)
+        response = self.client.put(url, {'user': 'test_user', 'dataset_attribute': [
+            {'name': 'cache.test', 'value': '1'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCached(url, hit=False)
+        self.assertCached(released_url, hit=True)
+        # nor by the models not rendered by the API, or new shared rows
+        OrganismGroup.objects.create(type='test', name='cache test')
+        DatasetType.objects.create(name='cache_test', label='cache test', topic='test')
+        self.assertCached(released_url, hit=True)
+        with self.settings(METADATA_API_CACHE_TTL=0):
+            cache.clear()
+            self.assertCached(url, hit=False)
+            self.assertCached(url, hit=False)
+
+    def test_released_dataset_write(self):
+        genome_uuid = 'a7335667-93e7-11ec-a39d-005056b38ce3'
+        released_url = reverse('ensembl_metadata:genome-detail', args=[genome_uuid])
+        self.assertCached(released_url, hit=False)
+        dataset = Dataset.objects.filter(genomes__genome_uuid=genome_uuid).first()
+        response = self.client.put(reverse('ensembl_metadata:dataset-detail', args=[dataset.dataset_uuid]), {
+            'user': 'test_user', 'dataset_attribute': [{'name': 'cache.test', 'value': '1'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCached(released_url, hit=False)
+        self.assertCached(released_url, hit=True)
+        dataset_type = DatasetType.objects.first()
+        dataset_type.save()
+        self.assertCached(released_url, hit=False)
+
+    def test_released_dataset_list(self):
+        url = reverse('ensembl_metadata:dataset-list') + '?released=1'
+        self.assertCached(url, hit=False)
+        self.assertCached(url, hit=True)
+        response = self.client.get(reverse('ensembl_metadata:dataset-list'))
+        self.assertNotIn('X-Cache', response)
+
+    def test_released_dataset_list_membership(self):
+        url = reverse('ensembl_metadata:dataset-list') + '?released=1'
+        released = self.assertCached(url, hit=False).data['count']
+        self.assertEqual(released, Dataset.objects.filter(genomes__is_released=True).distinct().count())
+        genome = Genome.objects.get(genome_uuid='56d9b469-097f-48a7-8501-c8416bcbcdfb')
+        self.assertFalse(genome.is_released)
+        genome_dataset = GenomeDataset.objects.filter(genome=genome).first()
+        # a dataset is only released along with its genome
+        genome_dataset.release = EnsemblRelease.objects.first()
+        genome_dataset.save()
+        self.assertEqual(self.assertCached(url, hit=True).data['count'], released)
+        GenomeRelease.objects.create(genome=genome, release=EnsemblRelease.objects.first())
+        response = self.assertCached(url, hit=False)
+        self.assertEqual(response.data['count'],
+                         Dataset.objects.filter(genomes__is_released=True).distinct().count())
+        self.assertGreater(response.data['count'], released)
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+                url = reverse('ensembl_metadata:genome-detail', args=['a7335667-93e7-11ec-a39d-005056b38ce3'])
+                self.assertCached(url, hit=False)
+                self.assertCached(url, hit=True)
+                self.assertEqual(self.client.get(reverse('ensembl_metadata:cache-stats')).data['backend'],
+                                 'django.core.cache.backends.filebased.FileBasedCache')
+
 
 class CascadeDeleteTestCase(TestCase):
     databases = ['default', 'metadata', 'ncbi_taxonomy']
@@ -79,11 +332,122 @@ class CascadeDeleteTestCase(TestCase):
             Genome.objects.get(pk=self.genome.pk)
 
 
+class ReleaseLockTestCase(TestCase):
+    fixtures = ['ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+
+    def test_released_flag(self):
+        self.assertTrue(Genome.objects.get(pk=4).is_released)
+        genome = Genome.objects.get(genome_uuid='56d9b469-097f-48a7-8501-c8416bcbcdfb')
+        self.assertFalse(genome.is_released)
+        genome_release = GenomeRelease.objects.create(genome=genome, release=EnsemblRelease.objects.get(pk=4))
+        genome.refresh_from_db()
+        self.assertTrue(genome.is_released)
+        # moved to another genome
+        other = Genome.objects.get(genome_uuid='63b4ffbf-0147-4aa7-b0af-7575bb822740')
+        genome_release.genome = other
+        genome_release.save()
+        genome.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((genome.is_released, other.is_released), (False, True))
+        stale = Genome.objects.get(pk=other.pk)
+        # bulk writes
+        GenomeRelease.objects.bulk_create([GenomeRelease(genome=genome, release=genome_release.release)])
+        genome.refresh_from_db()
+        self.assertTrue(genome.is_released)
+        GenomeRelease.objects.filter(genome=genome).delete()
+        genome.refresh_from_db()
+        self.assertFalse(genome.is_released)
+        GenomeRelease.objects.filter(pk=genome_release.pk).update(genome=genome)
+        genome.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((genome.is_released, other.is_released), (True, False))
+        # saving an instance read while released keeps the flag
+        self.assertTrue(stale.is_released)
+        stale.save()
+        other.refresh_from_db()
+        self.assertFalse(other.is_released)
+        # direct database writes send no signal, the command recomputes the flags
+        Genome._base_manager.filter(pk=genome.pk).update(is_released=False)
+        out = StringIO()
+        call_command('update_released_genomes', stdout=out)
+        self.assertIn('Updated the released flag of 1 genomes', out.getvalue())
+        genome.refresh_from_db()
+        self.assertTrue(genome.is_released)
+        genome_release.release.delete()
+        genome.refresh_from_db()
+        self.assertFalse(genome.is_released)
+
+    def test_released_data_guards(self):
+        genome = Genome.objects.get(pk=4)
+        dataset = genome.datasets.first()
+        for obj in (genome, genome.assembly, genome.organism, dataset, dataset.attributes_set.first(),
+                    genome.assembly.assemblysequence_set.first()):
+            if obj is None:
+                continue
+            with self.assertRaisesMessage(ValidationError, 'Released data cannot be modified'):
+                obj.save()
+            with self.assertRaisesMessage(ValidationError, 'Released data cannot be deleted'):
+                obj.delete()
+
+    def test_released_data_guards_cache(self):
+        dataset = Dataset.objects.get(dataset_uuid='2ef7c056-847e-4742-a68b-18c3ece068aa')
+        attributes = list(DatasetAttribute.objects.filter(dataset=dataset))
+        with release_lock_cache():
+            with CaptureQueriesContext(connections['metadata']) as context:
+                for attribute in attributes:
+                    attribute.save()
+        # One released check for the dataset, then one UPDATE per attribute
+        self.assertEqual(len(context.captured_queries), len(attributes) + 1)
+
+    def test_released_data_bulk_guards(self):
+        unreleased = DatasetAttribute.objects.filter(dataset__dataset_uuid='2ef7c056-847e-4742-a68b-18c3ece068aa')
+        with CaptureQueriesContext(connections['metadata']) as context:
+            self.assertEqual(unreleased.update(value='0'), 60)
+        # One set based released check, one UPDATE
+        self.assertEqual(len(context.captured_queries), 2)
+        released = DatasetAttribute.objects.filter(dataset__genomes__pk=4)
+        with self.assertRaisesMessage(ValidationError, 'Released data cannot be modified'):
+            (unreleased | released).update(value='0')
+        with self.assertRaisesMessage(ValidationError, 'Released data cannot be deleted'):
+            released.delete()
+        with self.assertRaisesMessage(ValidationError, 'Released data cannot be modified'):
+            Genome.objects.bulk_update(list(Genome.objects.all()), ['is_best'])
+        with self.assertRaisesMessage(ValidationError, 'Released data cannot be deleted'):
+            Organism.objects.filter(genome__pk=4).delete()
+        sequences = AssemblySequence.objects.filter(assembly__genome__pk=19)
+        self.assertEqual(sequences.update(is_circular=False), sequences.count())
+        Dataset.objects.filter(dataset_uuid='2ef7c056-847e-4742-a68b-18c3ece068aa').delete()
+        self.assertFalse(DatasetAttribute.objects.filter(dataset__dataset_uuid='2ef7c056-847e-4742-a68b-18c3ece068aa'))
+
+
+class DatasetFactoryTestCase(TestCase):
+    fixtures = ['ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+
+    def test_create_child_datasets(self):
+        genome = Genome.objects.get(genome_uuid='56d9b469-097f-48a7-8501-c8416bcbcdfb')
+        genebuild = Dataset.objects.create(name='genebuild', label='genebuild',
+                                           dataset_type=DatasetType.objects.get(name='genebuild'),
+                                           dataset_source=DatasetSource.objects.first())
+        with CaptureQueriesContext(connections['metadata']) as context:
+            kids = Dataset.objects.create_child_datasets(genebuild, genome)
+        # types tree + (insert + pk fetch back) per level + genome links, whatever the number of children
+        self.assertLessEqual(len(context.captured_queries), 6)
+        self.assertEqual(len(kids), 19)
+        self.assertEqual(len({str(kid.dataset_uuid) for kid in kids}), len(kids), "Each child has its own UUID")
+        for kid in Dataset.objects.filter(pk__in=[kid.pk for kid in kids]).select_related('dataset_type', 'parent'):
+            self.assertEqual(kid.dataset_type.parent_id, kid.parent.dataset_type_id)
+            self.assertEqual(kid.label, f"{kid.name} from {kid.parent.dataset_type.name}")
+        self.assertEqual(GenomeDataset.objects.filter(genome=genome, dataset__in=kids).count(), 19)
+
+
 class DatasetViewSetTestCase(APITestCase):
     fixtures = ['django.json', 'ensembl_genome_data.json']
     databases = ['default', 'metadata', 'ncbi_taxonomy']
 
     def setUp(self):
+        cache.clear()
         # self.client = APIClient()
         self.user = User.objects.create_user(username='test_user', password='test', is_superuser=True, is_staff=True)
         self.client.login(username='test_user', password='test')
@@ -94,12 +458,39 @@ class DatasetViewSetTestCase(APITestCase):
         self.assertIsNotNone(response.data)
         self.assertEqual(response.data['count'], 86)
 
+    def test_dataset_viewset_cursor_pagination(self):
+        url = reverse('ensembl_metadata:dataset-list') + '?cursor=&page_size=20'
+        dataset_uuids = []
+        while url:
+            # No count query, one query per page for the datasets + one for their genome datasets
+            with self.assertNumQueries(2, using='metadata'):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            dataset_uuids.extend(dataset['dataset_uuid'] for dataset in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(dataset_uuids), 86)
+        self.assertEqual(len(set(dataset_uuids)), 86)
+
     def test_dataset_viewset_get_individual(self):
         dataset_uuid = '02104faf-3fee-4f28-b53c-605843dac941'
         response = self.client.get(reverse('ensembl_metadata:dataset-detail', args=[dataset_uuid]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIsNotNone(response.data)
 
+    def test_dataset_viewset_query_count(self):
+        # count + datasets with their source and type + genome datasets with their genome and release
+        for limit in (5, 50):
+            with self.assertNumQueries(3, using='metadata'):
+                response = self.client.get(reverse('ensembl_metadata:dataset-list'), {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+        # + released check for the response cache
+        with self.assertNumQueries(3, using='metadata'):
+            response = self.client.get(reverse('ensembl_metadata:dataset-detail',
+                                               args=['02104faf-3fee-4f28-b53c-605843dac941']))
+        self.assertTrue(response.data['genome_datasets'])
+        self.assertIn('release_version', response.data['genome_datasets'][0])
+
     def test_dataset_create_no_genome(self):
         payload = {
             'user': 'test_user',
@@ -259,3 +650,371 @@ class DatasetViewSetTestCase(APITestCase):
                 value=attribute_data['value']
             )
             self.assertIsNotNone(dataset_attribute)
+
+    def test_dataset_update_batch(self):
+        dataset_uuid = '2ef7c056-847e-4742-a68b-18c3ece068aa'
+        url = reverse('ensembl_metadata:dataset-detail', kwargs={'dataset_uuid': dataset_uuid})
+        attributes = [{"name": f"qc_statistic_{i}", "value": str(i)} for i in range(100)]
+        with CaptureQueriesContext(connections['metadata']) as context:
+            response = self.client.put(url, {"user": "test_user", "dataset_attribute": attributes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(len(context.captured_queries), 20, "Attributes are upserted in bulk")
+        self.assertEqual(DatasetAttribute.objects.filter(dataset__dataset_uuid=dataset_uuid,
+                                                         attribute__name__startswith='qc_statistic_').count(), 100)
+
+        # Already populated attribute: nothing is written
+        payload = {"user": "test_user", "dataset_attribute": [{"name": "new_qc_statistic", "value": "1"},
+                                                              {"name": "qc_statistic_1", "value": "2"}]}
+        response = self.client.put(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'],
+                         'Error, qc_statistic_1 is already populated. Please use the admin pages to modify it.')
+        self.assertFalse(Attribute.objects.filter(name='new_qc_statistic').exists())
+        # A failing insert rolls back the attributes created before it
+        payload = {"user": "test_user", "dataset_attribute": [{"name": "new_qc_statistic", "value": "1"}]}
+        with mock.patch.object(DatasetAttribute.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.put(url, payload, format='json')
+        self.assertFalse(Attribute.objects.filter(name='new_qc_statistic').exists())
+
+    def _bulk_payload(self, size, genome_uuid='56d9b469-097f-48a7-8501-c8416bcbcdfb'):
+        return [{
+            'genome_uuid': genome_uuid,
+            'name': f'Bulk Dataset {i}',
+            'label': f'Bulk dataset {i}',
+            'dataset_type': 'variation',
+            'dataset_source': {'name': f'/bulk/file_{size}_{i}.vcf', 'type': 'vcf'},
+            'dataset_attribute': [{'name': 'total_exons', 'value': str(i)}, {'name': f'bulk_{i}', 'value': '1'}]
+        } for i in range(size)]
+
+    def test_dataset_bulk_create(self):
+        url = reverse('ensembl_metadata:dataset-bulk')
+        query_counts = []
+        for size in (2, 10):
+            with CaptureQueriesContext(connections['metadata']) as context:
+                response = self.client.post(url, {'user': 'test_user', 'datasets': self._bulk_payload(size)},
+                                            format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['created'], size)
+            query_counts.append(len(context.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1], "Query count does not depend on the batch size")
+        dataset = Dataset.objects.get(dataset_uuid=response.data['results'][3]['dataset_uuid'])
+        self.assertEqual(dataset.name, 'Bulk Dataset 3')
+        self.assertEqual(dataset.dataset_set.count(), 2, "Children have been created")
+        self.assertEqual(set(dataset.attributes_set.values_list('attribute__name', 'value')),
+                         {('total_exons', '3'), ('bulk_3', '1')})
+
+    def test_dataset_bulk_create_errors(self):
+        datasets = self._bulk_payload(2) + self._bulk_payload(1, genome_uuid='eeb53722-0e6d-4970-972f-c840989e0ef6')
+        datasets.append(dict(datasets[0]))
+        datasets.append({'name': 'No genome'})
+        response = self.client.post(reverse('ensembl_metadata:dataset-bulk'),
+                                    {'user': 'test_user', 'datasets': datasets}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        results = response.data['results']
+        self.assertIn('dataset_uuid', results[0])
+        self.assertEqual(results[2]['error'], 'No Genome found with the provided UUID.')
+        self.assertIn('already exists', results[3]['error'])
+        self.assertIn('genome_uuid', results[4]['errors'])
+        response = self.client.post(reverse('ensembl_metadata:dataset-bulk'),
+                                    {'user': 'unknown', 'datasets': datasets}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with mock.patch('ensembl.production.metadata.admin.api.viewsets.dataset.BULK_MAX_DATASETS', 4):
+            response = self.client.post(reverse('ensembl_metadata:dataset-bulk'),
+                                        {'user': 'test_user', 'datasets': datasets}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_dataset_bulk_create_conflicts(self):
+        datasets = self._bulk_payload(3)
+        # a new source submitted with two types
+        datasets[1]['dataset_source'] = dict(datasets[0]['dataset_source'], type='gff3')
+        datasets[2]['dataset_attribute'].append({'name': 'total_exons', 'value': '2'})
+        response = self.client.post(reverse('ensembl_metadata:dataset-bulk'),
+                                    {'user': 'test_user', 'datasets': datasets}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        results = response.data['results']
+        self.assertEqual(DatasetSource.objects.get(name=datasets[0]['dataset_source']['name']).type, 'vcf')
+        self.assertIn('different type', results[1]['error'])
+        self.assertEqual(results[2]['errors']['dataset_attribute'], ['Duplicate values of attributes total_exons.'])
+
+    def test_dataset_bulk_create_atomic(self):
+        datasets = Dataset.objects.count()
+        with mock.patch.object(DatasetAttribute.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.post(reverse('ensembl_metadata:dataset-bulk'),
+                                 {'user': 'test_user', 'datasets': self._bulk_payload(2)}, format='json')
+        self.assertEqual(Dataset.objects.count(), datasets)
+
+
+class PaginatedInlineTestCase(TestCase):
+    fixtures = ['django.json', 'ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(username='danielp'))
+
+    def test_change_page(self):
+        query_counts = []
+        for release in EnsemblRelease.objects.filter(version__in=['108.0', '110.3']):
+            url = reverse('admin:ensembl_metadata_ensemblrelease_change', args=[release.pk])
+            with CaptureQueriesContext(connections['metadata']) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            query_counts.append(len(context.captured_queries))
+            self.assertContains(response, reverse('admin:ensembl_metadata_ensemblrelease_inline',
+                                                  args=[release.pk, 'genomereleaseinline']))
+            self.assertContains(response, reverse('admin:ensembl_metadata_ensemblrelease_inline',
+                                                  args=[release.pk, 'releasedatasetinline']))
+            self.assertNotContains(response, release.genomes.first().genome_uuid)
+        self.assertEqual(query_counts[0], query_counts[1], "Query count does not depend on the release size")
+
+    def test_inline_pages(self):
+        release = EnsemblRelease.objects.get(version='108.0')
+        genome_uuids = sorted(release.genomes.values_list('genome_uuid', flat=True))
+        url = reverse('admin:ensembl_metadata_ensemblrelease_inline', args=[release.pk, 'genomereleaseinline'])
+        with mock.patch.object(GenomeReleaseInLine, 'per_page', 3):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([row[0] for row in response.context['rows']],
+                             [display_genome_uuid(genome) for genome in
+                              Genome.objects.filter(genome_uuid__in=genome_uuids[:3]).order_by('genome_uuid')])
+            self.assertEqual(response.context['page'].paginator.num_pages, 3)
+            response = self.client.get(url, {'p': 3, 'o': '-genome_genome'})
+            self.assertEqual(len(response.context['rows']), 1)
+            self.assertIn(genome_uuids[0], response.context['rows'][0][0])
+            response = self.client.get(url, {'q': genome_uuids[1]})
+            self.assertEqual(len(response.context['rows']), 1)
+            self.assertContains(response, 'class="paginated-inline-link" href="?o=genome_genome&amp;q=')
+        response = self.client.get(reverse('admin:ensembl_metadata_ensemblrelease_inline',
+                                           args=[release.pk, 'releasedatasetinline']))
+        self.assertEqual(response.context['page'].paginator.count,
+                         GenomeDataset.objects.filter(release=release).count())
+        response = self.client.get(reverse('admin:ensembl_metadata_attribute_inline', args=[162, 'dattributeinline']))
+        self.assertEqual(response.context['page'].paginator.count, 29)
+        response = self.client.get(reverse('admin:ensembl_metadata_ensemblrelease_inline', args=[release.pk, 'other']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AdminQueryBudgetTestCase(TestCase):
+    """
+    Admin changelists and change views run a fixed number of queries, whatever the number of rows listed or of
+    objects related to the object shown.
+    """
+    fixtures = ['django.json', 'ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+    budget = 10
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(username='danielp'))
+        self.genome = Genome.objects.select_related('assembly', 'organism').get(genome_id=86)
+        self.dataset = self.genome.datasets.select_related('dataset_type', 'dataset_source').first()
+        self.attribute = self.dataset.attributes.first()
+        self.release = self.genome.releases.first()
+        self.group = OrganismGroup.objects.first()
+        self.objects = {
+            Genome: self.genome, Assembly: self.genome.assembly, Organism: self.genome.organism,
+            Dataset: self.dataset, DatasetSource: self.dataset.dataset_source, DatasetType: self.dataset.dataset_type,
+            Attribute: self.attribute, EnsemblRelease: self.release, OrganismGroup: self.group,
+            AssemblySequence: AssemblySequence.objects.filter(assembly=self.genome.assembly).first(),
+        }
+
+    def scale(self, size):
+        """
+        Add `size` rows to the changelists, and to the inlines of each object shown.
+        """
+        Organism.objects.bulk_create([
+            Organism(taxonomy_id=9606, common_name=f'scaled {i}', scientific_name=f'Scaled {i}',
+                     biosample_id=f'SCALED{i}', organism_uuid=str(uuid.uuid4())) for i in range(size)])
+        organisms = Organism.objects.filter(biosample_id__startswith='SCALED')
+        genomes = [Genome(assembly=self.genome.assembly, organism=organism if i % 2 else self.genome.organism,
+                          genome_uuid=str(uuid.uuid4()), production_name=f'scaled_{i}')
+                   for i, organism in enumerate(organisms)]
+        Genome.objects.bulk_create(genomes)
+        genomes = list(Genome.objects.filter(production_name__startswith='scaled_'))
+        GenomeRelease.objects.bulk_create([GenomeRelease(genome=genome, release=self.release) for genome in genomes])
+        OrganismGroupMember.objects.bulk_create([OrganismGroupMember(organism=organism, organism_group=self.group)
+                                                 for organism in organisms])
+        datasets = [Dataset(name=f'scaled_{i}', label=f'Scaled {i}', dataset_type=self.dataset.dataset_type,
+                            dataset_source=self.dataset.dataset_source, dataset_uuid=str(uuid.uuid4()))
+                    for i in range(size)]
+        Dataset.objects.bulk_create_datasets(datasets)
+        GenomeDataset.objects.bulk_create([GenomeDataset(genome=self.genome, dataset=dataset, release=self.release)
+                                           for dataset in datasets] +
+                                          [GenomeDataset(genome=genome, dataset=self.dataset) for genome in genomes])
+        Attribute.objects.bulk_create([Attribute(name=f'scaled_{i}', label=f'Scaled {i}', description='scaled',
+                                                 type='string') for i in range(size)])
+        DatasetAttribute.objects.bulk_create([DatasetAttribute(dataset=self.dataset, attribute=attribute, value='1')
+                                              for attribute in Attribute.objects.filter(name__startswith='scaled_')])
+        DatasetAttribute.objects.bulk_create([DatasetAttribute(dataset=dataset, attribute=self.attribute, value='1')
+                                              for dataset in datasets])
+        DatasetType.objects.bulk_create([DatasetType(name=f'scaled_{i}', label=f'Scaled {i}', topic='scaled',
+                                                     parent=self.dataset.dataset_type) for i in range(size)])
+
+    def query_counts(self):
+        counts = {}
+        for model, model_admin in site._registry.items():
+            if model._meta.app_label != 'ensembl_metadata':
+                continue
+            info = model._meta.app_label, model._meta.model_name
+            urls = [reverse('admin:%s_%s_changelist' % info)]
+            obj = self.objects.get(model) or model.objects.first()
+            urls.append(reverse('admin:%s_%s_change' % info, args=[obj.pk]))
+            for url in urls:
+                # list filter lookups not cached yet
+                cache.clear()
+                with CaptureQueriesContext(connections['metadata']) as context:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+                counts[url] = len(context.captured_queries)
+        return counts
+
+    def test_query_budget(self):
+        counts = self.query_counts()
+        self.scale(30)
+        self.assertEqual(self.query_counts(), counts)
+        for url, count in counts.items():
+            self.assertLessEqual(count, self.budget, url)
+
+
+class AdminListFilterTestCase(TestCase):
+    fixtures = ['django.json', 'ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username='danielp'))
+
+    def release_queries(self, url, params=None):
+        with CaptureQueriesContext(connections['metadata']) as context:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, [query['sql'] for query in context.captured_queries if
+                          query['sql'].startswith('SELECT') and 'FROM "ensembl_release"' in query['sql']]
+
+    def test_cached_lookups(self):
+        url = reverse('admin:ensembl_metadata_organism_changelist')
+        response, queries = self.release_queries(url)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.release_queries(url)
+        self.assertEqual(queries, [])
+        self.assertContains(response, '?ensembl_release=5')
+        EnsemblRelease.objects.create(version='113.0', release_type='integrated')
+        response, queries = self.release_queries(url)
+        self.assertEqual(len(queries), 1)
+        self.assertContains(response, '113.0')
+        release = EnsemblRelease.objects.get(version='108.0')
+        response = self.client.get(url, {'ensembl_release': release.pk})
+        self.assertEqual(response.context['cl'].result_count,
+                         Organism.objects.filter(genome__releases=release).distinct().count())
+
+    def test_organism_autocomplete(self):
+        organism = Organism.objects.get(pk=83)
+        url = reverse('admin:ensembl_metadata_genome_changelist')
+        with CaptureQueriesContext(connections['metadata']) as context:
+            response = self.client.get(url)
+        self.assertContains(response, 'data-field-name="organism"')
+        # organisms are only read joined to the listed genomes
+        self.assertFalse([query for query in context.captured_queries if 'FROM "organism"' in query['sql']])
+        response = self.client.get(url, {'organism': organism.pk})
+        self.assertEqual(response.context['cl'].result_count, Genome.objects.filter(organism=organism).count())
+        self.assertContains(response, f'<option value="{organism.pk}" selected>{organism}</option>', html=True)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'ensembl_metadata', 'model_name': 'genome', 'field_name': 'organism', 'term': organism.biosample_id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(str(organism.pk), [result['id'] for result in response.json()['results']])
+
+
+class SearchDocumentTestCase(APITestCase):
+    fixtures = ['django.json', 'ensembl_genome_data.json']
+    databases = ['default', 'metadata', 'ncbi_taxonomy']
+
+    def setUp(self):
+        cache.clear()
+        out = StringIO()
+        call_command('rebuild_search_index', chunk_size=7, stdout=out)
+        self.assertIn(f'Indexed {Dataset.objects.count()} datasets and {Genome.objects.count()} genomes',
+                      out.getvalue())
+        self.client.force_login(User.objects.get(username='danielp'))
+        self.genome = Genome.objects.select_related('assembly', 'organism').get(pk=19)
+
+    def admin_search(self, model_name, term):
+        with CaptureQueriesContext(connections['metadata']) as context:
+            response = self.client.get(reverse(f'admin:ensembl_metadata_{model_name}_changelist'), {'q': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # a single subquery, no join to deduplicate
+        self.assertFalse([query for query in context.captured_queries
+                          if 'search_document' in query['sql'] and 'DISTINCT' in query['sql']])
+        return set(response.context['cl'].queryset.values_list('pk', flat=True))
+
+    def test_admin_search(self):
+        accession = self.genome.assembly.accession
+        dataset_ids = set(Dataset.objects.filter(genomes=self.genome).values_list('pk', flat=True))
+        self.assertTrue(dataset_ids)
+        self.assertEqual(self.admin_search('dataset', accession), dataset_ids)
+        self.assertEqual(self.admin_search('dataset', str(self.genome.genome_uuid)), dataset_ids)
+        self.assertEqual(self.admin_search('genome', accession[:8]),
+                         set(Genome.objects.filter(assembly__accession__startswith=accession[:8])
+                             .values_list('pk', flat=True)))
+        self.assertEqual(self.admin_search('genome', 'Homo sap'),
+                         set(Genome.objects.filter(organism__scientific_name='Homo sapiens')
+                             .values_list('pk', flat=True)))
+        self.assertEqual(self.admin_search('genome', 'Homo sap unknown'), set())
+        self.assertEqual(self.admin_search('genome', '"-'), set())
+
+    def indexed(self):
+        # documents are written when the transaction commits
+        return self.captureOnCommitCallbacks(using='metadata', execute=True)
+
+    def test_signals(self):
+        dataset_ids = set(Dataset.objects.filter(genomes=self.genome).values_list('pk', flat=True))
+        assembly = self.genome.assembly
+        assembly.name = 'Renamed_assembly'
+        with self.indexed():
+            assembly.save()
+            self.assertEqual(self.admin_search('genome', 'Renamed_assembly'), set())
+        self.assertEqual(self.admin_search('genome', 'Renamed_assembly'), {self.genome.pk})
+        self.assertEqual(self.admin_search('dataset', 'renamed'), dataset_ids)
+        # split on underscores as on any other punctuation
+        self.assertEqual(self.admin_search('genome', 'assem rename'), {self.genome.pk})
+        self.assertIn('Renamed assembly', SearchDocument.objects.get(kind=SearchDocument.Kind.GENOME,
+                                                                     object_id=self.genome.pk).text)
+        dataset = Dataset.objects.get(pk=min(dataset_ids))
+        with self.indexed():
+            GenomeDataset.objects.filter(dataset=dataset).delete()
+        self.assertEqual(self.admin_search('dataset', 'renamed'), dataset_ids - {dataset.pk})
+        with self.indexed():
+            dataset.delete()
+        self.assertFalse(SearchDocument.objects.filter(kind=SearchDocument.Kind.DATASET, object_id=dataset.pk).exists())
+
+    def test_indexed_once(self):
+        with CaptureQueriesContext(connections['metadata']) as context:
+            with self.indexed():
+                response = self.client.post(reverse('ensembl_metadata:dataset-list'), {
+                    'user': 'danielp', 'genome_uuid': str(self.genome.genome_uuid), 'name': 'Indexed dataset',
+                    'label': 'Indexed dataset', 'dataset_type': 'variation',
+                    'dataset_source': {'name': 'indexed_source', 'type': 'core'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        # the dataset saved by the serializer and its children inserted in bulk, written at once
+        self.assertEqual(len([query for query in context.captured_queries
+                              if query['sql'].startswith('DELETE FROM search_document')]), 1)
+        dataset_ids = set(Dataset.objects.filter(genomes=self.genome).values_list('pk', flat=True))
+        self.assertEqual(set(SearchDocument.objects.filter(kind=SearchDocument.Kind.DATASET, object_id__in=dataset_ids)
+                             .values_list('object_id', flat=True)), dataset_ids)
+
+    def test_api_search(self):
+        response = self.client.get(reverse('ensembl_metadata:genome-list'), {'search': str(self.genome.genome_uuid)})
+        self.assertEqual([genome['genome_uuid'] for genome in response.data['results']], [self.genome.genome_uuid])
+        response = self.client.get(reverse('ensembl_metadata:dataset-list'),
+                                   {'search': self.genome.assembly.accession, 'limit': 100})
+        self.assertEqual(response.data['count'], Dataset.objects.filter(genomes=self.genome).count())
+        with self.indexed():
+            response = self.client.post(reverse('ensembl_metadata:dataset-bulk'), {'user': 'danielp', 'datasets': [{
+                'genome_uuid': str(self.genome.genome_uuid), 'name': 'Bulk dataset', 'label': 'Bulk dataset',
+                'dataset_type': 'variation', 'dataset_source': {'name': 'bulk_source', 'type': 'core'}}]},
+                format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        dataset_uuid = response.data['results'][0]['dataset_uuid']
+        response = self.client.get(reverse('ensembl_metadata:dataset-list'), {'search': dataset_uuid})
+        self.assertEqual([dataset['dataset_uuid'] for dataset in response.data['results']], [dataset_uuid])
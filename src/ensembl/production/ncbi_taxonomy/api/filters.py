@@ -1,3 +1,4 @@
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import BaseFilterBackend
 from ensembl.production.ncbi_taxonomy.api.utils import TaxonomyUtils
 
@@ -6,10 +7,12 @@ class TaxonomyFilterBackend(BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
         taxon_ids_string = request.query_params.get('taxon_ids', None)
         if taxon_ids_string is not None:
+            try:
+                taxon_ids = TaxonomyUtils.parse_taxon_ids(taxon_ids_string)
+            except ValueError:
+                raise ValidationError({'taxon_ids': 'Comma-separated taxon ids expected'})
             if request.query_params.get('descendents'):
-                taxon_ids = TaxonomyUtils.fetch_descendent_ids(taxon_ids_string)
-            else:
-                taxon_ids = [int(x.strip()) for x in taxon_ids_string.split(',')]
+                taxon_ids = TaxonomyUtils.fetch_descendent_ids(taxon_ids)
             queryset = queryset.filter(taxon_id__in=taxon_ids)
 
         return queryset.order_by('taxon_id')
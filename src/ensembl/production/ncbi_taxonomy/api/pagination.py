@@ -0,0 +1,60 @@
+#   See the NOTICE file distributed with this work for additional information
+#   regarding copyright ownership.
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from rest_framework.pagination import BasePagination, CursorPagination, LimitOffsetPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the view `cursor_ordering` field (its indexed primary key): each page is fetched with
+    `WHERE pk > last_seen ORDER BY pk LIMIT n`, so it costs the same at any depth, and no COUNT(*) is run.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+
+class OffsetOrCursorPagination(BasePagination):
+    """
+    Keep the default limit/offset pagination, unless the client opts in for keyset pagination by sending the
+    `cursor` query parameter (empty for the first page, then the value found in the `next` link).
+    """
+    cursor_query_param = 'cursor'
+
+    def __init__(self):
+        self.paginator = LimitOffsetPagination()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.paginator = KeysetPagination(getattr(view, 'cursor_ordering', 'pk'))
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
+
+    def get_schema_operation_parameters(self, view):
+        return (LimitOffsetPagination().get_schema_operation_parameters(view) +
+                KeysetPagination('pk').get_schema_operation_parameters(view))
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
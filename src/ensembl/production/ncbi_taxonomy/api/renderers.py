@@ -0,0 +1,34 @@
+from rest_framework.renderers import BaseRenderer
+
+
+def newick_label(label):
+    label = str(label)
+    if any(char in label for char in " ()[]':;,\t\n"):
+        return "'" + label.replace("'", "''") + "'"
+    return label
+
+
+def to_newick(tree, label='scientific_name'):
+    """
+    Newick representation of a nested {'children': [...]} tree, nodes labelled with their `label` value.
+    """
+    def newick(node):
+        children = ','.join(newick(child) for child in node['children'])
+        return (f'({children})' if children else '') + newick_label(node[label] or node['taxon_id'])
+
+    return newick(tree) + ';'
+
+
+class NewickRenderer(BaseRenderer):
+    """
+    Render the `newick` value of the response data as text (`?format=newick`).
+    """
+    media_type = 'text/x-nh'
+    format = 'newick'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and 'newick' in data:
+            return (data['newick'] or '') + '\n'
+        # errors
+        return str(data)
@@ -16,6 +16,85 @@ class TaxonomyNodeSerializer(serializers.ModelSerializer):
         model = TaxonomyNode
         fields = ['taxon_id', 'parent_id', 'rank', 'scientific_name', 'names']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(TaxonomyNode.prefetch_names())
+
     def get_scientific_name(self, obj):
-        return TaxonomyName.objects.get(
-            taxon_id=obj.taxon_id, name_class='scientific name').name
+        return obj.scientific_name()
+
+
+class TaxonomyIdsSerializer(serializers.Serializer):
+    taxon_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+
+
+class TaxonomySummarySerializer(serializers.Serializer):
+    taxon_id = serializers.IntegerField()
+    rank = serializers.CharField()
+    scientific_name = serializers.CharField(allow_null=True)
+
+
+class TaxonomyLineageSerializer(TaxonomySummarySerializer):
+    lineage = TaxonomySummarySerializer(many=True)
+
+
+class TaxonomyLineageResultSerializer(serializers.Serializer):
+    results = TaxonomyLineageSerializer(many=True)
+    not_found = serializers.ListField(child=serializers.IntegerField())
+
+
+class TaxonomyLCAResultSerializer(serializers.Serializer):
+    lca = TaxonomySummarySerializer(allow_null=True)
+    not_found = serializers.ListField(child=serializers.IntegerField())
+
+
+class TaxonomySubtreeRequestSerializer(TaxonomyIdsSerializer):
+    collapse = serializers.BooleanField(default=False, help_text='Drop the intermediate nodes with a single child')
+    label = serializers.ChoiceField(['scientific_name', 'taxon_id'], default='scientific_name',
+                                    help_text='Newick node labels')
+
+
+class TaxonomyTreeSerializer(TaxonomySummarySerializer):
+    children = serializers.ListField(child=serializers.DictField())
+
+
+class TaxonomySubtreeResultSerializer(serializers.Serializer):
+    tree = TaxonomyTreeSerializer(allow_null=True)
+    newick = serializers.CharField(allow_null=True)
+    not_found = serializers.ListField(child=serializers.IntegerField())
+
+
+class TaxonomyNameSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(help_text='Name searched')
+    match = serializers.ChoiceField(['prefix', 'iexact', 'exact'], default='prefix',
+                                    help_text='prefix (autocomplete), iexact (ignoring case and whitespace) or exact')
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100)
+
+
+class TaxonomyNamesSerializer(serializers.Serializer):
+    names = serializers.ListField(child=serializers.CharField(), allow_empty=False, max_length=10000)
+
+
+class TaxonomyResolvedNameSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    taxon_ids = serializers.ListField(child=serializers.IntegerField())
+    ambiguous = serializers.BooleanField()
+    matches = TaxonomyNameSerializer(many=True)
+
+
+class TaxonomyResolveResultSerializer(serializers.Serializer):
+    results = TaxonomyResolvedNameSerializer(many=True)
+
+
+class TaxonomyRankRequestSerializer(TaxonomyIdsSerializer):
+    rank = serializers.CharField(help_text='Target rank, e.g. genus, family, order')
+
+
+class TaxonomyRankAncestorSerializer(serializers.Serializer):
+    taxon_id = serializers.IntegerField()
+    ancestor = TaxonomySummarySerializer(allow_null=True)
+
+
+class TaxonomyRankResultSerializer(serializers.Serializer):
+    results = TaxonomyRankAncestorSerializer(many=True)
+    not_found = serializers.ListField(child=serializers.IntegerField())
@@ -1,5 +1,19 @@
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
 from django.db import connections
-from ensembl.production.ncbi_taxonomy.models import TaxonomyNode
+from django.db.models import Case, IntegerField, Value, When
+from ensembl.production.ncbi_taxonomy.index import TaxonomyIndex, TaxonomyNameIndex, normalize_name
+from ensembl.production.ncbi_taxonomy.models import TaxonomyName, TaxonomyNode
+
+# Largest number of ids sent in a single IN (...) clause
+IN_CHUNK_SIZE = 1000
+
+
+def chunks(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
 
 
 class TaxonomyUtils(object):
@@ -9,13 +23,344 @@ class TaxonomyUtils(object):
         node = TaxonomyNode.objects.get(pk=taxon_id)
         return node
 
+    @classmethod
+    def parse_taxon_ids(cls, taxon_ids):
+        """
+        Taxon ids as a list of int, from a comma-separated string or an iterable. Raise ValueError if one is not an int.
+        """
+        if isinstance(taxon_ids, str):
+            taxon_ids = [taxon_id for taxon_id in taxon_ids.split(',') if taxon_id.strip()]
+        return [int(taxon_id) for taxon_id in taxon_ids]
+
+    @classmethod
+    def get_index(cls):
+        """
+        The in memory taxonomy index, or None if disabled with the TAXONOMY_INDEX setting.
+        """
+        return TaxonomyIndex.get() if getattr(settings, 'TAXONOMY_INDEX', True) else None
+
     @classmethod
     def fetch_descendent_ids(cls, taxon_ids):
-        # TODO: Replace raw SQL with a queryset command.
+        taxon_ids = cls.parse_taxon_ids(taxon_ids)
+        index = cls.get_index()
+        results = []
+        if index is not None:
+            # nodes added since the index was loaded are looked up in the database
+            missing = [taxon_id for taxon_id in taxon_ids if taxon_id not in index]
+            for taxon_id in set(taxon_ids) - set(missing):
+                results.extend(index.descendants(taxon_id))
+            taxon_ids = missing
+        if taxon_ids:
+            results.extend(cls.fetch_descendent_ids_sql(taxon_ids))
+        return list(dict.fromkeys(results))
+
+    @classmethod
+    def fetch_descendent_ids_sql(cls, taxon_ids):
         cursor = connections['ncbi_taxonomy'].cursor()
         sql = "SELECT n.taxon_id FROM ncbi_taxa_node n  JOIN ncbi_taxa_node parent ON " + \
               " (n.left_index BETWEEN parent.left_index AND parent.right_index) " + \
-              " WHERE parent.taxon_id IN (" + str(taxon_ids) + ")"
-        cursor.execute(sql)
+              " WHERE parent.taxon_id IN (" + ", ".join(["%s"] * len(taxon_ids)) + ")"
+        cursor.execute(sql, taxon_ids)
         results = [item[0] for item in cursor.fetchall()]
         return results
+
+    @classmethod
+    def fetch_ancestor_ids(cls, taxon_id):
+        """
+        Taxon ids of the ancestors of a taxon, from its parent up to the root.
+        """
+        index = cls.get_index()
+        if index is not None and taxon_id in index:
+            return index.ancestors(taxon_id)
+        node = TaxonomyNode.objects.get(pk=taxon_id)
+        return list(TaxonomyNode.objects.filter(
+            left_index__lt=node.left_index, right_index__gte=node.right_index, root_id=node.root_id
+        ).order_by('-left_index').values_list('taxon_id', flat=True))
+
+    @classmethod
+    def is_descendant(cls, taxon_id, ancestor_id):
+        """
+        Whether a taxon is the ancestor taxon or one of its descendants.
+        """
+        index = cls.get_index()
+        if index is not None and taxon_id in index and ancestor_id in index:
+            return index.is_descendant(taxon_id, ancestor_id)
+        nodes = TaxonomyNode.objects.in_bulk([taxon_id, ancestor_id])
+        if taxon_id not in nodes or ancestor_id not in nodes:
+            raise TaxonomyNode.DoesNotExist
+        return nodes[ancestor_id].left_index <= nodes[taxon_id].left_index <= nodes[ancestor_id].right_index
+
+    @classmethod
+    def filter_descendants(cls, taxon_ids, ancestor_ids):
+        """
+        The taxa (of a small set, e.g. the taxa of the registry organisms) which are one of the ancestor taxa or one
+        of their descendants, so that a large clade is never expanded. Checked against the index, or with one nested
+        set query per chunk of taxa.
+        """
+        index = cls.get_index()
+        matches = set()
+        missing = list(dict.fromkeys(taxon_ids))
+        if index is not None and all(ancestor_id in index for ancestor_id in ancestor_ids):
+            matches.update(taxon_id for taxon_id in missing if taxon_id in index and any(
+                index.is_descendant(taxon_id, ancestor_id) for ancestor_id in ancestor_ids))
+            missing = [taxon_id for taxon_id in missing if taxon_id not in index]
+        if not ancestor_ids:
+            return matches
+        cursor = connections['ncbi_taxonomy'].cursor()
+        for chunk in chunks(missing):
+            sql = "SELECT DISTINCT n.taxon_id FROM ncbi_taxa_node n JOIN ncbi_taxa_node a ON " + \
+                  " (n.left_index BETWEEN a.left_index AND a.right_index AND n.root_id = a.root_id) " + \
+                  " WHERE a.taxon_id IN (" + ", ".join(["%s"] * len(ancestor_ids)) + ")" + \
+                  " AND n.taxon_id IN (" + ", ".join(["%s"] * len(chunk)) + ")"
+            cursor.execute(sql, list(ancestor_ids) + chunk)
+            matches.update(taxon_id for taxon_id, in cursor.fetchall())
+        return matches
+
+    @classmethod
+    def fetch_lineages(cls, taxon_ids):
+        """
+        Ancestors of each taxon, from the root down to its parent, as {taxon_id: [ancestor ids]}. Taxa not found
+        are left out. Computed in memory from the index, or with one nested set query per chunk of taxa.
+        """
+        index = cls.get_index()
+        lineages = {}
+        if index is not None:
+            for taxon_id in taxon_ids:
+                if taxon_id in index:
+                    lineages[taxon_id] = index.ancestors(taxon_id)[::-1]
+        missing = [taxon_id for taxon_id in taxon_ids if taxon_id not in lineages]
+        cursor = connections['ncbi_taxonomy'].cursor()
+        for chunk in chunks(missing):
+            sql = "SELECT n.taxon_id, a.taxon_id FROM ncbi_taxa_node n JOIN ncbi_taxa_node a ON " + \
+                  " (n.left_index BETWEEN a.left_index AND a.right_index AND n.root_id = a.root_id) " + \
+                  " WHERE n.taxon_id IN (" + ", ".join(["%s"] * len(chunk)) + ") ORDER BY a.left_index"
+            cursor.execute(sql, chunk)
+            for taxon_id, ancestor_id in cursor.fetchall():
+                lineage = lineages.setdefault(taxon_id, [])
+                if ancestor_id != taxon_id:
+                    lineage.append(ancestor_id)
+        return lineages
+
+    @classmethod
+    def fetch_summaries(cls, taxon_ids):
+        """
+        Rank and scientific name of the taxa, as {taxon_id: {'taxon_id', 'rank', 'scientific_name'}}, from the index
+        or with two queries per chunk of taxa.
+        """
+        index = cls.get_index()
+        if index is not None and all(taxon_id in index for taxon_id in taxon_ids):
+            return {taxon_id: {'taxon_id': taxon_id, 'rank': index.rank(taxon_id),
+                               'scientific_name': index.scientific_name(taxon_id)} for taxon_id in taxon_ids}
+        summaries = {}
+        for chunk in chunks(taxon_ids):
+            for taxon_id, rank in TaxonomyNode.objects.filter(taxon_id__in=chunk).values_list('taxon_id', 'rank'):
+                summaries[taxon_id] = {'taxon_id': taxon_id, 'rank': rank, 'scientific_name': None}
+            for taxon_id, name in TaxonomyName.objects.filter(
+                    taxon_id__in=chunk, name_class=TaxonomyNode.scientific_name_class).values_list('taxon_id', 'name'):
+                if taxon_id in summaries:
+                    summaries[taxon_id]['scientific_name'] = name
+        return summaries
+
+    @classmethod
+    def fetch_lca(cls, taxon_ids):
+        """
+        Lowest common ancestor of the taxa found, None if none is found or they are in different trees. Computed
+        from the index, or with nested set arithmetic in two queries.
+        """
+        index = cls.get_index()
+        if index is not None and all(taxon_id in index for taxon_id in taxon_ids):
+            return index.lca(taxon_ids)
+        nodes = []
+        for chunk in chunks(taxon_ids):
+            nodes.extend(TaxonomyNode.objects.filter(taxon_id__in=chunk).values_list(
+                'left_index', 'right_index', 'root_id'))
+        if not nodes or len({root_id for _, _, root_id in nodes}) > 1:
+            return None
+        return TaxonomyNode.objects.filter(
+            left_index__lte=min(left_index for left_index, _, _ in nodes),
+            right_index__gte=max(right_index for _, right_index, _ in nodes),
+            root_id=nodes[0][2]
+        ).order_by('-left_index').values_list('taxon_id', flat=True).first()
+
+    @classmethod
+    def fetch_subtree(cls, taxon_ids, collapse=False):
+        """
+        Subtree induced by the taxa found: their lowest common ancestor and the paths down to each of them, as
+        nested {'taxon_id', 'rank', 'scientific_name', 'children'}. Nodes with a single child that are not part
+        of the taxa are dropped if `collapse` is set. None if no taxon is found or they are in different trees.
+        """
+        lineages = cls.fetch_lineages(taxon_ids)
+        paths = [lineages[taxon_id] + [taxon_id] for taxon_id in taxon_ids if taxon_id in lineages]
+        if not paths:
+            return None
+        depth = 0
+        while all(len(path) > depth and path[depth] == paths[0][depth] for path in paths):
+            depth += 1
+        if depth == 0:
+            return None
+        children = {}
+        for path in paths:
+            for parent_id, taxon_id in zip(path[depth - 1:], path[depth:]):
+                children.setdefault(parent_id, {})[taxon_id] = None
+        summaries = cls.fetch_summaries({paths[0][depth - 1]}.union(*children.values()))
+        selected = set(taxon_ids)
+
+        def node(taxon_id):
+            while collapse and len(children.get(taxon_id, ())) == 1 and taxon_id not in selected:
+                taxon_id = next(iter(children[taxon_id]))
+            return dict(summaries[taxon_id], children=[node(child_id) for child_id in children.get(taxon_id, ())])
+
+        return node(paths[0][depth - 1])
+
+    @classmethod
+    def fetch_rank_ancestors(cls, taxon_ids, rank):
+        """
+        Ancestor (or self) at the given rank of each taxon found, as {taxon_id: ancestor taxon_id or None}. Computed
+        from the index, or with one nested set query per chunk of taxa.
+        """
+        index = cls.get_index()
+        ancestors = {}
+        if index is not None:
+            ancestors = index.rank_ancestors([taxon_id for taxon_id in taxon_ids if taxon_id in index], rank)
+        missing = [taxon_id for taxon_id in taxon_ids if taxon_id not in ancestors]
+        for chunk in chunks(missing):
+            ancestors.update((taxon_id, None) for taxon_id in TaxonomyNode.objects.filter(
+                taxon_id__in=chunk).values_list('taxon_id', flat=True))
+            cursor = connections['ncbi_taxonomy'].cursor()
+            sql = "SELECT n.taxon_id, a.taxon_id FROM ncbi_taxa_node n JOIN ncbi_taxa_node a ON " + \
+                  " (n.left_index BETWEEN a.left_index AND a.right_index AND n.root_id = a.root_id) " + \
+                  " WHERE a.rank = %s AND n.taxon_id IN (" + ", ".join(["%s"] * len(chunk)) + ") ORDER BY a.left_index"
+            cursor.execute(sql, [rank] + chunk)
+            # the deepest ancestor comes last
+            ancestors.update(cursor.fetchall())
+        return ancestors
+
+    @classmethod
+    def fetch_intervals(cls, taxon_ids):
+        """
+        Nested set interval of the taxa found, as {taxon_id: (left_index, right_index)}, from the index or with one
+        query per chunk of taxa.
+        """
+        index = cls.get_index()
+        intervals = {}
+        if index is not None:
+            for taxon_id in taxon_ids:
+                position = index.position(taxon_id)
+                if position is not None:
+                    intervals[taxon_id] = (index.left_indexes[position], index.right_indexes[position])
+        for chunk in chunks([taxon_id for taxon_id in taxon_ids if taxon_id not in intervals]):
+            intervals.update((taxon_id, (left_index, right_index)) for taxon_id, left_index, right_index in
+                             TaxonomyNode.objects.filter(taxon_id__in=chunk).values_list(
+                                 'taxon_id', 'left_index', 'right_index'))
+        return intervals
+
+    @classmethod
+    def clade_counts(cls, taxon_id, counts):
+        """
+        Totals of the counts attached to taxa (e.g. {organism taxon_id: [organisms, genomes]}) for the taxon and each
+        of its descendants with a non zero total, as {taxon_id: (parent_id, [totals])}, in pre-order.
+
+        The counted taxa are sorted by left_index with prefix sums of their counts, so the totals of a node are the
+        difference of two prefix sums found by bisection over its nested set interval: O((N + M) log N) for N counted
+        taxa and M nodes, and no query per node. Only the nodes on the lineage of a counted taxon are visited.
+        """
+        lineages = cls.fetch_lineages([taxon_id] + [counted_id for counted_id in counts if counted_id != taxon_id])
+        if taxon_id not in lineages:
+            return {}
+        parents = {taxon_id: lineages[taxon_id][-1] if lineages[taxon_id] else None}
+        for counted_id in counts:
+            lineage = lineages.get(counted_id, []) + [counted_id]
+            if taxon_id in lineage:
+                start = lineage.index(taxon_id)
+                for parent_id, child_id in zip(lineage[start:], lineage[start + 1:]):
+                    parents[child_id] = parent_id
+        intervals = cls.fetch_intervals(list(parents))
+
+        points = sorted((intervals[counted_id][0], counts[counted_id]) for counted_id in counts
+                        if counted_id in parents and counted_id in intervals)
+        left_indexes = [left_index for left_index, _ in points]
+        prefix_sums = [[0] * len(next(iter(counts.values()), []))]
+        for _, values in points:
+            prefix_sums.append([total + value for total, value in zip(prefix_sums[-1], values)])
+
+        clades = {}
+        for node_id in sorted((node_id for node_id in parents if node_id in intervals), key=intervals.get):
+            left_index, right_index = intervals[node_id]
+            start = bisect_left(left_indexes, left_index)
+            end = bisect_right(left_indexes, right_index)
+            clades[node_id] = (parents[node_id], [upper - lower for upper, lower in
+                                                  zip(prefix_sums[end], prefix_sums[start])])
+        return clades
+
+    @classmethod
+    def shared_count_corrections(cls, groups):
+        """
+        Corrections to add to the per taxon counts of items attached to several taxa (e.g. the datasets of genomes
+        of several organisms, each given as its list of taxa), so that `clade_counts` totals count each item once:
+        {taxon_id: correction}. The taxa of an item are sorted by left_index, and each pair of consecutive taxa gets
+        -1 at its lowest common ancestor, where both are first counted together.
+        """
+        taxa = list({taxon_id for group in groups for taxon_id in group})
+        lineages = cls.fetch_lineages(taxa)
+        intervals = cls.fetch_intervals(taxa)
+        corrections = {}
+        for group in groups:
+            ordered = sorted({taxon_id for taxon_id in group if taxon_id in intervals and taxon_id in lineages},
+                             key=intervals.get)
+            for first_id, second_id in zip(ordered, ordered[1:]):
+                common = [ancestor_id for ancestor_id, other_id in zip(lineages[first_id] + [first_id],
+                                                                       lineages[second_id] + [second_id])
+                          if ancestor_id == other_id]
+                if common:
+                    corrections[common[-1]] = corrections.get(common[-1], 0) - 1
+        return corrections
+
+    @classmethod
+    def search_names(cls, query, match='prefix', limit=20):
+        """
+        Names equal to the query (`exact`), equal ignoring case and whitespace (`iexact`) or starting with it
+        (`prefix`), scientific names first then the other name classes by relevance.
+        """
+        if getattr(settings, 'TAXONOMY_INDEX', True):
+            index = TaxonomyNameIndex.get()
+            name_ids = index.search(query, prefix=match == 'prefix', limit=None if match == 'exact' else limit)
+            names = {}
+            for chunk in chunks(name_ids):
+                names.update(TaxonomyName.objects.in_bulk(chunk))
+            names = [names[name_id] for name_id in name_ids if name_id in names]
+            if match == 'exact':
+                names = [name for name in names if name.name == query]
+            return names[:limit]
+        lookup = {'exact': 'name', 'iexact': 'name__iexact', 'prefix': 'name__istartswith'}[match]
+        ranking = TaxonomyNameIndex.ranking
+        return list(TaxonomyName.objects.filter(**{lookup: query}).exclude(
+            name_class__in=TaxonomyNameIndex.excluded
+        ).annotate(class_rank=Case(
+            *[When(name_class=name_class, then=Value(rank)) for rank, name_class in enumerate(ranking)],
+            default=Value(len(ranking)), output_field=IntegerField()
+        )).order_by('class_rank', 'name_class', 'name')[:limit])
+
+    @classmethod
+    def resolve_names(cls, names):
+        """
+        Names matching each of the names, ignoring case and whitespace, as {name: [TaxonomyName]}, scientific
+        names first. Looked up in the name index, or with one IN query per chunk of names (relying on the case
+        insensitive collation of the database for case).
+        """
+        ranking = TaxonomyNameIndex.ranking
+        if getattr(settings, 'TAXONOMY_INDEX', True):
+            index = TaxonomyNameIndex.get()
+            name_ids = {name: index.search(name) for name in names}
+            found = {}
+            for chunk in chunks({name_id for ids in name_ids.values() for name_id in ids}):
+                found.update(TaxonomyName.objects.in_bulk(chunk))
+            return {name: [found[name_id] for name_id in ids if name_id in found] for name, ids in name_ids.items()}
+        variants = {' '.join(name.split()) for name in names}
+        by_key = {}
+        for chunk in chunks(variants):
+            for match in TaxonomyName.objects.filter(name__in=chunk).exclude(name_class__in=TaxonomyNameIndex.excluded):
+                by_key.setdefault(normalize_name(match.name), []).append(match)
+        for matches in by_key.values():
+            matches.sort(key=lambda match: (ranking.index(match.name_class) if match.name_class in ranking
+                                            else len(ranking), match.name_class))
+        return {name: by_key.get(normalize_name(name), []) for name in names}
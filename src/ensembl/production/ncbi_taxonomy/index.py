@@ -0,0 +1,434 @@
+import abc
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+
+from ensembl.production.ncbi_taxonomy.models import TaxonomyName, TaxonomyNode
+
+
+class LazyIndex(abc.ABC):
+    """
+    Process wide index, loaded on first use with `load()`.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    @abc.abstractmethod
+    def load(cls, using='ncbi_taxonomy'):
+        """
+        Build the index, from the `using` database or any other source.
+        """
+
+    @classmethod
+    def get(cls):
+        """
+        The process wide index, loaded on first use.
+        """
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls.load()
+        return cls._instance
+
+    @classmethod
+    def clear(cls):
+        """
+        Drop the process wide index, it is reloaded on next use (e.g. after a taxonomy update).
+        """
+        with cls._lock:
+            cls._instance = None
+
+    @classmethod
+    def rebuild(cls, using='ncbi_taxonomy'):
+        """
+        Reload the process wide index from the database right away. Other processes keep their own index.
+        """
+        index = cls.from_database(using)
+        with cls._lock:
+            cls._instance = index
+        return index
+
+    @classmethod
+    def from_database(cls, using='ncbi_taxonomy'):
+        return cls.load(using)
+
+
+class TaxonomyIndex(LazyIndex):
+    """
+    In memory copy of the taxonomy nested set, loaded once per process from ncbi_taxa_node, or memory mapped from a
+    snapshot file written by the `taxonomy_snapshot` command (see `TAXONOMY_SNAPSHOT`).
+
+    Nodes are stored in compact arrays sorted by `left_index` (taxon_id, parent_id, left_index, right_index, rank
+    code, and scientific name as offsets in a UTF-8 blob), plus the taxon ids sorted with their position to find a
+    node. The descendants of a node are the nodes whose
+    `left_index` lies within its own [left_index, right_index] range: a contiguous slice found with two binary
+    searches. The ancestors follow the parent pointers.
+    """
+
+    # array name: type code
+    arrays = {
+        'taxon_ids': 'q',
+        'parent_ids': 'q',
+        'left_indexes': 'q',
+        'right_indexes': 'q',
+        'ranks': 'H',
+        'sorted_ids': 'q',
+        'sorted_positions': 'q',
+        'name_offsets': 'q',
+        'name_data': 'B',
+    }
+    snapshot_magic = b'NCBITAX1'
+
+    def __init__(self, arrays, rank_names):
+        """
+        :param arrays: {array name: array or memoryview}, see `arrays`
+        :param rank_names: rank of each code used in `ranks`
+        """
+        for name in self.arrays:
+            setattr(self, name, arrays[name])
+        self.rank_names = list(rank_names)
+        self.rank_intervals = {}
+        self.mapped = None
+
+    @classmethod
+    def from_nodes(cls, nodes, scientific_names=()):
+        """
+        :param nodes: iterable of (taxon_id, parent_id, left_index, right_index, rank) sorted by left_index
+        :param scientific_names: iterable of (taxon_id, scientific name)
+        """
+        arrays = {name: array(typecode) for name, typecode in cls.arrays.items()}
+        rank_names = []
+        rank_codes = {}
+        for taxon_id, parent_id, left_index, right_index, rank in nodes:
+            arrays['taxon_ids'].append(taxon_id)
+            arrays['parent_ids'].append(parent_id or 0)
+            arrays['left_indexes'].append(left_index)
+            arrays['right_indexes'].append(right_index)
+            if rank not in rank_codes:
+                rank_codes[rank] = len(rank_names)
+                rank_names.append(rank)
+            arrays['ranks'].append(rank_codes[rank])
+        taxon_ids = arrays['taxon_ids']
+        positions = sorted(range(len(taxon_ids)), key=taxon_ids.__getitem__)
+        arrays['sorted_ids'] = array('q', (taxon_ids[position] for position in positions))
+        arrays['sorted_positions'] = array('q', positions)
+        index = cls(arrays, rank_names)
+
+        names = [b''] * len(taxon_ids)
+        for taxon_id, name in scientific_names:
+            position = index.position(taxon_id)
+            if position is not None:
+                names[position] = name.encode()
+        index.name_offsets.append(0)
+        for name in names:
+            index.name_offsets.append(index.name_offsets[-1] + len(name))
+        index.name_data = b''.join(names)
+        return index
+
+    @classmethod
+    def from_database(cls, using='ncbi_taxonomy'):
+        return cls.from_nodes(
+            TaxonomyNode.objects.using(using).order_by('left_index').values_list(
+                'taxon_id', 'parent_id', 'left_index', 'right_index', 'rank').iterator(chunk_size=10000),
+            TaxonomyName.objects.using(using).filter(name_class=TaxonomyNode.scientific_name_class).values_list(
+                'taxon_id', 'name').iterator(chunk_size=10000)
+        )
+
+    @classmethod
+    def load(cls, using='ncbi_taxonomy'):
+        """
+        Map the TAXONOMY_SNAPSHOT file if there is one, else read the database.
+        """
+        snapshot = getattr(settings, 'TAXONOMY_SNAPSHOT', None)
+        if snapshot and os.path.isfile(snapshot):
+            return cls.from_snapshot(snapshot)
+        return cls.from_database(using)
+
+    @classmethod
+    def rebuild(cls, using='ncbi_taxonomy'):
+        """
+        Reload the process wide index from the database, and rewrite the TAXONOMY_SNAPSHOT file if there is one so
+        that processes started afterwards map the new taxonomy.
+        """
+        index = cls.from_database(using)
+        snapshot = getattr(settings, 'TAXONOMY_SNAPSHOT', None)
+        if snapshot:
+            index.write_snapshot(snapshot)
+            index = cls.from_snapshot(snapshot)
+        with cls._lock:
+            cls._instance = index
+        return index
+
+    def write_snapshot(self, path):
+        """
+        Write the index to a binary file: magic, header length, JSON header (byte order, ranks and the offset of
+        each array) then the raw arrays aligned on 8 bytes. The file is replaced atomically.
+        """
+        sections = {}
+        offset = 0
+        for name, typecode in self.arrays.items():
+            size = len(getattr(self, name)) * array(typecode).itemsize
+            sections[name] = [offset, size]
+            offset += size + (-size % 8)
+        header = json.dumps({'byteorder': sys.byteorder, 'rank_names': self.rank_names, 'count': len(self),
+                             'sections': sections}).encode()
+        header += b' ' * (-len(header) % 8)
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as snapshot:
+            snapshot.write(self.snapshot_magic)
+            snapshot.write(struct.pack('<Q', len(header)))
+            snapshot.write(header)
+            for name in self.arrays:
+                data = getattr(self, name)
+                snapshot.write(data)
+                snapshot.write(b'\0' * (-len(memoryview(data).cast('B')) % 8))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """
+        Map a snapshot file read only: its pages are shared by all the processes using it, and nothing is copied.
+        """
+        with open(path, 'rb') as snapshot:
+            mapped = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(cls.snapshot_magic)] != cls.snapshot_magic:
+            raise ValueError(f'{path} is not a taxonomy snapshot')
+        start = len(cls.snapshot_magic) + 8
+        header_size = struct.unpack('<Q', mapped[len(cls.snapshot_magic):start])[0]
+        header = json.loads(mapped[start:start + header_size])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f'{path} was written on a {header["byteorder"]} endian system')
+        start += header_size
+        view = memoryview(mapped)
+        arrays = {name: view[start + offset:start + offset + size].cast(cls.arrays[name])
+                  for name, (offset, size) in header['sections'].items()}
+        index = cls(arrays, header['rank_names'])
+        index.mapped = mapped
+        return index
+
+    def __len__(self):
+        return len(self.taxon_ids)
+
+    def __contains__(self, taxon_id):
+        return self.position(taxon_id) is not None
+
+    def position(self, taxon_id):
+        i = bisect_left(self.sorted_ids, taxon_id)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == taxon_id:
+            return self.sorted_positions[i]
+        return None
+
+    def rank(self, taxon_id):
+        return self.rank_names[self.ranks[self.position(taxon_id)]]
+
+    def scientific_name(self, taxon_id):
+        position = self.position(taxon_id)
+        return bytes(self.name_data[self.name_offsets[position]:self.name_offsets[position + 1]]).decode() or None
+
+    def descendant_slice(self, taxon_id):
+        """
+        Slice of the node arrays holding the node and all its descendants.
+        """
+        position = self.position(taxon_id)
+        if position is None:
+            raise KeyError(taxon_id)
+        start = bisect_left(self.left_indexes, self.left_indexes[position])
+        end = bisect_right(self.left_indexes, self.right_indexes[position])
+        return slice(start, end)
+
+    def descendants(self, taxon_id):
+        """
+        Taxon ids of the node and all its descendants.
+        """
+        return self.taxon_ids[self.descendant_slice(taxon_id)].tolist()
+
+    def ancestors(self, taxon_id):
+        """
+        Taxon ids of the ancestors of the node, from its parent up to the root.
+        """
+        position = self.position(taxon_id)
+        if position is None:
+            raise KeyError(taxon_id)
+        ancestors = []
+        parent_id = self.parent_ids[position]
+        while parent_id and parent_id != taxon_id:
+            ancestors.append(parent_id)
+            taxon_id = parent_id
+            position = self.position(taxon_id)
+            if position is None:
+                break
+            parent_id = self.parent_ids[position]
+        return ancestors
+
+    def is_descendant(self, taxon_id, ancestor_id):
+        """
+        Whether the node is the ancestor node or one of its descendants.
+        """
+        position = self.position(taxon_id)
+        ancestor = self.position(ancestor_id)
+        if position is None or ancestor is None:
+            raise KeyError(taxon_id if position is None else ancestor_id)
+        return self.left_indexes[ancestor] <= self.left_indexes[position] <= self.right_indexes[ancestor]
+
+    def lca(self, taxon_ids):
+        """
+        Lowest common ancestor of the nodes: the deepest ancestor of the leftmost node whose nested set range
+        covers all of them, None if they are in different trees.
+        """
+        positions = []
+        for taxon_id in taxon_ids:
+            position = self.position(taxon_id)
+            if position is None:
+                raise KeyError(taxon_id)
+            positions.append(position)
+        if not positions:
+            return None
+        position = min(positions, key=self.left_indexes.__getitem__)
+        right_index = max(self.right_indexes[p] for p in positions)
+        while self.right_indexes[position] < right_index:
+            taxon_id, parent_id = self.taxon_ids[position], self.parent_ids[position]
+            position = self.position(parent_id) if parent_id != taxon_id else None
+            if position is None:
+                return None
+        return self.taxon_ids[position]
+
+    def intervals(self, rank):
+        """
+        Positions of the nodes of a rank, sorted by left_index, and for each one the index in this list of the closest
+        node of the same rank enclosing it (-1 if none), built on first use.
+        """
+        if rank not in self.rank_intervals:
+            code = self.rank_names.index(rank) if rank in self.rank_names else -1
+            positions = array('q', (position for position, node_rank in enumerate(self.ranks) if node_rank == code))
+            enclosing = array('q')
+            stack = []
+            for i, position in enumerate(positions):
+                while stack and self.right_indexes[positions[stack[-1]]] < self.left_indexes[position]:
+                    stack.pop()
+                enclosing.append(stack[-1] if stack else -1)
+                stack.append(i)
+            self.rank_intervals[rank] = (positions, array('q', (self.left_indexes[p] for p in positions)), enclosing)
+        return self.rank_intervals[rank]
+
+    def rank_ancestors(self, taxon_ids, rank):
+        """
+        Ancestor (or self) at the given rank of each node, as {taxon_id: ancestor taxon_id or None}: the last node of
+        that rank starting before the node, or the closest of its same rank ancestors whose range contains it.
+        """
+        positions, left_indexes, enclosing = self.intervals(rank)
+        ancestors = {}
+        for taxon_id in taxon_ids:
+            position = self.position(taxon_id)
+            if position is None:
+                raise KeyError(taxon_id)
+            left_index = self.left_indexes[position]
+            i = bisect_right(left_indexes, left_index) - 1
+            while i >= 0 and self.right_indexes[positions[i]] < left_index:
+                i = enclosing[i]
+            ancestors[taxon_id] = self.taxon_ids[positions[i]] if i >= 0 else None
+        return ancestors
+
+
+def normalize_name(name):
+    """
+    Case and whitespace insensitive form of a taxonomy name.
+    """
+    return ' '.join(name.split()).casefold()
+
+
+class SortedKeys(object):
+    """
+    Sorted UTF-8 strings stored in one bytes block with their offsets, a sequence `bisect` can search.
+    """
+
+    def __init__(self, keys):
+        self.offsets = array('q', [0])
+        blocks = []
+        for key in keys:
+            blocks.append(key)
+            self.offsets.append(self.offsets[-1] + len(key))
+        self.data = b''.join(blocks)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+class TaxonomyNameIndex(LazyIndex):
+    """
+    In memory index of the names in ncbi_taxa_name, loaded once per process.
+
+    There is one sorted sequence of normalized names per name class, along with their name ids. A lookup runs two
+    binary searches per name class, in the `ranking` order of the classes, and stops when `limit` names are found.
+    """
+    ranking = [
+        TaxonomyNode.scientific_name_class,
+        'genbank common name',
+        'common name',
+        'equivalent name',
+        'genbank synonym',
+        'synonym',
+        'genbank acronym',
+        'acronym',
+        'blast name',
+        'includes',
+        'in-part',
+        'type material',
+        'authority',
+    ]
+    # Not names of the taxon
+    excluded = ['merged_taxon_id', 'import date']
+
+    def __init__(self, names):
+        """
+        :param names: iterable of (name_id, name, name_class)
+        """
+        by_class = {}
+        for name_id, name, name_class in names:
+            if name_class not in self.excluded:
+                by_class.setdefault(name_class, []).append((normalize_name(name).encode(), name_id))
+        self.name_classes = sorted(by_class, key=lambda name_class: (
+            self.ranking.index(name_class) if name_class in self.ranking else len(self.ranking), name_class))
+        self.keys = []
+        self.name_ids = []
+        for name_class in self.name_classes:
+            entries = by_class.pop(name_class)
+            entries.sort()
+            self.keys.append(SortedKeys(key for key, _ in entries))
+            self.name_ids.append(array('q', (name_id for _, name_id in entries)))
+
+    @classmethod
+    def load(cls, using='ncbi_taxonomy'):
+        return cls(TaxonomyName.objects.using(using).values_list(
+            'name_id', 'name', 'name_class').iterator(chunk_size=10000))
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.keys)
+
+    def search(self, query, prefix=False, limit=None):
+        """
+        Ids of the names equal to the query, or starting with it, once normalized, best name classes first.
+        """
+        key = normalize_name(query).encode()
+        name_ids = []
+        for keys, ids in zip(self.keys, self.name_ids):
+            if limit is not None and len(name_ids) >= limit:
+                break
+            i = bisect_left(keys, key)
+            while i < len(keys) and (limit is None or len(name_ids) < limit):
+                found = keys[i]
+                if not (found.startswith(key) if prefix else found == key):
+                    break
+                name_ids.append(ids[i])
+                i += 1
+        return name_ids
@@ -0,0 +1,187 @@
+import os
+import time
+from array import array
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from ensembl.production.ncbi_taxonomy.index import TaxonomyIndex, TaxonomyNameIndex
+from ensembl.production.ncbi_taxonomy.models import TaxonomyName, TaxonomyNode
+
+# The NCBI taxonomy dump files (https://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdump.tar.gz) are streamed line by line,
+# the tree is kept in compact int arrays (about 40 bytes per node) to compute the nested set, and the rows are
+# inserted in batches, so memory only depends on the number of nodes, never on the number of names.
+
+
+def read_dmp(path):
+    """
+    Fields of each line of a .dmp file (separated by tab-pipe-tab, lines ending with tab-pipe).
+    """
+    with open(path, encoding='utf-8') as dmp:
+        for line in dmp:
+            line = line.rstrip('\n')
+            if line.endswith('\t|'):
+                line = line[:-2]
+            yield line.split('\t|\t')
+
+
+class Command(BaseCommand):
+    help = 'Load the taxonomy database from an NCBI taxdump directory (nodes.dmp, names.dmp and optional merged.dmp)' \
+           ', replacing its content in a single transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('taxdump_dir', help='Directory with the extracted taxdump files')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per INSERT (default: 10000)')
+        parser.add_argument('--database', default='ncbi_taxonomy', help='Database alias (default: ncbi_taxonomy)')
+
+    def handle(self, *args, **options):
+        taxdump_dir = options['taxdump_dir']
+        for filename in ('nodes.dmp', 'names.dmp'):
+            if not os.path.isfile(os.path.join(taxdump_dir, filename)):
+                raise CommandError(f'{filename} not found in {taxdump_dir}')
+        self.using = options['database']
+        self.batch_size = options['batch_size']
+
+        start = time.perf_counter()
+        self.read_nodes(os.path.join(taxdump_dir, 'nodes.dmp'))
+        self.compute_nested_set()
+        self.report('Read and indexed', len(self.order), 'nodes', start)
+
+        with transaction.atomic(using=self.using):
+            start = time.perf_counter()
+            self.clear_tables()
+            nodes = self.insert(TaxonomyNode, self.node_rows())
+            self.report('Inserted', nodes, 'nodes', start)
+            start = time.perf_counter()
+            names = self.insert(TaxonomyName, self.name_rows(taxdump_dir))
+            self.report('Inserted', names, 'names', start)
+        TaxonomyIndex.clear()
+        TaxonomyNameIndex.clear()
+
+    def report(self, action, rows, table, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{action} {rows} {table} in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)')
+
+    def read_nodes(self, path):
+        self.taxon_ids = array('i')
+        self.parent_ids = array('i')
+        self.ranks = array('H')
+        self.hidden_flags = array('b')
+        self.rank_names = []
+        rank_codes = {}
+        for fields in read_dmp(path):
+            self.taxon_ids.append(int(fields[0]))
+            self.parent_ids.append(int(fields[1]))
+            if fields[2] not in rank_codes:
+                rank_codes[fields[2]] = len(self.rank_names)
+                self.rank_names.append(fields[2])
+            self.ranks.append(rank_codes[fields[2]])
+            self.hidden_flags.append(int(fields[10]))
+
+    def compute_nested_set(self):
+        """
+        Number the nodes with an iterative depth first traversal: `left_index` when entering a node, `right_index`
+        when leaving it. Children are stored in CSR form: the children of the node at position i are
+        children[child_offsets[i]:child_offsets[i + 1]].
+        """
+        count = len(self.taxon_ids)
+        self.positions = array('i', [-1]) * (max(self.taxon_ids, default=0) + 1)
+        for position, taxon_id in enumerate(self.taxon_ids):
+            self.positions[taxon_id] = position
+
+        roots = []
+        child_offsets = array('i', [0]) * (count + 1)
+        for position in range(count):
+            parent_id = self.parent_ids[position]
+            if parent_id == self.taxon_ids[position] or not 0 < parent_id < len(self.positions) \
+                    or self.positions[parent_id] < 0:
+                roots.append(position)
+                self.parent_ids[position] = 0
+            else:
+                child_offsets[self.positions[parent_id] + 1] += 1
+        for position in range(count):
+            child_offsets[position + 1] += child_offsets[position]
+        children = array('i', [0]) * count
+        next_child = array('i', child_offsets)
+        for position in range(count):
+            if self.parent_ids[position]:
+                parent = self.positions[self.parent_ids[position]]
+                children[next_child[parent]] = position
+                next_child[parent] += 1
+        del next_child
+
+        self.left_indexes = array('i', [0]) * count
+        self.right_indexes = array('i', [0]) * count
+        self.root_ids = array('i', [0]) * count
+        self.order = array('i')
+        counter = 0
+        for root in roots:
+            root_id = self.taxon_ids[root]
+            counter += 1
+            self.left_indexes[root] = counter
+            self.root_ids[root] = root_id
+            self.order.append(root)
+            stack = [[root, child_offsets[root]]]
+            while stack:
+                top = stack[-1]
+                position, child = top
+                if child < child_offsets[position + 1]:
+                    top[1] += 1
+                    child = children[child]
+                    counter += 1
+                    self.left_indexes[child] = counter
+                    self.root_ids[child] = root_id
+                    self.order.append(child)
+                    stack.append([child, child_offsets[child]])
+                else:
+                    stack.pop()
+                    counter += 1
+                    self.right_indexes[position] = counter
+        if len(self.order) < count:
+            self.stderr.write(f'{count - len(self.order)} nodes in parent cycles are not loaded')
+
+    def clear_tables(self):
+        cursor = connections[self.using].cursor()
+        cursor.execute(f'DELETE FROM {TaxonomyName._meta.db_table}')
+        cursor.execute(f'UPDATE {TaxonomyNode._meta.db_table} SET parent_id = NULL')
+        cursor.execute(f'DELETE FROM {TaxonomyNode._meta.db_table}')
+
+    def node_rows(self):
+        # pre-order: parents are inserted before their children
+        for position in self.order:
+            yield TaxonomyNode(
+                taxon_id=self.taxon_ids[position],
+                parent_id=self.parent_ids[position] or None,
+                rank=self.rank_names[self.ranks[position]],
+                genbank_hidden_flag=self.hidden_flags[position],
+                left_index=self.left_indexes[position],
+                right_index=self.right_indexes[position],
+                root_id=self.root_ids[position],
+            )
+
+    def loaded(self, taxon_id):
+        return 0 < taxon_id < len(self.positions) and self.positions[taxon_id] >= 0 \
+            and self.left_indexes[self.positions[taxon_id]] > 0
+
+    def name_rows(self, taxdump_dir):
+        for fields in read_dmp(os.path.join(taxdump_dir, 'names.dmp')):
+            taxon_id = int(fields[0])
+            if self.loaded(taxon_id):
+                yield TaxonomyName(taxon_id=taxon_id, name=fields[1], name_class=fields[3])
+        merged = os.path.join(taxdump_dir, 'merged.dmp')
+        if os.path.isfile(merged):
+            for old_taxon_id, taxon_id in read_dmp(merged):
+                if self.loaded(int(taxon_id)):
+                    yield TaxonomyName(taxon_id=int(taxon_id), name=old_taxon_id, name_class='merged_taxon_id')
+
+    def insert(self, model, rows):
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                model.objects.using(self.using).bulk_create(batch)
+                total += len(batch)
+                batch = []
+        model.objects.using(self.using).bulk_create(batch)
+        return total + len(batch)
@@ -0,0 +1,26 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from ensembl.production.ncbi_taxonomy.index import TaxonomyIndex
+
+
+class Command(BaseCommand):
+    help = 'Write the taxonomy index (nodes, ranks and scientific names) to a binary snapshot file, memory mapped ' \
+           'by the server processes when the TAXONOMY_SNAPSHOT setting points to it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Snapshot file, replaced atomically')
+        parser.add_argument('--database', default='ncbi_taxonomy', help='Database alias (default: ncbi_taxonomy)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = TaxonomyIndex.from_database(options['database'])
+        loaded = time.perf_counter()
+        index.write_snapshot(options['path'])
+        written = time.perf_counter()
+        TaxonomyIndex.from_snapshot(options['path'])
+        self.stdout.write(f'Loaded {len(index)} nodes in {loaded - start:.1f}s, wrote '
+                          f'{os.path.getsize(options["path"]) / 2 ** 20:.1f}MB in {written - loaded:.1f}s, '
+                          f'mapped back in {(time.perf_counter() - written) * 1000:.1f}ms')
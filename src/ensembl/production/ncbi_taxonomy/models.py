@@ -18,15 +18,37 @@ class TaxonomyNode(models.Model):
     def __str__(self):
         return str(self.taxon_id)
 
+    scientific_name_class = 'scientific name'
+    name_classes = [
+        'common name',
+        'equivalent name',
+        'genbank common name',
+        'genbank synonym',
+        'synonym'
+    ]
+
+    @classmethod
+    def prefetch_names(cls):
+        """
+        Prefetch the scientific and other names of the nodes, in one query, as `prefetched_names`.
+        """
+        return models.Prefetch(
+            'taxonomyname_set',
+            queryset=TaxonomyName.objects.filter(name_class__in=[cls.scientific_name_class] + cls.name_classes),
+            to_attr='prefetched_names'
+        )
+
+    def scientific_name(self):
+        if hasattr(self, 'prefetched_names'):
+            return next((name.name for name in self.prefetched_names
+                         if name.name_class == self.scientific_name_class), None)
+        return TaxonomyName.objects.filter(
+            taxon_id=self, name_class=self.scientific_name_class).values_list('name', flat=True).first()
+
     def names(self):
-        name_classes = [
-            'common name',
-            'equivalent name',
-            'genbank common name',
-            'genbank synonym',
-            'synonym'
-        ]
-        return TaxonomyName.objects.filter(taxon_id=self, name_class__in=name_classes)
+        if hasattr(self, 'prefetched_names'):
+            return [name for name in self.prefetched_names if name.name_class in self.name_classes]
+        return TaxonomyName.objects.filter(taxon_id=self, name_class__in=self.name_classes)
 
 
 class TaxonomyName(models.Model):
@@ -0,0 +1,303 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from ensembl.production.ncbi_taxonomy.api.utils import TaxonomyUtils
+from ensembl.production.ncbi_taxonomy.index import TaxonomyIndex, TaxonomyNameIndex
+from ensembl.production.ncbi_taxonomy.models import TaxonomyName, TaxonomyNode
+
+
+class TaxonomyNodeTestCase(APITestCase):
+    fixtures = ['ncbi_taxonomy.json']
+    databases = ['ncbi_taxonomy']
+
+    def test_taxonomy_list_query_count(self):
+        # count + nodes + names of the page
+        for limit in (10, 100):
+            with self.assertNumQueries(3, using='ncbi_taxonomy'):
+                response = self.client.get(reverse('taxonomy-list'), {'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), limit)
+        for taxon in response.data['results']:
+            node = TaxonomyNode.objects.get(taxon_id=taxon['taxon_id'])
+            self.assertEqual(taxon['scientific_name'], node.scientific_name())
+            self.assertEqual(sorted(name['name'] for name in taxon['names']),
+                             sorted(name.name for name in node.names()))
+
+    def test_taxonomy_detail(self):
+        with self.assertNumQueries(2, using='ncbi_taxonomy'):
+            response = self.client.get(reverse('taxonomy-detail', args=[9615]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['scientific_name'], 'Canis lupus familiaris')
+        self.assertTrue(all(name['name_class'] in TaxonomyNode.name_classes for name in response.data['names']))
+
+
+class TaxonomyIndexTestCase(TestCase):
+    fixtures = ['ncbi_taxonomy.json']
+    databases = ['ncbi_taxonomy']
+
+    def setUp(self):
+        TaxonomyIndex.clear()
+
+    def tearDown(self):
+        TaxonomyIndex.clear()
+
+    def test_descendants(self):
+        index = TaxonomyIndex.get()
+        self.assertEqual(len(index), 125)
+        for taxon_id in (1, 7742, 9608, 9615):
+            self.assertEqual(sorted(index.descendants(taxon_id)),
+                             sorted(TaxonomyUtils.fetch_descendent_ids_sql([taxon_id])))
+        with self.assertNumQueries(0, using='ncbi_taxonomy'):
+            self.assertEqual(len(TaxonomyUtils.fetch_descendent_ids('7742, 9608')), 60)
+        self.assertRaises(KeyError, index.descendants, 123456789)
+
+    def test_ancestors(self):
+        ancestors = TaxonomyUtils.fetch_ancestor_ids(9615)
+        self.assertEqual(ancestors[:4], [9612, 9611, 9608, 379584])
+        self.assertEqual(ancestors[-1], 1)
+        with self.settings(TAXONOMY_INDEX=False):
+            self.assertEqual(TaxonomyUtils.fetch_ancestor_ids(9615), ancestors)
+        self.assertTrue(TaxonomyUtils.is_descendant(9615, 7742))
+        self.assertTrue(TaxonomyUtils.is_descendant(7742, 7742))
+        self.assertFalse(TaxonomyUtils.is_descendant(7742, 9615))
+
+    def test_fallback(self):
+        # node added after the index was loaded
+        TaxonomyIndex.get()
+        TaxonomyNode.objects.create(taxon_id=123456789, parent_id=9615, rank='no rank', genbank_hidden_flag=0,
+                                    left_index=4000000, right_index=4000000, root_id=1)
+        self.assertEqual(TaxonomyUtils.fetch_descendent_ids([123456789]), [123456789])
+        with self.settings(TAXONOMY_INDEX=False):
+            self.assertEqual(len(TaxonomyUtils.fetch_descendent_ids('7742')), 60)
+
+    def test_snapshot(self):
+        index = TaxonomyIndex.get()
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'taxonomy.bin')
+            out = StringIO()
+            call_command('taxonomy_snapshot', path, stdout=out)
+            self.assertIn('Loaded 125 nodes', out.getvalue())
+            with self.settings(TAXONOMY_SNAPSHOT=path):
+                TaxonomyIndex.clear()
+                with self.assertNumQueries(0, using='ncbi_taxonomy'):
+                    mapped = TaxonomyIndex.get()
+            self.assertIsNotNone(mapped.mapped)
+            self.assertEqual(len(mapped), len(index))
+            for taxon_id in (1, 7742, 9608, 9615, 9823):
+                self.assertEqual(mapped.descendants(taxon_id), index.descendants(taxon_id))
+                self.assertEqual(mapped.ancestors(taxon_id), index.ancestors(taxon_id))
+                self.assertEqual(mapped.rank(taxon_id), index.rank(taxon_id))
+                self.assertEqual(mapped.scientific_name(taxon_id), index.scientific_name(taxon_id))
+            self.assertEqual(mapped.scientific_name(9615), 'Canis lupus familiaris')
+            self.assertEqual(mapped.lca([9615, 9823]), 314145)
+            self.assertEqual(mapped.rank_ancestors([9615, 9823], 'family'), index.rank_ancestors([9615, 9823], 'family'))
+            del mapped
+            TaxonomyIndex.clear()
+
+    def test_filter_descendents(self):
+        response = self.client.get(reverse('taxonomy-list'), {'taxon_ids': '9608', 'descendents': 1, 'limit': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], len(TaxonomyIndex.get().descendants(9608)))
+        response = self.client.get(reverse('taxonomy-list'), {'taxon_ids': '9608) OR (1=1', 'descendents': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TaxonomyLineageTestCase(APITestCase):
+    fixtures = ['ncbi_taxonomy.json']
+    databases = ['ncbi_taxonomy']
+
+    def setUp(self):
+        TaxonomyIndex.clear()
+
+    def tearDown(self):
+        TaxonomyIndex.clear()
+
+    def test_lineage(self):
+        taxon_ids = list(TaxonomyNode.objects.values_list('taxon_id', flat=True))
+        for index_enabled in (True, False):
+            with self.settings(TAXONOMY_INDEX=index_enabled):
+                TaxonomyIndex.get()
+                # ancestors (of taxon 0 only, not found in the index), + nodes + scientific names without the index
+                with self.assertNumQueries(1 if index_enabled else 3, using='ncbi_taxonomy'):
+                    response = self.client.post(reverse('taxonomy-lineage'), {'taxon_ids': taxon_ids + [0]},
+                                                format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.data['not_found'], [0])
+                self.assertEqual(len(response.data['results']), len(taxon_ids))
+                dog = next(result for result in response.data['results'] if result['taxon_id'] == 9615)
+                self.assertEqual(dog['scientific_name'], 'Canis lupus familiaris')
+                self.assertEqual([taxon['taxon_id'] for taxon in dog['lineage']],
+                                 TaxonomyUtils.fetch_ancestor_ids(9615)[::-1])
+                self.assertEqual(dog['lineage'][0], {'taxon_id': 1, 'rank': 'no rank', 'scientific_name': 'root'})
+                self.assertEqual(dog['lineage'][-1]['rank'], 'species')
+
+    def test_lineage_invalid(self):
+        response = self.client.post(reverse('taxonomy-lineage'), {'taxon_ids': ['dog']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lca(self):
+        for index_enabled in (True, False):
+            with self.settings(TAXONOMY_INDEX=index_enabled):
+                response = self.client.post(reverse('taxonomy-lca'), {'taxon_ids': [9615, 9823, 0]}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.data['lca']['scientific_name'], 'Laurasiatheria')
+                self.assertEqual(response.data['not_found'], [0])
+                response = self.client.post(reverse('taxonomy-lca'), {'taxon_ids': [9615, 9612]}, format='json')
+                self.assertEqual(response.data['lca']['taxon_id'], 9612)
+        all_taxa = list(TaxonomyNode.objects.values_list('taxon_id', flat=True))
+        self.assertEqual(TaxonomyUtils.fetch_lca(all_taxa), 1)
+
+    def test_subtree(self):
+        response = self.client.post(reverse('taxonomy-subtree'), {'taxon_ids': [9615, 9823]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tree = response.data['tree']
+        self.assertEqual(tree['taxon_id'], 314145)
+        self.assertEqual(len(tree['children']), 2)
+        self.assertTrue(response.data['newick'].endswith('Laurasiatheria;'))
+        self.assertIn("'Sus scrofa'", response.data['newick'])
+        response = self.client.post(reverse('taxonomy-subtree') + '?format=newick',
+                                    {'taxon_ids': [9615, 9823, 9612], 'collapse': True, 'label': 'taxon_id'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content.decode(), '((9615)9612,9823)314145;\n')
+
+    def test_rank(self):
+        taxon_ids = list(TaxonomyNode.objects.values_list('taxon_id', flat=True))
+        for rank in ('genus', 'family', 'order', 'clade', 'no rank', 'unknown'):
+            ancestors = TaxonomyUtils.fetch_rank_ancestors(taxon_ids, rank)
+            with self.settings(TAXONOMY_INDEX=False):
+                self.assertEqual(TaxonomyUtils.fetch_rank_ancestors(taxon_ids, rank), ancestors)
+            for taxon_id, ancestor_id in ancestors.items():
+                expected = [node for node in [taxon_id] + TaxonomyUtils.fetch_ancestor_ids(taxon_id)
+                            if TaxonomyNode.objects.get(taxon_id=node).rank == rank]
+                self.assertEqual(ancestor_id, expected[0] if expected else None)
+        response = self.client.post(reverse('taxonomy-rank'), {'taxon_ids': [9615, 9823, 1, 0], 'rank': 'family'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(result['taxon_id'], result['ancestor'] and result['ancestor']['scientific_name'])
+                          for result in response.data['results']], [(9615, 'Canidae'), (9823, 'Suidae'), (1, None)])
+        self.assertEqual(response.data['not_found'], [0])
+
+
+class LoadTaxdumpTestCase(TestCase):
+    fixtures = ['ncbi_taxonomy.json']
+    databases = ['ncbi_taxonomy']
+
+    def test_load_taxdump(self):
+        nodes = list(TaxonomyNode.objects.order_by('taxon_id'))
+        names = list(TaxonomyName.objects.exclude(name_class='merged_taxon_id').order_by('name_id'))
+        descendants = {node.taxon_id: set(TaxonomyUtils.fetch_descendent_ids_sql([node.taxon_id])) for node in nodes}
+        with tempfile.TemporaryDirectory() as taxdump_dir:
+            with open(os.path.join(taxdump_dir, 'nodes.dmp'), 'w') as dmp:
+                for node in nodes:
+                    dmp.write('\t|\t'.join(map(str, [node.taxon_id, node.parent_id or node.taxon_id, node.rank, 'XX',
+                                                     0, 0, 1, 0, 0, 0, node.genbank_hidden_flag, 0, ''])) + '\t|\n')
+            with open(os.path.join(taxdump_dir, 'names.dmp'), 'w') as dmp:
+                for name in names:
+                    dmp.write('\t|\t'.join([str(name.taxon_id), name.name, '', name.name_class]) + '\t|\n')
+            with open(os.path.join(taxdump_dir, 'merged.dmp'), 'w') as dmp:
+                dmp.write('4478\t|\t38820\t|\n')
+            out = StringIO()
+            call_command('load_taxdump', taxdump_dir, batch_size=50, stdout=out)
+        self.assertIn('Inserted 125 nodes', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(TaxonomyNode.objects.count(), 125)
+        self.assertEqual(TaxonomyName.objects.count(), len(names) + 1)
+        root = TaxonomyNode.objects.get(taxon_id=1)
+        self.assertEqual((root.parent_id, root.left_index, root.right_index), (None, 1, 250))
+        for node in TaxonomyNode.objects.all():
+            self.assertEqual(set(TaxonomyUtils.fetch_descendent_ids_sql([node.taxon_id])), descendants[node.taxon_id])
+            self.assertEqual(node.root_id, 1)
+        self.assertEqual(TaxonomyName.objects.get(name_class='merged_taxon_id').taxon_id, 38820)
+
+
+class TaxonomyNameSearchTestCase(APITestCase):
+    fixtures = ['ncbi_taxonomy.json']
+    databases = ['default', 'ncbi_taxonomy']
+
+    def setUp(self):
+        TaxonomyNameIndex.clear()
+
+    def tearDown(self):
+        TaxonomyNameIndex.clear()
+
+    def search(self, **params):
+        response = self.client.get(reverse('taxonomy-name-search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(name['taxon_id'], name['name_class'], name['name']) for name in response.data]
+
+    def test_search(self):
+        self.assertEqual(len(TaxonomyNameIndex.get()), TaxonomyName.objects.exclude(
+            name_class__in=TaxonomyNameIndex.excluded).count())
+        names = self.search(q='canis', limit=100)
+        self.assertEqual(names[0], (9611, 'scientific name', 'Canis'))
+        self.assertTrue(all(name.lower().startswith('canis') for _, _, name in names))
+        self.assertEqual([name_class for _, name_class, _ in names],
+                         sorted((name_class for _, name_class, _ in names), key=lambda name_class: (
+                             TaxonomyNameIndex.ranking.index(name_class), name_class)))
+        self.assertEqual(len(self.search(q='canis', limit=2)), 2)
+        self.assertEqual(self.search(q='  DOG ', match='iexact'), [(9615, 'genbank common name', 'dog')])
+        self.assertEqual(self.search(q='DOG', match='exact'), [])
+        self.assertEqual(self.search(q='dog', match='exact'), [(9615, 'genbank common name', 'dog')])
+        with self.settings(TAXONOMY_INDEX=False):
+            self.assertEqual(sorted(self.search(q='canis', limit=100)), sorted(names))
+            self.assertEqual(self.search(q='DOG', match='iexact'), [(9615, 'genbank common name', 'dog')])
+
+    def test_search_invalid(self):
+        response = self.client.get(reverse('taxonomy-name-search'), {'q': 'canis', 'match': 'regex'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild(self):
+        response = self.client.post(reverse('taxonomy-index-rebuild'))
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        User.objects.create_superuser(username='admin', password='admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(reverse('taxonomy-index-rebuild'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['TaxonomyIndex'], 125)
+        # from the database, not from an outdated snapshot
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = os.path.join(directory, 'taxonomy.bin')
+            TaxonomyIndex.from_database().write_snapshot(snapshot)
+            TaxonomyNode.objects.create(taxon_id=9606, parent_id=314146, rank='species', genbank_hidden_flag=0,
+                                        left_index=4517814, right_index=4517815, root_id=1)
+            with self.settings(TAXONOMY_SNAPSHOT=snapshot):
+                response = self.client.post(reverse('taxonomy-index-rebuild'))
+                self.assertEqual(response.data['TaxonomyIndex'], 126)
+                self.assertIsNotNone(TaxonomyIndex.get().mapped)
+                self.assertEqual(len(TaxonomyIndex.load()), 126)
+        TaxonomyIndex.clear()
+
+    def test_resolve(self):
+        names = ['Canis lupus familiaris', ' canis  LUPUS familiaris', 'pigs', 'Homo nonexistens']
+        # not a name of the taxon
+        TaxonomyName.objects.create(taxon_id=9823, name='Canis lupus familiaris', name_class='in-part')
+        TaxonomyNameIndex.get()
+        with self.assertNumQueries(1, using='ncbi_taxonomy'):
+            response = self.client.post(reverse('taxonomy-resolve'), {'names': names}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['name'] for result in results], [name.strip() for name in names])
+        self.assertEqual(results[0]['taxon_ids'], [9615, 9823])
+        self.assertEqual(results[1]['taxon_ids'], [9615, 9823])
+        self.assertFalse(results[0]['ambiguous'])
+        self.assertEqual(results[0]['matches'][-1]['name_class'], 'in-part')
+        self.assertEqual(results[0]['matches'][0]['name_class'], 'scientific name')
+        self.assertEqual(results[2]['taxon_ids'], [9821, 9823])
+        self.assertTrue(results[2]['ambiguous'])
+        self.assertEqual(results[3]['taxon_ids'], [])
+        with self.settings(TAXONOMY_INDEX=False):
+            # case insensitivity is left to the database collation
+            with self.assertNumQueries(1, using='ncbi_taxonomy'):
+                response = self.client.post(reverse('taxonomy-resolve'), {'names': names}, format='json')
+            self.assertEqual([result['taxon_ids'] for result in response.data['results']][::2],
+                             [[9615, 9823], [9821, 9823]])
+            self.assertEqual([result['ambiguous'] for result in response.data['results']][::2], [False, True])
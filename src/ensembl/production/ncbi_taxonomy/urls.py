@@ -2,7 +2,14 @@ from django.urls import path, re_path
 from ensembl.production.ncbi_taxonomy import views
 
 urlpatterns = [
-    re_path(r'^(?P<taxon_id>[0-9]+)/$', views.TaxonomyNodeDetail.as_view()),
-    path('', views.TaxonomyNodeList.as_view()),
-    path('names/', views.TaxonomyNameList.as_view())
+    re_path(r'^(?P<taxon_id>[0-9]+)/$', views.TaxonomyNodeDetail.as_view(), name='taxonomy-detail'),
+    path('', views.TaxonomyNodeList.as_view(), name='taxonomy-list'),
+    path('names/', views.TaxonomyNameList.as_view(), name='taxonomy-names'),
+    path('names/search/', views.TaxonomyNameSearch.as_view(), name='taxonomy-name-search'),
+    path('index/rebuild/', views.TaxonomyIndexRebuild.as_view(), name='taxonomy-index-rebuild'),
+    path('lineage/', views.TaxonomyLineage.as_view(), name='taxonomy-lineage'),
+    path('resolve/', views.TaxonomyResolve.as_view(), name='taxonomy-resolve'),
+    path('lca/', views.TaxonomyLCA.as_view(), name='taxonomy-lca'),
+    path('rank/', views.TaxonomyRank.as_view(), name='taxonomy-rank'),
+    path('subtree/', views.TaxonomySubtree.as_view(), name='taxonomy-subtree')
 ]
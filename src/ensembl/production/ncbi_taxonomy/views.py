@@ -1,8 +1,20 @@
 from django_filters.rest_framework import DjangoFilterBackend
+from drf_spectacular.utils import extend_schema
 from rest_framework import generics
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from ensembl.production.ncbi_taxonomy.api.pagination import OffsetOrCursorPagination
 from ensembl.production.ncbi_taxonomy.models import TaxonomyName, TaxonomyNode
-from ensembl.production.ncbi_taxonomy.api.serializers import TaxonomyNameSerializer, TaxonomyNodeSerializer
+from ensembl.production.ncbi_taxonomy.api.serializers import TaxonomyNameSerializer, TaxonomyNodeSerializer, \
+    TaxonomyIdsSerializer, TaxonomyLineageResultSerializer, TaxonomyLCAResultSerializer, \
+    TaxonomySubtreeRequestSerializer, TaxonomySubtreeResultSerializer, TaxonomyNameSearchSerializer, \
+    TaxonomyNamesSerializer, TaxonomyResolveResultSerializer, TaxonomyRankRequestSerializer, \
+    TaxonomyRankResultSerializer
+from ensembl.production.ncbi_taxonomy.api.renderers import NewickRenderer, to_newick
 from ensembl.production.ncbi_taxonomy.api.filters import TaxonomyFilterBackend
+from ensembl.production.ncbi_taxonomy.api.utils import TaxonomyUtils
+from ensembl.production.ncbi_taxonomy.index import TaxonomyIndex, TaxonomyNameIndex
 
 
 class TaxonomyNodeList(generics.ListAPIView):
@@ -14,6 +26,11 @@ class TaxonomyNodeList(generics.ListAPIView):
     queryset = TaxonomyNode.objects.all()
     serializer_class = TaxonomyNodeSerializer
     filter_backends = [TaxonomyFilterBackend]
+    pagination_class = OffsetOrCursorPagination
+    cursor_ordering = 'taxon_id'
+
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(super().get_queryset())
 
 
 class TaxonomyNodeDetail(generics.RetrieveAPIView):
@@ -26,6 +43,9 @@ class TaxonomyNodeDetail(generics.RetrieveAPIView):
     serializer_class = TaxonomyNodeSerializer
     lookup_field = 'taxon_id'
 
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(super().get_queryset())
+
 
 class TaxonomyNameList(generics.ListAPIView):
     """
@@ -37,3 +57,171 @@ class TaxonomyNameList(generics.ListAPIView):
     serializer_class = TaxonomyNameSerializer
     filter_backends = [DjangoFilterBackend, TaxonomyFilterBackend]
     filterset_fields = ['name_class']
+    pagination_class = OffsetOrCursorPagination
+    cursor_ordering = 'name_id'
+
+
+class TaxonomyLineage(generics.GenericAPIView):
+    """
+    Return the lineage of each taxon, from the root down to its parent, with ranks and scientific names.
+    """
+    name = 'Taxonomy Lineage'
+
+    queryset = TaxonomyNode.objects.all()
+    serializer_class = TaxonomyIdsSerializer
+    permission_classes = [AllowAny]
+
+    @extend_schema(responses=TaxonomyLineageResultSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        taxon_ids = list(dict.fromkeys(serializer.validated_data['taxon_ids']))
+        lineages = TaxonomyUtils.fetch_lineages(taxon_ids)
+        summaries = TaxonomyUtils.fetch_summaries(set(lineages).union(*lineages.values()))
+        results = [dict(summaries[taxon_id], lineage=[summaries[ancestor_id] for ancestor_id in lineages[taxon_id]
+                                                      if ancestor_id in summaries])
+                   for taxon_id in taxon_ids if taxon_id in summaries]
+        return Response(TaxonomyLineageResultSerializer({
+            'results': results,
+            'not_found': [taxon_id for taxon_id in taxon_ids if taxon_id not in summaries],
+        }).data)
+
+
+class TaxonomyLCA(generics.GenericAPIView):
+    """
+    Return the lowest common ancestor of a list of taxa.
+    """
+    name = 'Taxonomy LCA'
+
+    queryset = TaxonomyNode.objects.all()
+    serializer_class = TaxonomyIdsSerializer
+    permission_classes = [AllowAny]
+
+    @extend_schema(responses=TaxonomyLCAResultSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        taxon_ids = list(dict.fromkeys(serializer.validated_data['taxon_ids']))
+        lca = TaxonomyUtils.fetch_lca(taxon_ids)
+        summaries = TaxonomyUtils.fetch_summaries(taxon_ids + ([lca] if lca else []))
+        return Response(TaxonomyLCAResultSerializer({
+            'lca': summaries.get(lca),
+            'not_found': [taxon_id for taxon_id in taxon_ids if taxon_id not in summaries],
+        }).data)
+
+
+class TaxonomySubtree(generics.GenericAPIView):
+    """
+    Return the taxonomy subtree connecting a list of taxa, from their lowest common ancestor, as nested JSON and
+    Newick (`?format=newick` for the Newick text only).
+    """
+    name = 'Taxonomy Subtree'
+
+    queryset = TaxonomyNode.objects.all()
+    serializer_class = TaxonomySubtreeRequestSerializer
+    permission_classes = [AllowAny]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NewickRenderer]
+
+    @extend_schema(responses=TaxonomySubtreeResultSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        taxon_ids = list(dict.fromkeys(serializer.validated_data['taxon_ids']))
+        tree = TaxonomyUtils.fetch_subtree(taxon_ids, collapse=serializer.validated_data['collapse'])
+        found = set()
+        nodes = [tree] if tree else []
+        while nodes:
+            node = nodes.pop()
+            found.add(node['taxon_id'])
+            nodes.extend(node['children'])
+        return Response({
+            'tree': tree,
+            'newick': to_newick(tree, serializer.validated_data['label']) if tree else None,
+            'not_found': [taxon_id for taxon_id in taxon_ids if taxon_id not in found],
+        })
+
+
+class TaxonomyNameSearch(generics.GenericAPIView):
+    """
+    Search taxon names, by prefix for autocompletion or by exact match, across all the name classes. Scientific
+    names come first.
+    """
+    name = 'Taxonomy Name Search'
+
+    queryset = TaxonomyName.objects.all()
+    serializer_class = TaxonomyNameSerializer
+
+    @extend_schema(parameters=[TaxonomyNameSearchSerializer])
+    def get(self, request, *args, **kwargs):
+        params = TaxonomyNameSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        names = TaxonomyUtils.search_names(params.validated_data['q'], match=params.validated_data['match'],
+                                           limit=params.validated_data['limit'])
+        return Response(self.get_serializer(names, many=True).data)
+
+
+class TaxonomyIndexRebuild(generics.GenericAPIView):
+    """
+    Reload the in memory taxonomy indexes of the server process handling the request from the database, and rewrite
+    the TAXONOMY_SNAPSHOT file if set. The other server processes keep their indexes until they are restarted (e.g.
+    `kill -HUP` of the gunicorn master).
+    """
+    name = 'Taxonomy Index Rebuild'
+
+    queryset = TaxonomyNode.objects.all()
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        return Response({index.__name__: len(index.rebuild()) for index in (TaxonomyIndex, TaxonomyNameIndex)})
+
+
+class TaxonomyResolve(generics.GenericAPIView):
+    """
+    Resolve a list of names (scientific names, synonyms, common names...) to taxon ids, ignoring case and
+    whitespace. A name is ambiguous when it identifies more than one taxon: matches of names which do not identify
+    a taxon (in-part, includes, authority, blast name...) are listed but not counted.
+    """
+    name = 'Taxonomy Resolve'
+
+    queryset = TaxonomyName.objects.all()
+    serializer_class = TaxonomyNamesSerializer
+    permission_classes = [AllowAny]
+
+    @extend_schema(responses=TaxonomyResolveResultSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        names = serializer.validated_data['names']
+        resolved = TaxonomyUtils.resolve_names(set(names))
+        results = []
+        identifying = {TaxonomyNode.scientific_name_class, *TaxonomyNode.name_classes}
+        for name in names:
+            taxon_ids = list(dict.fromkeys(match.taxon_id for match in resolved[name]))
+            identified = {match.taxon_id for match in resolved[name] if match.name_class in identifying}
+            results.append({'name': name, 'taxon_ids': taxon_ids, 'ambiguous': len(identified) > 1,
+                            'matches': resolved[name]})
+        return Response(TaxonomyResolveResultSerializer({'results': results}).data)
+
+
+class TaxonomyRank(generics.GenericAPIView):
+    """
+    Return the ancestor at a given rank (e.g. the genus or the family) of each taxon, null if it has none.
+    """
+    name = 'Taxonomy Rank'
+
+    queryset = TaxonomyNode.objects.all()
+    serializer_class = TaxonomyRankRequestSerializer
+    permission_classes = [AllowAny]
+
+    @extend_schema(responses=TaxonomyRankResultSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        taxon_ids = list(dict.fromkeys(serializer.validated_data['taxon_ids']))
+        ancestors = TaxonomyUtils.fetch_rank_ancestors(taxon_ids, serializer.validated_data['rank'])
+        summaries = TaxonomyUtils.fetch_summaries({ancestor_id for ancestor_id in ancestors.values() if ancestor_id})
+        return Response(TaxonomyRankResultSerializer({
+            'results': [{'taxon_id': taxon_id, 'ancestor': summaries.get(ancestors[taxon_id])}
+                        for taxon_id in taxon_ids if taxon_id in ancestors],
+            'not_found': [taxon_id for taxon_id in taxon_ids if taxon_id not in ancestors],
+        }).data)
@@ -66,6 +66,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ensembl.production.metadata.admin.middleware.ReleaseLockCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'metadata_admin.urls'
@@ -94,6 +95,23 @@ DATABASES = {
         'PORT': os.getenv("DATABASE_PORT", 3306),
     }
 }
+
+# API responses cache, e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# CACHE_LOCATION=/var/tmp/metadata_admin_cache for a cache shared by all the server processes
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", "metadata_admin"),
+    }
+}
+METADATA_API_CACHE = 'default'
+# Seconds unreleased genomes and datasets are cached, released ones are kept until invalidated
+METADATA_API_CACHE_TTL = int(os.getenv("METADATA_API_CACHE_TTL", 60))
+# Answer taxonomy descendants / ancestors queries from an in memory copy of ncbi_taxa_node loaded once per process
+TAXONOMY_INDEX = True
+# Taxonomy index file written by `manage.py taxonomy_snapshot`, memory mapped instead of reading the database
+TAXONOMY_SNAPSHOT = os.getenv("TAXONOMY_SNAPSHOT")
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
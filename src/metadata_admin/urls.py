@@ -17,6 +17,7 @@ from drf_spectacular.views import SpectacularSwaggerView
 
 urlpatterns = [
     path('api/metadata/', include('ensembl.production.metadata.admin.api.urls')),
+    path('api/taxonomy/', include('ensembl.production.ncbi_taxonomy.urls')),
     path('', admin.site.urls),
     path(
         'api/docs/',